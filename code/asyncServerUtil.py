@@ -0,0 +1,294 @@
+import os
+import socket
+import asyncio
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Largest request head accepted before the connection is dropped
+MAX_HEAD_SIZE = 64 * 1024
+
+# Response bytes a handler may queue before its thread waits for the socket
+WRITE_HIGH_WATER = 1024 * 1024
+
+RECV_SIZE = 64 * 1024
+
+class ConnectionState:
+    """
+    One client connection owned by the event loop.
+    Handler threads read and write through it, the loop does the socket I/O.
+    """
+
+    def __init__(self, loop, sock):
+        self.loop = loop
+        self.sock = sock
+        self.buffer = bytearray()
+        self.eof = False
+        self.broken = False
+        self.timeout = None
+        self.outbox = asyncio.Queue()
+        self.pending_bytes = 0
+        self.pending_cond = threading.Condition()
+
+    # --- Event loop side ---
+
+    async def fill(self):
+        """Receive more data into the buffer. Returns False on EOF."""
+        data = await self.loop.sock_recv(self.sock, RECV_SIZE)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+    async def wait_for_head(self, idle_timeout):
+        """Wait until a complete request head is buffered. Returns False if the client went away."""
+        while b"\r\n\r\n" not in self.buffer:
+            if self.eof or len(self.buffer) > MAX_HEAD_SIZE:
+                return False
+            try:
+                if not await asyncio.wait_for(self.fill(), idle_timeout):
+                    return bool(self.buffer.strip())
+            except (asyncio.TimeoutError, OSError):
+                return False
+        return True
+
+    async def pump(self):
+        """Send queued response items to the client in order until the end marker."""
+        while True:
+            item = await self.outbox.get()
+            if item is None:
+                return
+            try:
+                if isinstance(item, bytes):
+                    if not self.broken:
+                        await self.loop.sock_sendall(self.sock, item)
+                else:
+                    f, offset, count = item
+                    try:
+                        if not self.broken:
+                            await self.loop.sock_sendfile(self.sock, f, offset, count)
+                    finally:
+                        f.close()
+            except OSError:
+                self.broken = True
+            finally:
+                if isinstance(item, bytes):
+                    self.release(len(item))
+
+    def release(self, size):
+        with self.pending_cond:
+            self.pending_bytes -= size
+            self.pending_cond.notify_all()
+
+    # --- Handler thread side ---
+
+    def call(self, coro):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise socket.timeout("timed out")
+
+    def enqueue(self, item, size=0):
+        if self.broken:
+            raise BrokenPipeError("Client disconnected")
+        with self.pending_cond:
+            self.pending_bytes += size
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, item)
+        with self.pending_cond:
+            # Backpressure: do not let a fast producer buffer the whole response
+            if not self.pending_cond.wait_for(lambda: self.pending_bytes <= WRITE_HIGH_WATER or self.broken,
+                                              self.timeout):
+                raise socket.timeout("timed out")
+
+class BridgeReader:
+    """Blocking rfile for handler threads, reading from a loop-owned connection."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def _take(self, size):
+        data = bytes(self.state.buffer[:size])
+        del self.state.buffer[:size]
+        return data
+
+    def readline(self, limit=-1):
+        state = self.state
+        scanned = 0
+        while True:
+            end = state.buffer.find(b"\n", scanned)
+            if end >= 0 and (limit < 0 or end < limit):
+                return self._take(end + 1)
+            if 0 <= limit <= len(state.buffer):
+                return self._take(limit)
+            scanned = len(state.buffer)
+            if state.eof or not state.call(state.fill()):
+                return self._take(len(state.buffer))
+
+    def read(self, size=-1):
+        state = self.state
+        while size < 0 or len(state.buffer) < size:
+            if state.eof or not state.call(state.fill()):
+                break
+        return self._take(len(state.buffer) if size < 0 else size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
+
+class BridgeWriter:
+    """Blocking wfile for handler threads; bytes and file ranges are sent by the event loop."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def write(self, data):
+        data = bytes(data)
+        if data:
+            self.state.enqueue(data, len(data))
+        return len(data)
+
+    def sendfile(self, f, offset, count):
+        """Hand a file range to the event loop; the thread does not wait for the transfer."""
+        duplicate = open(os.dup(f.fileno()), "rb")
+        self.state.enqueue((duplicate, offset, count))
+        return count
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class BridgeConnection:
+    """Stands in for the socket a handler expects; records its timeout for bridged reads."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def settimeout(self, timeout):
+        self.state.timeout = timeout
+
+    def gettimeout(self):
+        return self.state.timeout
+
+class AsyncHTTPServer:
+    """
+    asyncio server core: the event loop owns every socket, so idle keep-alive
+    connections and slow downloads cost no thread. Each request is dispatched to
+    the existing request handler on a small executor, and file bodies it sends
+    are streamed by the loop with non-blocking sendfile.
+    """
+
+    def __init__(self, server_address, handler_class, executor_workers=16,
+                 idle_timeout=60, max_connections=10000, reuse_port=False):
+        self.server_address = server_address
+        self.handler_class = handler_class
+        self.executor_workers = executor_workers
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers, thread_name_prefix="http-async")
+        self.open_connections = 0
+        self.active_requests = 0
+        self.served = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind(server_address)
+        self.socket.listen(1024)
+        self.socket.setblocking(False)
+        self.server_address = self.socket.getsockname()
+        self.server_name = socket.getfqdn(self.server_address[0])
+        self.server_port = self.server_address[1]
+        self.loop = None
+
+    def stats(self):
+        return {
+            "mode": "async",
+            "executor_workers": self.executor_workers,
+            "open_connections": self.open_connections,
+            "active_requests": self.active_requests,
+            "served": self.served,
+        }
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_connections)
+        while True:
+            await slots.acquire()
+            try:
+                sock, client_address = await self.loop.sock_accept(self.socket)
+            except OSError:
+                slots.release()
+                continue
+            sock.setblocking(False)
+            task = self.loop.create_task(self.handle_connection(sock, client_address))
+            task.add_done_callback(lambda _: slots.release())
+
+    async def handle_connection(self, sock, client_address):
+        self.open_connections += 1
+        state = ConnectionState(self.loop, sock)
+        handler = self.make_handler(state, client_address)
+        try:
+            while not handler.close_connection:
+                if not await state.wait_for_head(self.idle_timeout):
+                    break
+
+                pump = self.loop.create_task(state.pump())
+                self.active_requests += 1
+                try:
+                    await self.loop.run_in_executor(self.executor, self.run_request, handler)
+                finally:
+                    self.active_requests -= 1
+                    state.outbox.put_nowait(None)
+                    await pump
+                self.served += 1
+                if state.broken or state.eof:
+                    break
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.open_connections -= 1
+            try:
+                sock.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+            sock.close()
+
+    def make_handler(self, state, client_address):
+        """Build a request handler bound to the bridged connection instead of a socket."""
+        handler = self.handler_class.__new__(self.handler_class)
+        handler.server = self
+        handler.request = None
+        handler.client_address = client_address
+        handler.directory = os.getcwd()
+        handler.connection = BridgeConnection(state)
+        handler.rfile = BridgeReader(state)
+        handler.wfile = BridgeWriter(state)
+        handler.close_connection = False
+        handler.requests_served = 0
+        return handler
+
+    def run_request(self, handler):
+        try:
+            handler.handle_one_request()
+        except (BrokenPipeError, ConnectionResetError):
+            handler.close_connection = True
+        except Exception:
+            handler.close_connection = True
+            traceback.print_exc()
+
+    def serve_forever(self):
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.executor.shutdown(wait=False)
+            self.socket.close()
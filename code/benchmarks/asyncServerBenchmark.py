@@ -0,0 +1,109 @@
+"""
+Compare the threaded, worker-pool and asyncio server modes.
+
+For each mode the benchmark measures:
+  - threads and resident memory with many idle keep-alive connections
+  - threads and resident memory while many slow clients stream a large file
+  - aggregate throughput of concurrent full downloads
+
+Usage: python3 benchmarks/asyncServerBenchmark.py [--idle 500] [--streams 50] [--size-mb 20]
+"""
+import os
+import time
+import shutil
+import argparse
+import threading
+
+from benchUtil import make_nas_tree, start_server, stop_server, process_usage, raw_request, read_response
+
+def idle_connections(port, count):
+    sockets = []
+    for _ in range(count):
+        sock = raw_request(port, "/small.txt")
+        read_response(sock)
+        sockets.append(sock)
+    return sockets
+
+def slow_reader(port, stop):
+    sock = raw_request(port, "/large.bin")
+    try:
+        while not stop.is_set():
+            if not sock.recv(16 * 1024):
+                break
+            time.sleep(0.01)
+    except OSError:
+        pass
+    finally:
+        sock.close()
+
+def full_download(port, results, index):
+    sock = raw_request(port, "/large.bin", headers={"Connection": "close"})
+    try:
+        results[index] = read_response(sock)[1]
+    except OSError:
+        results[index] = 0
+    finally:
+        sock.close()
+
+def run_mode(base, mode, args):
+    process, port = start_server(base, mode, args.workers)
+    row = {"mode": mode}
+    try:
+        sockets = idle_connections(port, args.idle)
+        time.sleep(1)
+        usage = process_usage(process.pid)
+        row["idle_threads"], row["idle_rss_mb"] = usage["threads"], usage["rss_kb"] / 1024
+        for sock in sockets:
+            sock.close()
+        time.sleep(0.5)
+
+        stop = threading.Event()
+        readers = [threading.Thread(target=slow_reader, args=(port, stop)) for _ in range(args.streams)]
+        for reader in readers:
+            reader.start()
+        time.sleep(2)
+        usage = process_usage(process.pid)
+        row["slow_threads"], row["slow_rss_mb"] = usage["threads"], usage["rss_kb"] / 1024
+        stop.set()
+        for reader in readers:
+            reader.join()
+
+        results = [0] * args.streams
+        downloads = [threading.Thread(target=full_download, args=(port, results, i)) for i in range(args.streams)]
+        started = time.perf_counter()
+        for download in downloads:
+            download.start()
+        for download in downloads:
+            download.join()
+        elapsed = time.perf_counter() - started
+        row["throughput_mb_s"] = sum(results) / elapsed / (1024 * 1024)
+    finally:
+        stop_server(process)
+    return row
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--idle", type=int, default=500, help="idle keep-alive connections")
+    parser.add_argument("--streams", type=int, default=50, help="concurrent slow readers / downloads")
+    parser.add_argument("--size-mb", type=int, default=20, help="size of the streamed file")
+    parser.add_argument("--workers", type=int, default=32, help="worker threads for pool and async modes")
+    parser.add_argument("--modes", default="threaded,pool,async")
+    args = parser.parse_args()
+
+    base, profile_dir = make_nas_tree()
+    try:
+        with open(os.path.join(profile_dir, "small.txt"), "w") as f:
+            f.write("hello\n")
+        with open(os.path.join(profile_dir, "large.bin"), "wb") as f:
+            f.write(os.urandom(args.size_mb * 1024 * 1024))
+
+        print(f"{'mode':<10}{'idle thr':>10}{'idle MB':>10}{'slow thr':>10}{'slow MB':>10}{'MB/s':>10}")
+        for mode in args.modes.split(","):
+            row = run_mode(base, mode, args)
+            print(f"{row['mode']:<10}{row['idle_threads']:>10}{row['idle_rss_mb']:>10.1f}"
+                  f"{row['slow_threads']:>10}{row['slow_rss_mb']:>10.1f}{row['throughput_mb_s']:>10.1f}")
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
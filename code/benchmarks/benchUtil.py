@@ -0,0 +1,119 @@
+import os
+import sys
+import json
+import socket
+import tempfile
+import subprocess
+
+CODE_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE = "Bench"
+PUBLIC_PROFILE = "Public_bench"
+
+# Runs server.py's FileHandler in a child process with every path pointed at a scratch tree
+SERVER_BOOTSTRAP = """
+import sys
+sys.path.insert(0, {code!r})
+import server
+server.PROFILE_ROOT = {root!r}
+server.PROFILE_PASSWORDS_FILE = {passwords!r}
+server.CODE_DIRECTORY = {code!r}
+server.TEMP_ZIP_DIRECTORY = {temp!r}
+server.load_profile_passwords()
+server.get_profiles_list()
+mode = {mode!r}
+address = ("127.0.0.1", {port})
+if mode == "async":
+    from asyncServerUtil import AsyncHTTPServer
+    httpd = AsyncHTTPServer(address, server.FileHandler, {workers}, 60, 100000)
+elif mode == "pool":
+    from poolServerUtil import PooledHTTPServer
+    httpd = PooledHTTPServer(address, server.FileHandler, {workers}, {workers} * 2, 2)
+else:
+    httpd = server.ThreadedHTTPServer(address, server.FileHandler)
+print("ready", flush=True)
+httpd.serve_forever()
+"""
+
+def make_nas_tree():
+    """Create a scratch NAS layout with a password-less and a public profile. Returns (base, profile_dir)."""
+    base = tempfile.mkdtemp(prefix="nas-bench-")
+    profile_dir = os.path.join(base, "profiles", PROFILE)
+    os.makedirs(profile_dir)
+    os.makedirs(os.path.join(base, "profiles", PUBLIC_PROFILE))
+    os.makedirs(os.path.join(base, "temp", "zips"))
+    with open(os.path.join(base, "profiles.json"), "w", encoding="utf-8") as f:
+        json.dump({PROFILE: None, PUBLIC_PROFILE: None}, f)
+    return base, profile_dir
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(base, mode, workers=32):
+    """Start server.py's handler in a child process. Returns (process, port)."""
+    port = free_port()
+    code = SERVER_BOOTSTRAP.format(
+        code=CODE_DIRECTORY,
+        root=os.path.join(base, "profiles"),
+        passwords=os.path.join(base, "profiles.json"),
+        temp=os.path.join(base, "temp", "zips"),
+        mode=mode,
+        port=port,
+        workers=workers,
+    )
+    process = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True)
+    process.stdout.readline()
+    return process, port
+
+def stop_server(process):
+    process.terminate()
+    process.wait(timeout=10)
+
+def process_usage(pid):
+    """Resident memory (KB) and thread count of a process, from /proc."""
+    usage = {"rss_kb": None, "threads": None}
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    usage["rss_kb"] = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    usage["threads"] = int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return usage
+
+def raw_request(port, path, method="GET", headers=None, body=b""):
+    """Open a connection and send one request without reading the response."""
+    sock = socket.create_connection(("127.0.0.1", port))
+    lines = [f"{method} {path} HTTP/1.1", "Host: localhost", f"Cookie: profile={PROFILE}"]
+    for name, value in (headers or {}).items():
+        lines.append(f"{name}: {value}")
+    if body:
+        lines.append(f"Content-Length: {len(body)}")
+    sock.sendall(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    return sock
+
+def read_response(sock):
+    """Read one Content-Length framed response. Returns (status, body size)."""
+    f = sock.makefile("rb")
+    status_line = f.readline()
+    if not status_line:
+        return None, 0
+    length = 0
+    while True:
+        line = f.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    received = 0
+    while received < length:
+        chunk = f.read(min(1024 * 1024, length - received))
+        if not chunk:
+            break
+        received += len(chunk)
+    return int(status_line.split()[1]), received
@@ -0,0 +1,122 @@
+"""
+Directory listing cost on a large synthetic folder.
+
+Compares the old per-entry os.stat / getmtime / isfile / isdir listing with the
+os.scandir based scanDirectory, then times requests through the server: the
+folder page (a shell whose cost does not depend on the folder size), and the
+first and a later page of the /list JSON API with a cold and a warm scan cache.
+
+Usage: python3 benchmarks/listingBenchmark.py [--entries 100000] [--page 200] [--repeat 3]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+
+from benchUtil import CODE_DIRECTORY, make_nas_tree, start_server, stop_server, raw_request, read_response
+
+sys.path.insert(0, CODE_DIRECTORY)
+from loadDirectoryUtil import scanDirectory
+
+def legacy_scan(path):
+    """The listing loop as it was before scandir: four or more syscalls per entry."""
+    entries = []
+    for name in sorted(os.listdir(path)):
+        if name.startswith("."):
+            continue
+        full_path = os.path.join(path, name)
+        try:
+            stat = os.stat(full_path)
+            size = stat.st_size
+            last_modified = os.path.getmtime(full_path)
+        except Exception:
+            size = 0
+            last_modified = None
+        entries.append((name, os.path.isdir(full_path), os.path.isfile(full_path), size, last_modified))
+    return entries
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def make_entries(folder, count):
+    os.makedirs(folder)
+    for i in range(count):
+        if i % 50 == 0:
+            os.mkdir(os.path.join(folder, f"album_{i:06d}"))
+        else:
+            with open(os.path.join(folder, f"IMG_{i:06d}.jpg"), "wb") as f:
+                f.write(b"x" * (i % 4096))
+
+def timed_request(port, path, headers=None):
+    started = time.perf_counter()
+    sock = raw_request(port, path, headers=headers)
+    try:
+        status, size = read_response(sock)
+    finally:
+        sock.close()
+    return status, size, time.perf_counter() - started
+
+def next_cursor(port, path):
+    sock = raw_request(port, path)
+    try:
+        f = sock.makefile("rb")
+        length = 0
+        for line in f:
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return json.loads(f.read(length))["next_cursor"]
+    finally:
+        sock.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000, help="entries in the synthetic folder")
+    parser.add_argument("--page", type=int, default=200, help="entries per /list page")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    base, profile_dir = make_nas_tree()
+    folder = os.path.join(profile_dir, "big")
+    try:
+        print(f"Creating {args.entries} entries...")
+        make_entries(folder, args.entries)
+
+        legacy = best_of(args.repeat, legacy_scan, folder)
+        scandir = best_of(args.repeat, scanDirectory, folder)
+        print(f"{'scan (listdir + stat calls)':<32}{legacy * 1000:>10.1f} ms")
+        print(f"{'scan (scanDirectory)':<32}{scandir * 1000:>10.1f} ms  ({legacy / scandir:.1f}x)")
+
+        process, port = start_server(base, "pool", 4)
+        try:
+            times = []
+            for _ in range(args.repeat):
+                status, size, elapsed = timed_request(port, "/big/")
+                times.append(elapsed)
+            print(f"{'GET /big/ (page shell)':<32}{min(times) * 1000:>10.1f} ms  status {status}, {size} bytes")
+
+            for label in ("cold", "warm"):
+                status, size, elapsed = timed_request(port, f"/list?path=/big/&sort=mtime&limit={args.page}")
+                print(f"{'GET /list first page (' + label + ')':<32}{elapsed * 1000:>10.1f} ms  status {status}, {size / 1024:.1f} KB")
+
+            cursor = next_cursor(port, f"/list?path=/big/&sort=mtime&limit={args.page}")
+            if cursor:
+                status, size, elapsed = timed_request(port, f"/list?path=/big/&sort=mtime&limit={args.page}&cursor={cursor}")
+                print(f"{'GET /list next page (warm)':<32}{elapsed * 1000:>10.1f} ms  status {status}")
+        finally:
+            stop_server(process)
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Upload throughput of one large file: a single multipart POST to /upload against a
+parallel upload through /uploads, where fixed-size chunks are PUT on several
+connections at once and written into a preallocated file with os.pwrite.
+
+Usage: python3 benchmarks/uploadBenchmark.py [--size 512] [--chunk 8] [--streams 1 2 4 8] [--checksum]
+"""
+import os
+import time
+import base64
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import http.client
+
+from benchUtil import PROFILE, make_nas_tree, start_server, stop_server
+
+BLOCK_SIZE = 1024 * 1024
+
+def make_source(size):
+    fd, path = tempfile.mkstemp(prefix="upload-bench-", suffix=".bin")
+    with os.fdopen(fd, "wb") as f:
+        block = os.urandom(BLOCK_SIZE)
+        for _ in range(size // BLOCK_SIZE):
+            f.write(block)
+        f.write(block[:size % BLOCK_SIZE])
+    return path
+
+def read_range(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(BLOCK_SIZE, length))
+            if not data:
+                return
+            length -= len(data)
+            yield data
+
+def multipart_upload(port, path, size):
+    boundary = "benchboundary7c3f9a"
+    head = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"multipart.bin\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n").encode("latin-1")
+    tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+
+    def body():
+        yield head
+        yield from read_range(path, 0, size)
+        yield tail
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    connection.request("POST", "/upload?path=/", body=body(), headers={
+        "Cookie": f"profile={PROFILE}",
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(head) + size + len(tail)),
+    })
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+def parallel_upload(port, path, size, chunk_size, streams, checksum):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+    filename = base64.b64encode(f"parallel-{streams}.bin".encode("utf-8")).decode("ascii")
+    connection.request("POST", "/uploads?path=/", headers={
+        "Cookie": f"profile={PROFILE}",
+        "Upload-Length": str(size),
+        "Upload-Chunk-Size": str(chunk_size),
+        "Upload-Metadata": f"filename {filename}",
+    })
+    response = connection.getresponse()
+    response.read()
+    upload_id = response.getheader("Location").rsplit("/", 1)[1]
+
+    pending = list(range(max(1, -(-size // chunk_size))))
+    lock = threading.Lock()
+    failures = []
+
+    def worker():
+        stream = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        while True:
+            with lock:
+                if not pending:
+                    break
+                index = pending.pop(0)
+            start = index * chunk_size
+            length = min(chunk_size, size - start)
+            headers = {"Cookie": f"profile={PROFILE}", "Content-Length": str(length)}
+            if checksum:
+                digest = hashlib.sha256(b"".join(read_range(path, start, length))).digest()
+                headers["Upload-Checksum"] = "sha256 " + base64.b64encode(digest).decode("ascii")
+            stream.request("PUT", f"/uploads/{upload_id}/chunks/{index}", body=read_range(path, start, length), headers=headers)
+            chunk_response = stream.getresponse()
+            chunk_response.read()
+            if chunk_response.status != 204:
+                failures.append((index, chunk_response.status))
+        stream.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if failures:
+        return failures[0][1]
+
+    connection.request("POST", f"/uploads/{upload_id}/finalize", headers={"Cookie": f"profile={PROFILE}"})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status
+
+def report(label, size, elapsed, status):
+    print(f"{label:<34}{elapsed:>8.2f} s {size / elapsed / (1024 * 1024):>10.1f} MB/s  status {status}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=512, help="file size in MB")
+    parser.add_argument("--chunk", type=int, default=8, help="parallel chunk size in MB")
+    parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8], help="parallel connection counts to try")
+    parser.add_argument("--checksum", action="store_true", help="send a SHA-256 Upload-Checksum with every chunk")
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    base, profile_dir = make_nas_tree()
+    source = make_source(size)
+    process, port = start_server(base, "pool", max(args.streams) * 2)
+    try:
+        started = time.perf_counter()
+        status = multipart_upload(port, source, size)
+        report("POST /upload (multipart)", size, time.perf_counter() - started, status)
+        os.remove(os.path.join(profile_dir, "multipart.bin"))
+
+        for streams in args.streams:
+            started = time.perf_counter()
+            status = parallel_upload(port, source, size, args.chunk * 1024 * 1024, streams, args.checksum)
+            report(f"/uploads chunks x{streams}", size, time.perf_counter() - started, status)
+            target = os.path.join(profile_dir, f"parallel-{streams}.bin")
+            if os.path.getsize(target) != size:
+                print(f"  size mismatch: {os.path.getsize(target)} != {size}")
+            os.remove(target)
+    finally:
+        stop_server(process)
+        os.remove(source)
+        shutil.rmtree(base, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Time to build a zip of a mixed folder (text, already-compressed media, many small
+files): zipfile deflating everything on one thread, ZipStreamWriter with the per-file
+compression policy on one thread, and the same archive deflated piece by piece in
+the compression process pool with different process counts.
+
+Usage: python3 benchmarks/zipBenchmark.py [--size 256] [--processes 1 2 4 8] [--policy balanced]
+"""
+import os
+import sys
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallelZipUtil
+from zipUtil import choose_compression
+from zipStreamUtil import ZipStreamWriter, collect_entries
+
+BLOCK_SIZE = 1024 * 1024
+
+def make_folder(size):
+    """A quarter each: one large log, one large "video" (random), 4 KB text files, 64 KB random files."""
+    folder = tempfile.mkdtemp(prefix="zip-bench-")
+    quarter = size // 4
+    line = b"2024-01-01 12:00:00 INFO request served in 12 ms from cache\n"
+    with open(os.path.join(folder, "server.log"), "wb") as f:
+        for _ in range(quarter // BLOCK_SIZE):
+            f.write(line * (BLOCK_SIZE // len(line)))
+    with open(os.path.join(folder, "holiday.mp4"), "wb") as f:
+        for _ in range(quarter // BLOCK_SIZE):
+            f.write(os.urandom(BLOCK_SIZE))
+    os.makedirs(os.path.join(folder, "notes"))
+    for index in range(quarter // 4096):
+        with open(os.path.join(folder, "notes", f"note-{index}.txt"), "wb") as f:
+            f.write((f"note {index}: " + "lorem ipsum dolor sit amet " * 150).encode()[:4096])
+    os.makedirs(os.path.join(folder, "photos"))
+    for index in range(quarter // 65536):
+        with open(os.path.join(folder, "photos", f"IMG_{index:04}.jpg"), "wb") as f:
+            f.write(os.urandom(65536))
+    return folder
+
+def legacy_zip(folder, target):
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED) as zipf:
+        for root, _, files in os.walk(folder):
+            for file in files:
+                path = os.path.join(root, file)
+                zipf.write(path, os.path.relpath(path, folder))
+
+def sequential_zip(folder, target, policy):
+    with open(target, "wb") as f:
+        writer = ZipStreamWriter(f)
+        for path, arcname, stat in collect_entries([folder]):
+            method, level = choose_compression(path, stat.st_size, policy)
+            writer.write_file(path, arcname, method, level or 0, stat=stat)
+        writer.close()
+
+def parallel_zip(folder, target, policy):
+    with open(target, "wb") as f:
+        writer = ZipStreamWriter(f)
+        parallelZipUtil.write_entries_parallel(writer, collect_entries([folder]),
+                                               lambda path, size: choose_compression(path, size, policy))
+        writer.close()
+
+def run(label, build, target, size):
+    started = time.perf_counter()
+    build()
+    elapsed = time.perf_counter() - started
+    with zipfile.ZipFile(target) as zipf:
+        bad = zipf.testzip()
+    print(f"{label:<36}{elapsed:>8.2f} s {size / elapsed / BLOCK_SIZE:>9.1f} MB/s {os.path.getsize(target) / BLOCK_SIZE:>9.1f} MB"
+          + (f"  corrupt entry {bad}" if bad else ""))
+    os.remove(target)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=256, help="folder size in MB")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8], help="pool sizes to try")
+    parser.add_argument("--policy", default="balanced", help="compression policy from zipUtil.COMPRESSION_POLICIES")
+    args = parser.parse_args()
+
+    size = args.size * BLOCK_SIZE
+    folder = make_folder(size)
+    target = os.path.join(tempfile.gettempdir(), "zip-bench.zip")
+    print(f"{os.cpu_count()} CPUs, {args.size} MB folder")
+    try:
+        run("zipfile, deflate everything", lambda: legacy_zip(folder, target), target, size)
+        run(f"ZipStreamWriter, {args.policy}", lambda: sequential_zip(folder, target, args.policy), target, size)
+        for processes in args.processes:
+            parallelZipUtil.configure_zip_processes(processes)
+            parallelZipUtil.compression_pool().submit(int).result()  # start the workers outside the timing
+            run(f"process pool x{processes}, {args.policy}", lambda: parallel_zip(folder, target, args.policy), target, size)
+    finally:
+        parallelZipUtil.configure_zip_processes(None)
+        shutil.rmtree(folder, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
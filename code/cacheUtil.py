@@ -0,0 +1,71 @@
+import hashlib
+import email.utils
+
+# Cache-Control sent per route. Everything revalidates with ETag / Last-Modified,
+# so "no-cache" still lets browsers reuse their copy after a cheap 304.
+CACHE_POLICIES = {
+    "file": "private, no-cache",
+    "static": "public, max-age=3600",
+    "listing": "private, no-cache",
+    "share": "public, no-cache",
+    # Thumbnails requested with the source's mtime in the URL (?v=) never change
+    "thumb": "private, max-age=86400",
+}
+
+def configure_cache_policies(policies):
+    """Override the default Cache-Control value of one or more routes."""
+    CACHE_POLICIES.update(policies)
+
+def file_etag(stat):
+    """Strong validator built from inode, size and modification time."""
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def content_etag(*parts):
+    """Weak validator for generated pages, built from whatever the page depends on."""
+    digest = hashlib.md5("\0".join(str(part) for part in parts).encode("utf-8", "surrogateescape"))
+    return f'W/"{digest.hexdigest()}"'
+
+def http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def _strip_weak(tag):
+    return tag[2:] if tag.startswith("W/") else tag
+
+def is_not_modified(handler, etag, mtime):
+    """Evaluate If-None-Match / If-Modified-Since (RFC 7232) for a GET request."""
+    if_none_match = handler.headers.get("If-None-Match")
+    if if_none_match:
+        # If-None-Match takes precedence and uses weak comparison
+        if if_none_match.strip() == "*":
+            return True
+        current = _strip_weak(etag)
+        return any(_strip_weak(tag.strip()) == current for tag in if_none_match.split(","))
+
+    if_modified_since = handler.headers.get("If-Modified-Since")
+    if if_modified_since and mtime is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return int(mtime) <= since.timestamp()
+    return False
+
+def send_cache_headers(handler, route, etag, mtime):
+    """Emit the validators and Cache-Control policy for a response."""
+    handler.send_header("ETag", etag)
+    if mtime is not None:
+        handler.send_header("Last-Modified", http_date(mtime))
+    policy = CACHE_POLICIES.get(route)
+    if policy:
+        handler.send_header("Cache-Control", policy)
+
+def send_if_not_modified(handler, route, etag, mtime):
+    """Send a 304 and return True when the client's cached copy is still valid."""
+    if not is_not_modified(handler, etag, mtime):
+        return False
+    handler.send_response(304)
+    send_cache_headers(handler, route, etag, mtime)
+    handler.end_headers()
+    return True
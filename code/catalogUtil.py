@@ -0,0 +1,423 @@
+import os
+import time
+import fcntl
+import sqlite3
+import threading
+import traceback
+from urllib.parse import parse_qs
+
+from profileUtil import get_profile_dir
+from responseUtil import send_json, send_text
+from listingUtil import MEDIA_EXTENSIONS
+
+# One SQLite catalog of every file and folder per profile, <profile>.sqlite3
+CATALOG_DIRECTORY = "/nas/storage/temp/catalog"
+
+# Seconds between reconciling scans, which pick up changes made outside the server.
+# Folders whose mtime did not change since their last scan are not read again.
+CATALOG_RECONCILE_INTERVAL = 900
+
+DEFAULT_SEARCH_LIMIT = 200
+
+# A search inside a folder with fewer entries than this below it reads that part of the
+# catalog directly, which beats filtering every match of the whole profile
+SUBTREE_SCAN_LIMIT = 20000
+MAX_SEARCH_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    parent TEXT NOT NULL,
+    name TEXT NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER NOT NULL,
+    scanned_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_parent ON entries (parent);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+
+# Trigram index over the names, kept in step with entries by triggers: any substring of
+# three or more characters is an index lookup. Builds of SQLite without FTS5 (or older
+# than 3.34) fall back to LIKE, which scans.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS names USING fts5(name, content='entries', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO names (rowid, name) VALUES (new.id, new.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_rename AFTER UPDATE OF name ON entries BEGIN
+    INSERT INTO names (names, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO names (rowid, name) VALUES (new.id, new.name);
+END;
+"""
+
+_config = {"directory": CATALOG_DIRECTORY, "profile_root": None, "interval": CATALOG_RECONCILE_INTERVAL}
+_local = {"pid": None, "connections": {}, "fts": {}}
+_lock = threading.RLock()
+_started = {"pid": None}
+
+def configure_catalog(directory, profile_root, interval):
+    _config.update(directory=directory, profile_root=os.path.abspath(profile_root), interval=interval)
+    os.makedirs(directory, exist_ok=True)
+
+def start_catalog():
+    """Start this process's reconciling thread, once per process."""
+    with _lock:
+        if _started["pid"] == os.getpid() or _config["profile_root"] is None:
+            return
+        _started["pid"] = os.getpid()
+    threading.Thread(target=_reconcile_forever, name="catalog-reconcile", daemon=True).start()
+
+def _connection(profile):
+    """This process's connection to a profile's catalog (see preforkUtil.run_prefork)."""
+    if _local["pid"] != os.getpid():
+        _local.update(pid=os.getpid(), connections={}, fts={})
+    connection = _local["connections"].get(profile)
+    if connection is None:
+        connection = sqlite3.connect(os.path.join(_config["directory"], f"{profile}.sqlite3"), timeout=30,
+                                     check_same_thread=False, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            _local["fts"][profile] = True
+        except sqlite3.OperationalError as e:
+            print(f"[Catalog] No trigram index ({e}), searching with LIKE")
+            _local["fts"][profile] = False
+        _local["connections"][profile] = connection
+    return connection
+
+def _locate(path):
+    """(profile, path relative to it with "/" separators) of an absolute path, or None outside the profiles."""
+    if _config["profile_root"] is None:
+        return None
+    rel = os.path.relpath(os.path.abspath(path), _config["profile_root"])
+    if rel == "." or rel.startswith(".."):
+        return None
+    profile, _, rel = rel.replace(os.sep, "/").partition("/")
+    return profile, rel
+
+def _subtree(rel):
+    # Every path below `rel`: "/" + 1 is "0", so [rel/, rel0) is exactly the subtree
+    return rel + "/", rel + "0"
+
+def _parent(rel):
+    return rel.rpartition("/")[0]
+
+def entry_type(name, is_folder):
+    """Same types as the listing's type filter: folder, media or file."""
+    if is_folder:
+        return "folder"
+    return "media" if name.lower().endswith(MEDIA_EXTENSIONS) else "file"
+
+def _upsert(connection, rel, stat, is_folder):
+    name = rel.rpartition("/")[2]
+    connection.execute(
+        "INSERT INTO entries (path, parent, name, type, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (path) DO UPDATE SET type = excluded.type, size = excluded.size, mtime_ns = excluded.mtime_ns",
+        (rel, _parent(rel), name, entry_type(name, is_folder), None if is_folder else stat.st_size, stat.st_mtime_ns))
+
+def _delete(connection, rel):
+    connection.execute("DELETE FROM entries WHERE path = ? OR (path >= ? AND path < ?)", (rel,) + _subtree(rel))
+
+def _write(profile, work):
+    """Run work(connection) in one transaction. Errors are logged: the next scan repairs the catalog."""
+    try:
+        with _lock:
+            connection = _connection(profile)
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                work(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+    except (sqlite3.Error, OSError) as e:
+        print(f"[Catalog] Could not update catalog of {profile}: {e}")
+
+def _hidden(rel):
+    """Whether a path is left out of the catalog: any part of it starts with a dot."""
+    return any(part.startswith(".") for part in rel.split("/"))
+
+def catalog_add(path):
+    """Record a file or folder just uploaded, created or replaced, and any new folders above it."""
+    located = _locate(path)
+    if not located or not located[1] or _hidden(located[1]):
+        return
+    profile, rel = located
+    start_catalog()
+
+    def work(connection):
+        stat = os.stat(path)
+        _upsert(connection, rel, stat, os.path.isdir(path))
+        parent = _parent(rel)
+        while parent:
+            if connection.execute("SELECT 1 FROM entries WHERE path = ?", (parent,)).fetchone():
+                break
+            _upsert(connection, parent, os.stat(os.path.join(_config["profile_root"], profile, parent)), True)
+            parent = _parent(parent)
+
+    _write(profile, work)
+
+def catalog_remove(path):
+    """Drop a deleted file, or a folder and everything below it."""
+    located = _locate(path)
+    if located and located[1]:
+        _write(located[0], lambda connection: _delete(connection, located[1]))
+
+def catalog_move(old_path, new_path):
+    """Follow a rename of a file or folder, with everything below it."""
+    old, new = _locate(old_path), _locate(new_path)
+    if not old or not new or old[0] != new[0] or not old[1] or not new[1]:
+        return
+    # Renamed to or from a hidden name, it leaves or joins the catalog as _scan would have it
+    if _hidden(new[1]):
+        catalog_remove(old_path)
+        return
+    if _hidden(old[1]):
+        catalog_add(new_path)
+        return
+    profile, old_rel, new_rel = old[0], old[1], new[1]
+
+    def work(connection):
+        _delete(connection, new_rel)
+        connection.execute("UPDATE entries SET path = ?, parent = ?, name = ? WHERE path = ?",
+                           (new_rel, _parent(new_rel), new_rel.rpartition("/")[2], old_rel))
+        low, high = _subtree(old_rel)
+        connection.execute("UPDATE entries SET path = ? || substr(path, ?), parent = ? || substr(parent, ?) "
+                           "WHERE path >= ? AND path < ?",
+                           (new_rel, len(old_rel) + 1, new_rel, len(old_rel) + 1, low, high))
+
+    _write(profile, work)
+
+def drop_catalog(profile_path):
+    """Remove the catalog of a removed profile."""
+    located = _locate(profile_path)
+    if not located or located[1]:
+        return
+    profile = located[0]
+    with _lock:
+        connection = _local["connections"].pop(profile, None) if _local["pid"] == os.getpid() else None
+        if connection is not None:
+            connection.close()
+        for name in (f"{profile}.sqlite3", f"{profile}.sqlite3-wal", f"{profile}.sqlite3-shm", f"{profile}.lock"):
+            try:
+                os.remove(os.path.join(_config["directory"], name))
+            except FileNotFoundError:
+                pass
+
+def _scan(folder):
+    """(name, stat, is_folder) of a folder's entries; hidden ones (partial uploads, upload sessions) and linked folders are left out."""
+    found = []
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            try:
+                is_folder = entry.is_dir(follow_symlinks=False)
+                if not is_folder and not entry.is_file():
+                    continue
+                found.append((entry.name, entry.stat(), is_folder))
+            except OSError:
+                continue
+    return found
+
+def reconcile_profile(profile):
+    """
+    Bring a profile's catalog in line with the disk. A folder is read again only if its
+    mtime differs from the one it had when last scanned (adding, removing or renaming
+    anything in it changes it); unchanged folders only have their subfolders checked.
+    Returns the number of folders read.
+    """
+    root = os.path.join(_config["profile_root"], profile)
+    connection = _connection(profile)
+    with _lock:
+        row = connection.execute("SELECT value FROM meta WHERE key = 'root_scanned_ns'").fetchone()
+    try:
+        root_changed = row is None or os.stat(root).st_mtime_ns != row[0]
+    except OSError:
+        return 0
+    read = 0
+    stack = [("", root_changed)]
+    while stack:
+        rel, changed = stack.pop()
+        folder = os.path.join(root, rel) if rel else root
+
+        if not changed:
+            with _lock:
+                subfolders = connection.execute("SELECT path, scanned_ns FROM entries WHERE parent = ? AND type = 'folder'",
+                                                (rel,)).fetchall()
+            for child, scanned_ns in subfolders:
+                try:
+                    mtime_ns = os.stat(os.path.join(root, child)).st_mtime_ns
+                except OSError:
+                    # Gone although the folder above looked unchanged: read that one after all
+                    stack.append((rel, True))
+                    break
+                stack.append((child, mtime_ns != scanned_ns))
+            continue
+
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            found = _scan(folder)
+        except OSError:
+            continue
+        read += 1
+
+        def work(connection):
+            # Changed while it was being read (an upload or rename racing the scan): read it again
+            if os.stat(folder).st_mtime_ns != mtime_ns:
+                stack.append((rel, True))
+                return
+            known = dict(connection.execute("SELECT name, scanned_ns FROM entries WHERE parent = ?", (rel,)).fetchall())
+            for name, stat, is_folder in found:
+                child = f"{rel}/{name}" if rel else name
+                _upsert(connection, child, stat, is_folder)
+                if is_folder:
+                    stack.append((child, known.get(name) != stat.st_mtime_ns))
+                known.pop(name, None)
+            for name in known:
+                _delete(connection, f"{rel}/{name}" if rel else name)
+            # Recorded last, so a scan cut short reads this folder again next time
+            if rel:
+                connection.execute("UPDATE entries SET scanned_ns = ? WHERE path = ?", (mtime_ns, rel))
+            else:
+                connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('root_scanned_ns', ?)", (mtime_ns,))
+
+        _write(profile, work)
+
+    _write(profile, lambda connection: connection.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('reconciled', ?)", (time.time(),)))
+    return read
+
+def reconcile_all():
+    """Reconcile every profile; a profile another worker process is scanning is skipped."""
+    for profile in sorted(os.listdir(_config["profile_root"])):
+        if profile.startswith(".") or not os.path.isdir(os.path.join(_config["profile_root"], profile)):
+            continue
+        with open(os.path.join(_config["directory"], f"{profile}.lock"), "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            started = time.monotonic()
+            read = reconcile_profile(profile)
+            if read:
+                print(f"[Catalog] {profile}: read {read} changed folders in {time.monotonic() - started:.1f}s")
+
+def _reconcile_forever():
+    # Linux applies nice values per thread: keep the scan behind request handling
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+    except (AttributeError, OSError):
+        pass
+    while True:
+        try:
+            reconcile_all()
+        except Exception as e:
+            print(f"[Catalog] Reconcile failed: {e}")
+            traceback.print_exc()
+        time.sleep(_config["interval"])
+
+def search_catalog(profile, query, folder="", type_filter="all", limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Entries of a profile whose name contains every word of `query` (case-insensitive),
+    below `folder` if given. Returns (rows, more): at most `limit` rows of
+    (path, type, size, mtime_ns), and whether there were more matches.
+    """
+    words = query.lower().split()
+    with _lock:
+        connection = _connection(profile)
+        fts = _local["fts"][profile]
+        # Words of three or more characters go through the trigram index; shorter ones
+        # can only be matched with LIKE, on the rows the index already narrowed down
+        indexed = [word for word in words if len(word) >= 3] if fts else []
+        if indexed and folder and connection.execute(
+                "SELECT COUNT(*) FROM (SELECT 1 FROM entries WHERE path >= ? AND path < ? LIMIT ?)",
+                _subtree(folder) + (SUBTREE_SCAN_LIMIT,)).fetchone()[0] < SUBTREE_SCAN_LIMIT:
+            indexed = []
+        if indexed:
+            sql = "SELECT e.path, e.type, e.size, e.mtime_ns FROM names JOIN entries e ON e.id = names.rowid WHERE names MATCH ?"
+            params = [" ".join('"' + word.replace('"', '""') + '"' for word in indexed)]
+        else:
+            sql = "SELECT e.path, e.type, e.size, e.mtime_ns FROM entries e WHERE 1"
+            params = []
+        for word in words:
+            if word not in indexed:
+                sql += " AND e.name LIKE ? ESCAPE '\\'"
+                params.append("%" + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if folder:
+            sql += " AND e.path >= ? AND e.path < ?"
+            params += _subtree(folder)
+        if type_filter == "file":
+            sql += " AND e.type != 'folder'"
+        elif type_filter != "all":
+            sql += " AND e.type = ?"
+            params.append(type_filter)
+        # No ORDER BY: sorting every match would cost time proportional to the matches
+        rows = connection.execute(sql + " LIMIT ?", params + [limit + 1]).fetchall()
+    return rows[:limit], len(rows) > limit
+
+def catalog_complete(profile):
+    """Whether a full scan of the profile has finished, so searches see every file."""
+    with _lock:
+        row = _connection(profile).execute("SELECT value FROM meta WHERE key = 'reconciled'").fetchone()
+    return row is not None
+
+def send_search(handler, parsed_url, profile_root):
+    """
+    GET /search?q=<words>&path=<folder>&type=all|folder|file|media&limit=<n>
+    Files and folders anywhere below <folder> (default: the whole profile) whose name
+    contains every word. "complete" is false until the first scan of the profile is done.
+    """
+    query = parse_qs(parsed_url.query)
+    words = query.get("q", [""])[0].strip()
+    type_filter = query.get("type", ["all"])[0]
+    if not words:
+        send_text(handler, 400, "Missing search words")
+        return
+    if type_filter not in ("all", "folder", "file", "media"):
+        send_text(handler, 400, "Invalid type")
+        return
+    try:
+        limit = max(1, min(int(query.get("limit", [DEFAULT_SEARCH_LIMIT])[0]), MAX_SEARCH_LIMIT))
+    except ValueError:
+        send_text(handler, 400, "Invalid limit")
+        return
+
+    profile_dir = os.path.abspath(get_profile_dir(handler, profile_root))
+    folder = os.path.normpath(query.get("path", [""])[0].strip("/"))
+    folder = "" if folder == "." else folder.replace(os.sep, "/")
+    if folder == ".." or folder.startswith("../"):
+        send_text(handler, 400, "Invalid path")
+        return
+
+    profile = os.path.basename(profile_dir)
+    start_catalog()
+    started = time.perf_counter()
+    try:
+        rows, more = search_catalog(profile, words, folder, type_filter, limit)
+        complete = catalog_complete(profile)
+    except sqlite3.Error as e:
+        print("Error searching catalog:", e)
+        send_text(handler, 500, "Search failed")
+        return
+
+    results = [{"path": path, "name": path.rpartition("/")[2], "type": kind, "size": size, "mtime": mtime_ns / 1e9}
+               for path, kind, size, mtime_ns in rows]
+    results.sort(key=lambda result: (result["type"] != "folder", result["name"].lower(), result["path"]))
+    send_json(handler, 200, {
+        "profile": profile,
+        "query": words,
+        "path": folder,
+        "results": results,
+        "more": more,
+        "complete": complete,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2),
+    })
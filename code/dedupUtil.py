@@ -0,0 +1,231 @@
+import os
+import sys
+import fcntl
+import errno
+import hashlib
+import sqlite3
+import threading
+
+# Storage used for a file whose content is already on disk:
+#   off      - always keep a separate copy (default)
+#   reflink  - copy-on-write clone (btrfs, XFS); copies stay independent, blocks are shared
+#   hardlink - another name for the same inode; only safe because files are never edited in place
+#   auto     - reflink where the filesystem supports it, hardlink otherwise
+DEDUP_MODES = ("off", "auto", "reflink", "hardlink")
+
+# ioctl from linux/fs.h: make dest_fd share all of src_fd's extents
+FICLONE = 0x40049409
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_config = {"mode": "off", "index_file": None}
+_local = {"pid": None, "connection": None}
+_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    deduped INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS files_hash ON files (hash, size);
+"""
+
+def configure_dedup(index_file, mode):
+    """Enable dedup for uploads. The SQLite index at index_file is shared by all worker processes."""
+    if mode not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup mode: {mode}")
+    _config["mode"] = mode
+    _config["index_file"] = index_file
+    if mode != "off":
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        with _lock:
+            _connection()
+
+def dedup_enabled():
+    return _config["mode"] != "off"
+
+def new_hasher():
+    """Hash object for an upload being streamed in, or None when dedup is off."""
+    return hashlib.sha256() if dedup_enabled() else None
+
+def _connection():
+    """This process's index connection (see preforkUtil.run_prefork)."""
+    if _local["pid"] != os.getpid():
+        connection = sqlite3.connect(_config["index_file"], timeout=30, check_same_thread=False,
+                                     isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        _local["connection"] = connection
+        _local["pid"] = os.getpid()
+    return _local["connection"]
+
+def _execute(sql, params=()):
+    with _lock:
+        return _connection().execute(sql, params).fetchall()
+
+def _tree_range(path):
+    # Every path below `path/` sorts between "path/" and "path0" ("0" follows "/")
+    path = os.path.abspath(path)
+    return path + "/", path + "0"
+
+def _clone(source, target):
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def _link_copy(source, target):
+    """Create `target` sharing `source`'s data. Returns True, or False if the filesystem can't."""
+    mode = _config["mode"]
+    if mode in ("auto", "reflink"):
+        try:
+            _clone(source, target)
+            return True
+        except OSError as e:
+            try:
+                os.remove(target)
+            except FileNotFoundError:
+                pass
+            if mode == "reflink" or e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                return False
+    try:
+        os.link(source, target)
+        return True
+    except OSError:
+        return False
+
+def _find_duplicate(digest, size):
+    """An indexed file with this content that is still exactly as it was indexed."""
+    for path, device, inode, mtime_ns in _execute(
+            "SELECT path, device, inode, mtime_ns FROM files WHERE hash = ? AND size = ?", (digest, size)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            forget(path)
+            continue
+        if (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns) == (device, inode, size, mtime_ns):
+            return path
+        forget(path)
+    return None
+
+def _record(path, digest, deduped):
+    stat = os.stat(path)
+    _execute("INSERT OR REPLACE INTO files (path, hash, size, device, inode, mtime_ns, deduped) "
+             "VALUES (?, ?, ?, ?, ?, ?, ?)",
+             (os.path.abspath(path), digest, stat.st_size, stat.st_dev, stat.st_ino, stat.st_mtime_ns, deduped))
+
+def place_file(tmp_path, filepath, hasher):
+    """
+    Move a fully written upload from tmp_path to filepath. With dedup on and the same
+    content already indexed, filepath becomes a reflink clone or hardlink of that file
+    instead and tmp_path is dropped.
+    """
+    if hasher is None:
+        os.replace(tmp_path, filepath)
+        return
+    digest = hasher.hexdigest()
+    size = os.path.getsize(tmp_path)
+    deduped = 0
+    try:
+        duplicate = _find_duplicate(digest, size) if size else None
+        if duplicate and os.path.abspath(duplicate) != os.path.abspath(filepath):
+            link_path = tmp_path + ".link"
+            if _link_copy(duplicate, link_path):
+                os.replace(link_path, filepath)
+                os.remove(tmp_path)
+                deduped = 1
+                print(f"[Dedup] {filepath} stored as a copy of {duplicate} ({size} bytes saved)")
+    except sqlite3.Error as e:
+        print(f"[Dedup] Index lookup failed: {e}")
+    if not deduped:
+        os.replace(tmp_path, filepath)
+    try:
+        _record(filepath, digest, deduped)
+    except sqlite3.Error as e:
+        print(f"[Dedup] Could not index {filepath}: {e}")
+
+def hash_file(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher
+
+def forget(path):
+    """Drop a file, or a folder and everything below it, from the index (after a delete)."""
+    if not dedup_enabled():
+        return
+    low, high = _tree_range(path)
+    try:
+        _execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)", (os.path.abspath(path), low, high))
+    except sqlite3.Error as e:
+        print(f"[Dedup] Could not update index for {path}: {e}")
+
+def moved(old_path, new_path):
+    """Follow a rename of a file or folder in the index."""
+    if not dedup_enabled():
+        return
+    old_path, new_path = os.path.abspath(old_path), os.path.abspath(new_path)
+    low, high = _tree_range(old_path)
+    try:
+        with _lock:
+            connection = _connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM files WHERE path = ? OR (path >= ? AND path < ?)",
+                                   (new_path,) + _tree_range(new_path))
+                connection.execute("UPDATE files SET path = ? WHERE path = ?", (new_path, old_path))
+                connection.execute("UPDATE files SET path = ? || substr(path, ?) WHERE path >= ? AND path < ?",
+                                   (new_path, len(old_path) + 1, low, high))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+    except sqlite3.Error as e:
+        print(f"[Dedup] Could not update index for {old_path}: {e}")
+
+def dedup_report(root=None):
+    """Bytes saved by dedup, optionally only for files below `root` (a profile folder)."""
+    report = {"mode": _config["mode"], "files": 0, "unique_files": 0, "logical_bytes": 0, "stored_bytes": 0, "saved_bytes": 0}
+    if not dedup_enabled():
+        return report
+    where, params = "", ()
+    if root:
+        where, params = "WHERE path >= ? AND path < ?", _tree_range(root)
+    # Per content: copies stored on their own (deduped = 0) each hold the data once;
+    # clones and links share one copy between them
+    files, unique, logical, saved = _execute(
+        "SELECT COALESCE(SUM(count), 0), COUNT(*), COALESCE(SUM(count * size), 0), "
+        "COALESCE(SUM((count - MAX(own, 1)) * size), 0) FROM ("
+        "SELECT size, COUNT(*) AS count, SUM(deduped = 0) AS own FROM files " + where + " GROUP BY hash, size)",
+        params)[0]
+    report.update(files=files, unique_files=unique, logical_bytes=logical, saved_bytes=saved,
+                  stored_bytes=logical - saved)
+    return report
+
+def index_tree(root):
+    """Add every file below root to the index, so content uploaded earlier is found too."""
+    count = 0
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.startswith("."):
+                continue
+            path = os.path.join(folder, name)
+            try:
+                _record(path, hash_file(path).hexdigest(), 0)
+                count += 1
+            except OSError as e:
+                print(f"[Dedup] Skipping {path}: {e}")
+    return count
+
+if __name__ == "__main__":
+    # python3 dedupUtil.py <index file> <folder>: index files that existed before dedup was enabled
+    if len(sys.argv) != 3:
+        print("Usage: python3 dedupUtil.py <index file> <folder>")
+        sys.exit(1)
+    configure_dedup(sys.argv[1], "auto")
+    print(f"Indexed {index_tree(sys.argv[2])} files")
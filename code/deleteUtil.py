@@ -2,6 +2,9 @@ import os
 import shutil
 import traceback
 from profileUtil import get_profile_dir
+from responseUtil import send_text
+from dedupUtil import forget
+from catalogUtil import catalog_remove
 from urllib.parse import unquote, parse_qs
 
 def delete(handler, parsed_url, profile_root):
@@ -9,9 +12,7 @@ def delete(handler, parsed_url, profile_root):
     filename = query.get("file", [None])[0]
 
     if not filename:
-        handler.send_response(400)
-        handler.end_headers()
-        handler.wfile.write(b"Missing file parameter")
+        send_text(handler, 400, "Missing file parameter")
         return
 
     rel_path = os.path.normpath(unquote(filename)).lstrip("/")
@@ -21,22 +22,16 @@ def delete(handler, parsed_url, profile_root):
     print(f"Resolved path: {file_path}")
 
     if not file_path.startswith(os.path.abspath(get_profile_dir(handler, profile_root))):
-        handler.send_response(400)
-        handler.end_headers()
-        handler.wfile.write(b"Invalid file path")
+        send_text(handler, 400, "Invalid file path")
         return
 
     if not os.path.exists(file_path):
-        handler.send_response(404)
-        handler.end_headers()
-        handler.wfile.write(b"File or folder not found")
+        send_text(handler, 404, "File or folder not found")
         return
 
     # Prevent deletion of root directory
     if os.path.abspath(file_path) == os.path.abspath(get_profile_dir(handler, profile_root)):
-        handler.send_response(400)
-        handler.end_headers()
-        handler.wfile.write(b"Cannot delete root directory")
+        send_text(handler, 400, "Cannot delete root directory")
         return
 
     try:
@@ -45,17 +40,13 @@ def delete(handler, parsed_url, profile_root):
         elif os.path.isdir(file_path):
             shutil.rmtree(file_path)  # recursive delete
         else:
-            handler.send_response(400)
-            handler.end_headers()
-            handler.wfile.write(b"Invalid file type")
+            send_text(handler, 400, "Invalid file type")
             return
 
-        handler.send_response(200)
-        handler.end_headers()
-        handler.wfile.write(b"Deleted")
+        forget(file_path)
+        catalog_remove(file_path)
+        send_text(handler, 200, "Deleted")
     except Exception as e:
         print("Error while deleting: ", e)
         traceback.print_exc()
-        handler.send_response(500)
-        handler.end_headers()
-        handler.wfile.write(b"Failed to delete")
\ No newline at end of file
+        send_text(handler, 500, "Failed to delete")
\ No newline at end of file
@@ -0,0 +1,146 @@
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+
+from responseUtil import send_json, send_text
+
+# A stream is closed after this many seconds; EventSource reconnects with Last-Event-ID
+EVENTS_MAX_DURATION = 600
+
+# Comment line sent when nothing happened for this long, so proxies keep the stream open
+# and a client that went away is noticed
+EVENTS_HEARTBEAT = 15
+
+# Long polls (?poll=1) return after this many seconds even with nothing new
+EVENTS_POLL_TIMEOUT = 25
+
+# Each open stream and each waiting long poll holds a handler thread. Past this many of
+# them together, new streams are refused (the page then polls) and polls are answered at
+# once, telling the client to wait EVENTS_RETRY_AFTER seconds before the next one
+EVENTS_MAX_STREAMS = 16
+EVENTS_RETRY_AFTER = 5
+
+# Job records written by other worker processes are not signalled here, so waiters also
+# look again this often
+EVENTS_RECHECK_INTERVAL = 1.0
+
+# Name of each kind of background job -> function(profile name) returning that profile's
+# (job id, record) pairs. Records need "state" and an "updated" timestamp.
+JOB_SOURCES = {}
+
+_condition = threading.Condition()
+_streams = {"open": 0}
+
+def _take_slot():
+    with _condition:
+        if _streams["open"] >= EVENTS_MAX_STREAMS:
+            return False
+        _streams["open"] += 1
+        return True
+
+def _release_slot():
+    with _condition:
+        _streams["open"] -= 1
+
+def register_job_source(name, profile_jobs):
+    JOB_SOURCES[name] = profile_jobs
+
+def notify_job_changed():
+    """Wake the streams and long polls of this process after a job record was written."""
+    with _condition:
+        _condition.notify_all()
+
+def job_events(profile, since):
+    """Events for the profile's jobs updated after `since`, oldest first, and the new cursor."""
+    events = []
+    for source, profile_jobs in JOB_SOURCES.items():
+        for job_id, record in profile_jobs(profile):
+            if record.get("updated", 0) > since:
+                events.append(dict(record, source=source, job_id=job_id))
+    events.sort(key=lambda event: event["updated"])
+    return events, max([since] + [event["updated"] for event in events])
+
+def wait_for_events(profile, since, timeout):
+    """job_events(), waiting up to `timeout` seconds for there to be any."""
+    deadline = time.monotonic() + timeout
+    while True:
+        events, cursor = job_events(profile, since)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return events, cursor
+        with _condition:
+            _condition.wait(min(remaining, EVENTS_RECHECK_INTERVAL))
+
+def event_name(record):
+    # A running job reports progress; every other state is its own event
+    return "progress" if record["state"] == "running" else record["state"]
+
+def parse_cursor(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def send_events(handler, parsed_url, profile):
+    """
+    /events: progress, completion and failure of all the profile's background jobs on one
+    connection, as Server-Sent Events (event: queued|progress|done|failed|cancelled, data:
+    the job record with "source" and "job_id"). With ?poll=1 it is a long poll instead,
+    answering {"events": [...], "cursor": c}; pass ?since=<cursor> to get only newer ones.
+    A poll past EVENTS_MAX_STREAMS does not wait and carries Retry-After.
+    """
+    query = parse_qs(parsed_url.query)
+    since = parse_cursor(handler.headers.get("Last-Event-ID") or query.get("since", [0])[0])
+
+    if query.get("poll", ["0"])[0] == "1":
+        send_poll(handler, profile, since)
+        return
+
+    if not _take_slot():
+        handler.close_connection = True
+        send_text(handler, 503, "Too many event streams, use ?poll=1")
+        return
+
+    try:
+        # The body ends with the connection
+        handler.close_connection = True
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        handler.send_header("Cache-Control", "no-store")
+        handler.send_header("X-Accel-Buffering", "no")
+        handler.end_headers()
+        handler.wfile.write(b"retry: 2000\n\n")
+        handler.wfile.flush()
+
+        started = time.monotonic()
+        while time.monotonic() - started < EVENTS_MAX_DURATION:
+            events, since = wait_for_events(profile, since, EVENTS_HEARTBEAT)
+            if not events:
+                handler.wfile.write(b": keep-alive\n\n")
+            for event in events:
+                handler.wfile.write(f"id: {event['updated']!r}\nevent: {event_name(event)}\n"
+                                    f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            handler.wfile.flush()
+    except (ConnectionError, TimeoutError):
+        pass
+    finally:
+        _release_slot()
+
+def send_poll(handler, profile, since):
+    """Answer a long poll; with every slot taken, answer with what there is now."""
+    if not _take_slot():
+        events, cursor = job_events(profile, since)
+        body = json.dumps({"events": events, "cursor": cursor}).encode("utf-8")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("Retry-After", str(EVENTS_RETRY_AFTER))
+        handler.end_headers()
+        handler.wfile.write(body)
+        return
+    try:
+        events, cursor = wait_for_events(profile, since, EVENTS_POLL_TIMEOUT)
+    finally:
+        _release_slot()
+    send_json(handler, 200, {"events": events, "cursor": cursor})
@@ -1,5 +1,8 @@
 import os
+import traceback
 from profileUtil import get_profile_dir
+from responseUtil import send_text
+from catalogUtil import catalog_add
 from urllib.parse import unquote, parse_qs
 
 def create_folder(handler, parsed_url, profile_root):
@@ -7,9 +10,7 @@ def create_folder(handler, parsed_url, profile_root):
     folder_name = query.get("name", [None])[0]
 
     if not folder_name:
-        handler.send_response(400)
-        handler.end_headers()
-        handler.wfile.write(b"Missing folder name")
+        send_text(handler, 400, "Missing folder name")
         return
 
     # Sanitize and create folder
@@ -19,16 +20,11 @@ def create_folder(handler, parsed_url, profile_root):
 
     try:
         os.makedirs(file_path, mode=0o755, exist_ok=False)
-        handler.send_response(200)
-        handler.end_headers()
-        handler.wfile.write(b"Folder created")
+        catalog_add(file_path)
+        send_text(handler, 200, "Folder created")
     except FileExistsError:
-        handler.send_response(409)
-        handler.end_headers()
-        handler.wfile.write(b"Folder already exists")
+        send_text(handler, 409, "Folder already exists")
     except Exception as e:
         print("Error creating folder:", e)
         traceback.print_exc()
-        handler.send_response(500)
-        handler.end_headers()
-        handler.wfile.write(b"Failed to create folder")
\ No newline at end of file
+        send_text(handler, 500, "Failed to create folder")
\ No newline at end of file
@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import tempfile
+
+class SharedDict:
+    """
+    Dict-like store shared between processes: one small JSON file per key.
+    Used in place of the in-memory job dicts when the server runs several worker processes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not key or "/" in key or key.startswith("."):
+            raise KeyError(key)
+        return os.path.join(self.directory, key)
+
+    def __setitem__(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+
+    def __getitem__(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            raise KeyError(key)
+
+    def __delitem__(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        try:
+            return os.path.exists(self._path(key))
+        except KeyError:
+            return False
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return [name for name in os.listdir(self.directory) if not name.startswith(".")]
+
+    def items(self):
+        items = []
+        for key in self.keys():
+            try:
+                items.append((key, self[key]))
+            except KeyError:
+                pass
+        return items
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        try:
+            del self[key]
+        except KeyError:
+            pass
+        return value
+
+class SharedSet:
+    """Set-like store shared between processes: one empty marker file per member."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        if not key or "/" in key or key.startswith("."):
+            raise KeyError(key)
+        return os.path.join(self.directory, key)
+
+    def add(self, key):
+        with open(self._path(key), "w"):
+            pass
+
+    def __contains__(self, key):
+        try:
+            return os.path.exists(self._path(key))
+        except KeyError:
+            return False
+
+    def discard(self, key):
+        try:
+            os.remove(self._path(key))
+        except (FileNotFoundError, KeyError):
+            pass
+
+    def remove(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.discard(key)
+
+def create_shared_job_state(directory):
+    """Fresh cross-process replacements for zip_jobs, zip_paths and cancelled_jobs."""
+    shutil.rmtree(directory, ignore_errors=True)
+    return (
+        SharedDict(os.path.join(directory, "progress")),
+        SharedDict(os.path.join(directory, "zip_paths")),
+        SharedSet(os.path.join(directory, "cancelled")),
+    )
@@ -4,14 +4,348 @@ let wasCancelled = false;
 let folderUploadXHRs = [];
 let folderUploadCancelled = false;
 let mediaFiles = [];
+let mediaVersions = [];
 let currentMediaIndex = -1;
 let allFiles = [];
 let currentFileIndex = 0;
 let currentZipJobId = null;
-let zipProgressIntervalId = null;
+let currentResumableUpload = null;
+// Zips are streamed straight into the browser's download instead of being built on the server first
+const ZIP_STREAMING = true;
+// fast, balanced or smallest pick stored/deflated per file; "store" gives the download an exact size
+const ZIP_STREAM_COMPRESSION = "balanced";
+// "zip", or "tar" (no CPU, exact size), "tar.zst" / "tar.gz" (multithreaded compression); tars are always streamed
+const DOWNLOAD_ARCHIVE_FORMAT = "zip";
+// Gallery and carousel tiles are server-made thumbnails (see /thumb); "webp" is smaller where the server supports it
+const THUMB_FORMAT = "jpeg";
 const ip = window.location.hostname;
 const port = 5000;
 
+// --- Folder listing: pages fetched from /list, only the visible rows are in the DOM ---
+const LISTING_PAGE_SIZE = 200;
+const LISTING_OVERSCAN = 20;
+const MEDIA_PAGE_SIZE = 1000;
+const fileTable = document.getElementById("fileTable");
+const fileTableBody = document.getElementById("fileTableBody");
+const listingStatus = document.getElementById("listingStatus");
+const listingProfile = fileTable ? fileTable.dataset.profile : "";
+const listingFolder = fileTable ? fileTable.dataset.path : "";
+const listingQuery = new URLSearchParams(window.location.search).get("q") || "";
+// "Subfolders" ticked: the search covers everything below this folder (/search) instead of filtering the listing
+const searchDeep = new URLSearchParams(window.location.search).get("deep") === "1";
+const SEARCH_LIMIT = 1000;
+let listingSort = JSON.parse(localStorage.getItem("listingSort") || '{"sort": "name", "order": "asc"}');
+let listingEntries = [];
+let listingTotal = 0;
+let listingCursor = null;
+let listingDone = false;
+let listingLoading = null;
+let listingGeneration = 0;
+let mediaEntriesPromise = null;
+let rowHeight = 45;
+let rowHeightMeasured = false;
+let renderedRange = "";
+let renderQueued = false;
+const selectedEntries = new Map();  // name -> entry, survives rows being re-rendered
+
+function listingUrl(params) {
+    const query = new URLSearchParams({ path: currentPath, sort: listingSort.sort, order: listingSort.order, ...params });
+    if (listingQuery) {
+        query.set("q", listingQuery);
+    }
+    return `/list?${query}`;
+}
+
+function fetchListingPage() {
+    if (listingDone) {
+        return Promise.resolve();
+    }
+    if (listingLoading) {
+        return listingLoading;
+    }
+
+    const generation = listingGeneration;
+    const params = { limit: LISTING_PAGE_SIZE };
+    if (listingCursor) {
+        params.cursor = listingCursor;
+    }
+
+    listingLoading = fetch(listingUrl(params))
+        .then(res => {
+            if (!res.ok) throw new Error(`Failed to load folder (${res.status})`);
+            return res.json();
+        })
+        .then(data => {
+            if (generation !== listingGeneration) {
+                return;  // sort changed while this page was in flight
+            }
+            for (const entry of data.entries) {
+                listingEntries.push(entry);
+            }
+            listingTotal = data.total;
+            listingCursor = data.next_cursor;
+            listingDone = !data.next_cursor;
+            listingLoading = null;
+            scheduleRender();
+        })
+        .catch(err => {
+            console.error("Listing error:", err);
+            if (generation === listingGeneration) {
+                listingDone = true;
+                listingLoading = null;
+                listingStatus.textContent = err.message;
+            }
+        });
+    return listingLoading;
+}
+
+// Every entry of one type (e.g. "media") in the current sort order, for the gallery and preview
+async function fetchAllEntries(type) {
+    const entries = [];
+    let cursor = null;
+    do {
+        const params = { type, limit: MEDIA_PAGE_SIZE };
+        if (cursor) {
+            params.cursor = cursor;
+        }
+        const res = await fetch(listingUrl(params));
+        if (!res.ok) throw new Error(`Failed to load folder (${res.status})`);
+        const data = await res.json();
+        entries.push(...data.entries);
+        cursor = data.next_cursor;
+    } while (cursor);
+    return entries;
+}
+
+function getMediaEntries() {
+    if (!mediaEntriesPromise) {
+        mediaEntriesPromise = fetchAllEntries("media").catch(err => {
+            mediaEntriesPromise = null;
+            throw err;
+        });
+    }
+    return mediaEntriesPromise;
+}
+
+function resetListing() {
+    listingGeneration++;
+    listingEntries = [];
+    listingTotal = 0;
+    listingCursor = null;
+    listingDone = false;
+    listingLoading = null;
+    mediaEntriesPromise = null;
+    renderedRange = "";
+    selectedEntries.clear();
+    document.getElementById("selectAll").checked = false;
+    toggleBulkDeleteButton();
+    updateSortButtons();
+    fetchListingPage();
+}
+
+function setListingSort(sort) {
+    const order = listingSort.sort === sort && listingSort.order === "asc" ? "desc" : "asc";
+    listingSort = { sort, order };
+    localStorage.setItem("listingSort", JSON.stringify(listingSort));
+    window.scrollTo(0, 0);
+    resetListing();
+}
+
+function updateSortButtons() {
+    document.querySelectorAll(".sort-btn").forEach(btn => {
+        const active = btn.dataset.sort === listingSort.sort;
+        btn.classList.toggle("active", active);
+        btn.dataset.order = active ? listingSort.order : "";
+    });
+}
+
+function scheduleRender() {
+    if (renderQueued) {
+        return;
+    }
+    renderQueued = true;
+    requestAnimationFrame(() => {
+        renderQueued = false;
+        renderVisibleRows();
+    });
+}
+
+function renderVisibleRows() {
+    const tableTop = fileTableBody.getBoundingClientRect().top + window.scrollY;
+    const viewTop = window.scrollY - tableTop;
+    const first = Math.min(listingEntries.length, Math.max(0, Math.floor(viewTop / rowHeight) - LISTING_OVERSCAN));
+    const last = Math.min(listingEntries.length, Math.max(first, Math.ceil((viewTop + window.innerHeight) / rowHeight) + LISTING_OVERSCAN));
+
+    // Re-rendering would close an open row menu, so skip it when nothing changed
+    const range = `${first}:${last}:${listingEntries.length}`;
+    if (range !== renderedRange) {
+        renderedRange = range;
+        const rows = [spacerRow(first * rowHeight)];
+        for (let i = first; i < last; i++) {
+            rows.push(renderRow(listingEntries[i], i));
+        }
+        rows.push(spacerRow((listingEntries.length - last) * rowHeight));
+        fileTableBody.innerHTML = rows.join("");
+
+        if (!rowHeightMeasured && last > first) {
+            const row = fileTableBody.querySelector("tr.file-row");
+            const height = row ? row.getBoundingClientRect().height : 0;
+            if (height > 0) {
+                rowHeightMeasured = true;
+                if (Math.abs(height - rowHeight) > 0.5) {
+                    rowHeight = height;
+                    renderedRange = "";
+                    scheduleRender();
+                }
+            }
+        }
+    }
+
+    if (!listingDone && last >= listingEntries.length - LISTING_OVERSCAN) {
+        fetchListingPage();
+    }
+
+    if (!listingDone) {
+        listingStatus.textContent = `Loaded ${listingEntries.length} of ${listingTotal || "?"} item(s)...`;
+    } else if (listingTotal === 0) {
+        listingStatus.textContent = listingQuery ? "No matching files." : "This folder is empty.";
+    } else {
+        listingStatus.textContent = `${listingTotal} item(s)`;
+    }
+}
+
+function spacerRow(height) {
+    return `<tr class="spacer-row"><td colspan="6" style="height: ${height}px;"></td></tr>`;
+}
+
+function escapeHtml(text) {
+    return String(text)
+        .replace(/&/g, "&amp;")
+        .replace(/</g, "&lt;")
+        .replace(/>/g, "&gt;")
+        .replace(/"/g, "&quot;")
+        .replace(/'/g, "&#39;");
+}
+
+function formatModified(mtime) {
+    const d = new Date(mtime * 1000);
+    const pad = n => String(n).padStart(2, "0");
+    return `${d.getFullYear()}-${pad(d.getMonth() + 1)}-${pad(d.getDate())} ${pad(d.getHours())}:${pad(d.getMinutes())}`;
+}
+
+// Path of an entry relative to the profile root, URL-encoded per segment
+function entryRelPath(entry) {
+    const relPath = listingFolder ? `${listingFolder}/${entry.name}` : entry.name;
+    return relPath.split("/").map(encodeURIComponent).join("/");
+}
+
+function renderRow(entry, index) {
+    const isFolder = entry.type === "folder";
+    const name = escapeHtml(entry.name);
+    const href = encodeURIComponent(entry.name) + (isFolder ? "/" : "");
+    const ref = `listingEntries[${index}]`;
+    const checked = selectedEntries.has(entry.name) ? " checked" : "";
+
+    const actionsHtml = isFolder ? `
+        <div class="dropdown">
+            <button class="dots-btn" onclick="toggleDropdown(event)">&#8942;</button>
+            <div class="dropdown-content">
+                <a href="javascript:void(0)" class="dropdown-link" onclick="startZipDownload(entryRelPath(${ref}))">Download ZIP</a>
+                <button class="rename-btn" onclick="renameItem(${ref}.name)">Rename</button>
+                <button class="delete-btn" onclick="deleteFile(${ref}.name, false)">Delete</button>
+                <button class="share-btn" onclick="showShareLink(${ref}.name, listingProfile, 'folder')">Share Link</button>
+            </div>
+        </div>` : `
+        <div class="dropdown">
+            <button class="dots-btn" onclick="toggleDropdown(event)">&#8942;</button>
+            <div class="dropdown-content">
+                <a href="${href}" download class="dropdown-link">Download</a>
+                <button class="preview-btn" onclick="previewFile(${ref}.name)">Preview</button>
+                <button class="rename-btn" onclick="renameItem(${ref}.name)">Rename</button>
+                <button class="delete-btn" onclick="deleteFile(${ref}.name, false)">Delete</button>
+                <button class="detail-btn" onclick="showDetails(${ref}.name)">Details</button>
+                <button class="share-btn" onclick="showShareLink(${ref}.name, listingProfile, 'file')">Share Link</button>
+            </div>
+        </div>`;
+
+    return `
+        <tr class="file-row">
+            <td><input type="checkbox" class="fileCheckbox" data-index="${index}"${checked}></td>
+            <td><a href="${href}"${isFolder ? "" : ' target="_blank"'}><strong>${name}</strong></a></td>
+            <td>${isFolder ? "Folder" : "File"}</td>
+            <td>${entry.size == null ? "-" : (entry.size / 1024).toFixed(1) + " KB"}</td>
+            <td>${entry.mtime ? formatModified(entry.mtime) : "Unknown"}</td>
+            <td>${actionsHtml}</td>
+        </tr>`;
+}
+
+// URL of a path relative to the profile root, encoded per segment
+function profileUrl(relPath, isFolder) {
+    const encoded = relPath ? relPath.split("/").map(encodeURIComponent).join("/") + (isFolder ? "/" : "") : "";
+    return `/${encodeURIComponent(listingProfile)}/${encoded}`;
+}
+
+function renderSearchResult(result) {
+    const isFolder = result.type === "folder";
+    const parent = result.path.includes("/") ? result.path.slice(0, result.path.lastIndexOf("/")) : "";
+
+    return `
+        <tr class="file-row">
+            <td></td>
+            <td>
+                <a href="${profileUrl(result.path, isFolder)}"${isFolder ? "" : ' target="_blank"'}><strong>${escapeHtml(result.name)}</strong></a>
+                <div><a href="${profileUrl(parent, true)}" class="search-folder">/${escapeHtml(parent)}</a></div>
+            </td>
+            <td>${isFolder ? "Folder" : "File"}</td>
+            <td>${result.size == null ? "-" : (result.size / 1024).toFixed(1) + " KB"}</td>
+            <td>${result.mtime ? formatModified(result.mtime) : "Unknown"}</td>
+            <td></td>
+        </tr>`;
+}
+
+// Names matching the search anywhere below this folder, from the server's catalog
+function searchCatalog() {
+    const query = new URLSearchParams({ q: listingQuery, path: listingFolder, limit: SEARCH_LIMIT });
+    listingStatus.textContent = "Searching...";
+    fetch(`/search?${query}`)
+        .then(res => {
+            if (!res.ok) throw new Error(`Search failed (${res.status})`);
+            return res.json();
+        })
+        .then(data => {
+            fileTableBody.innerHTML = data.results.map(renderSearchResult).join("");
+            let status = data.results.length
+                ? `${data.results.length}${data.more ? "+" : ""} match(es) in this folder and its subfolders`
+                : "No matching files.";
+            if (!data.complete) {
+                status += " The catalog is still being built, so some files may be missing.";
+            }
+            listingStatus.textContent = status;
+        })
+        .catch(err => {
+            console.error("Search error:", err);
+            listingStatus.textContent = err.message;
+        });
+}
+
+if (fileTable) {
+    const searchDeepBox = document.getElementById("searchDeep");
+    if (searchDeepBox) {
+        searchDeepBox.checked = searchDeep;
+    }
+    if (listingQuery && searchDeep) {
+        searchCatalog();
+    } else {
+        document.querySelectorAll(".sort-btn").forEach(btn => {
+            btn.addEventListener("click", () => setListingSort(btn.dataset.sort));
+        });
+        window.addEventListener("scroll", scheduleRender, { passive: true });
+        window.addEventListener("resize", scheduleRender);
+        updateSortButtons();
+        fetchListingPage();
+    }
+}
+
 function triggerFileUpload() {
     const input = document.getElementById('fileInput');
     input.click();
@@ -28,6 +362,282 @@ function triggerFileUpload() {
     };
 }
 
+// --- Resumable uploads: large files go to /uploads in chunks and survive dropped connections ---
+const RESUMABLE_THRESHOLD = 64 * 1024 * 1024;
+const RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024;
+const RESUMABLE_MAX_RETRIES = 8;
+// Chunks sent at once on separate connections; 1 falls back to sequential PATCH requests
+const PARALLEL_UPLOAD_STREAMS = 4;
+
+function resumableKey(file, folderPath) {
+    return `resumable:${folderPath}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+function encodeMetadataValue(value) {
+    return btoa(unescape(encodeURIComponent(value)));
+}
+
+async function createResumableUpload(file, folderPath, chunkSize) {
+    const headers = {
+        "Upload-Length": String(file.size),
+        "Upload-Metadata": `filename ${encodeMetadataValue(file.name)}`,
+    };
+    if (chunkSize) {
+        headers["Upload-Chunk-Size"] = String(chunkSize);
+    }
+    const response = await fetch(`/uploads?path=${encodeURIComponent(folderPath)}`, { method: "POST", headers: headers });
+    if (!response.ok) {
+        throw new Error(await response.text());
+    }
+    return (await response.json()).id;
+}
+
+async function resumableOffset(uploadId) {
+    const response = await fetch(`/uploads/${uploadId}`, { method: "HEAD", cache: "no-store" });
+    if (response.status === 404) {
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`Upload status failed: ${response.status}`);
+    }
+    return parseInt(response.headers.get("Upload-Offset"), 10);
+}
+
+function sendResumableChunk(upload, offset, onProgress) {
+    return new Promise((resolve, reject) => {
+        const chunk = upload.file.slice(offset, Math.min(offset + RESUMABLE_CHUNK_SIZE, upload.file.size));
+        const xhr = new XMLHttpRequest();
+        upload.xhrs.add(xhr);
+
+        xhr.upload.onprogress = (e) => {
+            if (e.lengthComputable) {
+                onProgress(offset + e.loaded);
+            }
+        };
+        xhr.onloadend = () => upload.xhrs.delete(xhr);
+        xhr.onload = () => {
+            if (xhr.status === 204) {
+                resolve(parseInt(xhr.getResponseHeader("Upload-Offset"), 10));
+            } else if (xhr.status === 409 && xhr.getResponseHeader("Upload-Offset") !== null) {
+                // Server has a different offset (e.g. an earlier attempt got further): continue from there
+                resolve(parseInt(xhr.getResponseHeader("Upload-Offset"), 10));
+            } else {
+                const error = new Error(`Chunk upload failed: ${xhr.status}`);
+                error.retryable = xhr.status === 409 || xhr.status >= 500;
+                reject(error);
+            }
+        };
+        xhr.onerror = () => {
+            const error = new Error("Network error");
+            error.retryable = true;
+            reject(error);
+        };
+        xhr.onabort = () => reject(new Error("Upload cancelled."));
+
+        xhr.open("PATCH", `/uploads/${upload.id}`, true);
+        xhr.setRequestHeader("Upload-Offset", String(offset));
+        xhr.send(chunk);
+    });
+}
+
+// Upload `file` into `folderPath` through a resumable session, picking up where an earlier
+// attempt (even one from before a page reload) left off. onProgress receives bytes sent so far.
+async function resumableUpload(file, folderPath, onProgress) {
+    const key = resumableKey(file, folderPath);
+    const upload = { id: localStorage.getItem(key), key: key, file: file, xhrs: new Set(), cancelled: false };
+    currentResumableUpload = upload;
+
+    if (PARALLEL_UPLOAD_STREAMS > 1) {
+        await parallelUpload(upload, folderPath, onProgress);
+        return finalizeResumableUpload(upload);
+    }
+
+    let offset = upload.id ? await resumableOffset(upload.id) : null;
+    if (offset === null) {
+        upload.id = await createResumableUpload(file, folderPath);
+        localStorage.setItem(key, upload.id);
+        offset = 0;
+    }
+    onProgress(offset);
+
+    let retries = 0;
+    while (offset < file.size) {
+        if (upload.cancelled) {
+            throw new Error("Upload cancelled.");
+        }
+        try {
+            offset = await sendResumableChunk(upload, offset, onProgress);
+            retries = 0;
+        } catch (error) {
+            if (upload.cancelled || !error.retryable || ++retries > RESUMABLE_MAX_RETRIES) {
+                throw error;
+            }
+            const delay = Math.min(30000, 1000 * 2 ** (retries - 1));
+            console.log(`Upload of ${file.name} interrupted, retrying in ${delay} ms`);
+            await new Promise(resolve => setTimeout(resolve, delay));
+            offset = await resumableOffset(upload.id).catch(() => offset);
+            if (offset === null) {
+                localStorage.removeItem(key);
+                throw new Error("Upload session expired");
+            }
+        }
+        onProgress(offset);
+    }
+    return finalizeResumableUpload(upload);
+}
+
+async function finalizeResumableUpload(upload) {
+    const response = await fetch(`/uploads/${upload.id}/finalize`, { method: "POST" });
+    if (!response.ok) {
+        throw new Error(await response.text());
+    }
+    localStorage.removeItem(upload.key);
+    currentResumableUpload = null;
+    return response.json();
+}
+
+// Base64 SHA-256 of a chunk for Upload-Checksum, or null where WebCrypto is
+// unavailable (it only exists on https:// or localhost pages); the checksum is optional.
+async function chunkChecksum(blob) {
+    if (!window.crypto || !window.crypto.subtle) {
+        return null;
+    }
+    const digest = new Uint8Array(await crypto.subtle.digest("SHA-256", await blob.arrayBuffer()));
+    return `sha256 ${btoa(String.fromCharCode(...digest))}`;
+}
+
+function sendParallelChunk(upload, index, chunkSize, checksum, onProgress) {
+    return new Promise((resolve, reject) => {
+        const start = index * chunkSize;
+        const chunk = upload.file.slice(start, Math.min(start + chunkSize, upload.file.size));
+        const xhr = new XMLHttpRequest();
+        upload.xhrs.add(xhr);
+
+        xhr.upload.onprogress = (e) => {
+            if (e.lengthComputable) {
+                onProgress(e.loaded);
+            }
+        };
+        xhr.onloadend = () => upload.xhrs.delete(xhr);
+        xhr.onload = () => {
+            if (xhr.status === 204) {
+                resolve();
+            } else {
+                const error = new Error(`Chunk ${index} failed: ${xhr.status}`);
+                // 460: checksum mismatch, the chunk was damaged on the way and is simply sent again
+                error.retryable = xhr.status === 460 || xhr.status >= 500;
+                reject(error);
+            }
+        };
+        xhr.onerror = () => {
+            const error = new Error("Network error");
+            error.retryable = true;
+            reject(error);
+        };
+        xhr.onabort = () => reject(new Error("Upload cancelled."));
+
+        xhr.open("PUT", `/uploads/${upload.id}/chunks/${index}`, true);
+        if (checksum) {
+            xhr.setRequestHeader("Upload-Checksum", checksum);
+        }
+        xhr.send(chunk);
+    });
+}
+
+async function parallelUploadStatus(uploadId) {
+    const response = await fetch(`/uploads/${uploadId}`, { cache: "no-store" });
+    if (response.status === 404) {
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error(`Upload status failed: ${response.status}`);
+    }
+    const status = await response.json();
+    return status.missing ? status : null;  // A sequential session from an older page is started over
+}
+
+// Send the chunks the server is missing over PARALLEL_UPLOAD_STREAMS connections at once.
+async function parallelUpload(upload, folderPath, onProgress) {
+    let status = upload.id ? await parallelUploadStatus(upload.id) : null;
+    if (status === null) {
+        upload.id = await createResumableUpload(upload.file, folderPath, RESUMABLE_CHUNK_SIZE);
+        localStorage.setItem(upload.key, upload.id);
+        const count = Math.max(1, Math.ceil(upload.file.size / RESUMABLE_CHUNK_SIZE));
+        status = { chunk_size: RESUMABLE_CHUNK_SIZE, missing: Array.from({ length: count }, (_, i) => i) };
+    }
+
+    const chunkSize = status.chunk_size;
+    const queue = status.missing.slice();
+    const inFlight = new Map();  // chunk index -> bytes of it sent so far
+    let completed = upload.file.size - queue.reduce(
+        (total, index) => total + Math.min(chunkSize, upload.file.size - index * chunkSize), 0);
+    const report = () => {
+        let sent = completed;
+        inFlight.forEach(bytes => { sent += bytes; });
+        onProgress(sent);
+    };
+    report();
+
+    const worker = async () => {
+        while (queue.length > 0) {
+            if (upload.cancelled) {
+                throw new Error("Upload cancelled.");
+            }
+            const index = queue.shift();
+            const start = index * chunkSize;
+            const checksum = await chunkChecksum(upload.file.slice(start, Math.min(start + chunkSize, upload.file.size)));
+            for (let retries = 0; ; retries++) {
+                inFlight.set(index, 0);
+                try {
+                    await sendParallelChunk(upload, index, chunkSize, checksum, (loaded) => {
+                        inFlight.set(index, loaded);
+                        report();
+                    });
+                    break;
+                } catch (error) {
+                    inFlight.delete(index);
+                    if (upload.cancelled || !error.retryable || retries >= RESUMABLE_MAX_RETRIES) {
+                        throw error;
+                    }
+                    const delay = Math.min(30000, 1000 * 2 ** retries);
+                    console.log(`Chunk ${index} of ${upload.file.name} failed, retrying in ${delay} ms`);
+                    await new Promise(resolve => setTimeout(resolve, delay));
+                }
+            }
+            inFlight.delete(index);
+            completed += Math.min(chunkSize, upload.file.size - start);
+            report();
+        }
+    };
+
+    const workers = [];
+    for (let i = 0; i < Math.min(PARALLEL_UPLOAD_STREAMS, queue.length); i++) {
+        workers.push(worker());
+    }
+    try {
+        await Promise.all(workers);
+    } catch (error) {
+        // Stop the other streams; the session is kept so a later attempt resumes it
+        upload.cancelled = true;
+        upload.xhrs.forEach(xhr => xhr.abort());
+        throw error;
+    }
+}
+
+function cancelResumableUpload() {
+    const upload = currentResumableUpload;
+    if (!upload) {
+        return;
+    }
+    currentResumableUpload = null;
+    upload.cancelled = true;
+    upload.xhrs.forEach(xhr => xhr.abort());
+    if (upload.id) {
+        localStorage.removeItem(upload.key);
+        fetch(`/uploads/${upload.id}`, { method: "DELETE" }).catch(() => {});
+    }
+}
+
 function uploadFilesSequentially() {
     if (wasCancelled) {
         return;
@@ -58,6 +668,11 @@ function uploadFilesSequentially() {
 
     document.getElementById("uploadFilename").textContent = `Uploading: ${file.name}`;
 
+    if (file.size >= RESUMABLE_THRESHOLD) {
+        uploadLargeFile(file);
+        return;
+    }
+
     const formData = new FormData();
     formData.append("file", file);
 
@@ -119,6 +734,44 @@ function uploadFilesSequentially() {
     xhr.send(formData);
 }
 
+function uploadLargeFile(file) {
+    uploadStartTime = Date.now();
+    const startOffset = { value: null };
+
+    document.getElementById("progressWrapper").style.display = "flex";
+    document.getElementById("cancelUploadBtn").style.display = "inline";
+    document.getElementById("progressBar").style.width = "0%";
+    document.getElementById("uploadSpeedText").textContent = "";
+
+    resumableUpload(file, currentPath, (sent) => {
+        if (startOffset.value === null) {
+            startOffset.value = sent;  // Bytes resumed from an earlier attempt don't count towards speed
+        }
+        const percent = file.size ? (sent / file.size) * 100 : 100;
+        document.getElementById("progressBar").style.width = percent + "%";
+        document.getElementById("progressText").textContent = Math.round(percent) + "%";
+
+        const elapsedSeconds = (Date.now() - uploadStartTime) / 1000;
+        if (elapsedSeconds > 0) {
+            document.getElementById("uploadSpeedText").textContent = formatSpeed((sent - startOffset.value) / elapsedSeconds);
+        }
+    }).then(() => {
+        if (wasCancelled) {
+            return;
+        }
+        appendUploadedFileToList(file.name, `${encodeURIComponent(file.name)}`);
+        ++currentFileIndex;
+        uploadFilesSequentially();
+    }).catch((error) => {
+        if (wasCancelled) {
+            console.log("Upload cancelled, skipping next file.");
+            return;
+        }
+        console.log(error);
+        alert("Upload failed");
+    });
+}
+
 document.addEventListener("DOMContentLoaded", () => {
     if (localStorage.getItem("showUploadModal") === "true") {
         openUploadModal();
@@ -194,6 +847,8 @@ document.getElementById("cancelUploadBtn").addEventListener("click", () => {
         currentXHR.abort();
         currentXHR = null;
     }
+    const resumableCancelled = currentResumableUpload !== null;
+    cancelResumableUpload();
 
     localStorage.removeItem("uploadedFiles");
     localStorage.removeItem("showUploadModal");
@@ -210,7 +865,8 @@ document.getElementById("cancelUploadBtn").addEventListener("click", () => {
     allFiles = []; // Clear upload queue
     currentFileIndex = 0;
     console.log("Last uploaded file: " + filename);
-    if (filename) {
+    // An unfinished resumable upload never reached the folder; its session was deleted above
+    if (filename && !resumableCancelled) {
         console.log("Will attempt to delete: " + filename);
         setTimeout(() => {
             console.log("Deleting file after cancel: " + filename);
@@ -243,6 +899,11 @@ document.getElementById("cancelUploadBtn").addEventListener("click", () => {
     }
 });
 
+// Folder uploads: files smaller than BATCH_FILE_LIMIT are packed into one /upload-batch request
+const BATCH_FILE_LIMIT = 4 * 1024 * 1024;
+const BATCH_MAX_BYTES = 64 * 1024 * 1024;
+const BATCH_MAX_FILES = 1000;
+
 function triggerFolderUpload() {
     const input = document.createElement('input');
     input.type = 'file';
@@ -282,6 +943,21 @@ function triggerFolderUpload() {
                 formData.append("file", file);
 
                 const uploadPath = `${currentPath}${relativePath.substring(0, relativePath.lastIndexOf("/"))}`;
+
+                if (file.size >= RESUMABLE_THRESHOLD) {
+                    document.getElementById("uploadFilename").textContent = `Uploading: ${file.name}`;
+                    let fileSent = 0;
+                    folderUploadXHRs.push({ abort: cancelResumableUpload }); // Keep track for cancel
+                    resumableUpload(file, uploadPath, (sent) => {
+                        uploadedSize += sent - fileSent;
+                        fileSent = sent;
+                        const percent = (uploadedSize / totalSize) * 100;
+                        document.getElementById("progressBar").style.width = percent + "%";
+                        document.getElementById("progressText").textContent = Math.round(percent) + "%";
+                    }).then(resolve, (error) => reject(folderUploadCancelled ? "Upload cancelled." : `Upload failed for ${file.name}: ${error.message}`));
+                    return;
+                }
+
                 const xhr = new XMLHttpRequest();
 
                 folderUploadXHRs.push(xhr); // Keep track for cancel
@@ -329,15 +1005,87 @@ function triggerFolderUpload() {
             });
         };
 
+        const uploadBatch = (batch) => {
+            return new Promise((resolve, reject) => {
+                if (folderUploadCancelled) {
+                    reject("Upload cancelled.");
+                    return;
+                }
+
+                const formData = new FormData();
+                batch.forEach(file => {
+                    formData.append("relpath", file.webkitRelativePath);
+                    formData.append("file", file);
+                });
+                const batchSize = batch.reduce((acc, f) => acc + f.size, 0);
+                const xhr = new XMLHttpRequest();
+                folderUploadXHRs.push(xhr); // Keep track for cancel
+
+                const batchStartTime = Date.now();
+                let counted = 0;
+                document.getElementById("uploadFilename").textContent =
+                    batch.length === 1 ? `Uploading: ${batch[0].name}` : `Uploading: ${batch.length} files`;
+
+                xhr.open("POST", `/upload-batch?path=${encodeURIComponent(currentPath)}`, true);
+
+                xhr.upload.onprogress = (e) => {
+                    if (e.lengthComputable) {
+                        // e.total includes the multipart headers; scale to the file bytes it carries
+                        const sent = Math.round(batchSize * (e.loaded / e.total));
+                        uploadedSize += sent - counted;
+                        counted = sent;
+                        const percent = Math.min(100, (uploadedSize / totalSize) * 100);
+                        document.getElementById("progressBar").style.width = percent + "%";
+                        document.getElementById("progressText").textContent = Math.round(percent) + "%";
+
+                        const elapsedSeconds = (Date.now() - batchStartTime) / 1000;
+                        uploadSpeedText.textContent = formatSpeed(e.loaded / elapsedSeconds);
+                    }
+                };
+
+                xhr.onreadystatechange = () => {
+                    if (xhr.readyState === 4) {
+                        if (folderUploadCancelled) {
+                            reject("Upload cancelled.");
+                        } else if (xhr.status >= 200 && xhr.status < 300) {
+                            uploadedSize += batchSize - counted;
+                            resolve();
+                        } else {
+                            reject(`Upload failed for ${batch.length} files: ${xhr.statusText}`);
+                        }
+                    }
+                };
+
+                xhr.send(formData);
+            });
+        };
+
         (async () => {
             try {
+                // Small files travel together, large ones on their own (resumable above RESUMABLE_THRESHOLD)
+                let batch = [];
+                let batchBytes = 0;
                 for (const file of files) {
                     const relativePath = file.webkitRelativePath;
-                    if (relativePath) {
+                    if (!relativePath) {
+                        continue;
+                    }
+                    if (file.size >= BATCH_FILE_LIMIT) {
                         await uploadFile(file, relativePath);
+                    } else {
+                        batch.push(file);
+                        batchBytes += file.size;
+                        if (batch.length >= BATCH_MAX_FILES || batchBytes >= BATCH_MAX_BYTES) {
+                            await uploadBatch(batch);
+                            batch = [];
+                            batchBytes = 0;
+                        }
                     }
                     if (folderUploadCancelled) break;
                 }
+                if (batch.length > 0 && !folderUploadCancelled) {
+                    await uploadBatch(batch);
+                }
 
                 if (!folderUploadCancelled) {
                     setTimeout(() => {
@@ -407,9 +1155,8 @@ function toggleDropdownMain(event) {
 
 // Toggle display of bulk dropdown based on checkbox selection
 function toggleBulkDeleteButton() {
-    const checked = document.querySelectorAll(".fileCheckbox:checked").length > 0;
     const bulkDropdown = document.getElementById("bulkActionsDropdown");
-    bulkDropdown.style.display = checked ? "inline-block" : "none";
+    bulkDropdown.style.display = selectedEntries.size > 0 ? "inline-block" : "none";
 }
 
 // Toggle dropdown visibility on click
@@ -437,24 +1184,34 @@ document.addEventListener("click", function () {
     });
 });
 
-// Toggle select all
+// Toggle select all (every entry loaded so far)
 document.getElementById("selectAll").addEventListener("change", function () {
-    const checkboxes = document.querySelectorAll(".fileCheckbox");
-    checkboxes.forEach(cb => cb.checked = this.checked);
+    selectedEntries.clear();
+    if (this.checked) {
+        listingEntries.forEach(entry => selectedEntries.set(entry.name, entry));
+    }
+    document.querySelectorAll(".fileCheckbox").forEach(cb => cb.checked = this.checked);
     toggleBulkDeleteButton();
 });
 
 // Attach change listener to individual checkboxes
 document.addEventListener("change", function (e) {
     if (e.target.classList.contains("fileCheckbox")) {
+        const entry = listingEntries[Number(e.target.dataset.index)];
+        if (entry) {
+            if (e.target.checked) {
+                selectedEntries.set(entry.name, entry);
+            } else {
+                selectedEntries.delete(entry.name);
+            }
+        }
         toggleBulkDeleteButton();
     }
 });
 
 // Handle bulk delete
 document.getElementById("bulkDelete-btn").addEventListener("click", function () {
-    const selected = Array.from(document.querySelectorAll(".fileCheckbox:checked"))
-                          .map(cb => cb.getAttribute("data-name"));
+    const selected = Array.from(selectedEntries.keys());
 
     if (selected.length === 0) {
         return;
@@ -474,14 +1231,34 @@ document.getElementById("bulkDelete-btn").addEventListener("click", function ()
 });
 
 document.getElementById("bulkDownload-btn").addEventListener("click", async function () {
-    const selectedCheckboxes = Array.from(document.querySelectorAll(".fileCheckbox:checked"));
+    const selected = Array.from(selectedEntries.values());
 
-    if (selectedCheckboxes.length === 0) return;
+    if (selected.length === 0) return;
 
-    if (!confirm(`Are you sure you want to download ${selectedCheckboxes.length} item(s)?`)) return;
+    if (!confirm(`Are you sure you want to download ${selected.length} item(s)?`)) return;
 
     // Collect all paths
-    const paths = selectedCheckboxes.map(cb => cb.getAttribute("data-path"));
+    const paths = selected.map(entryRelPath);
+
+    if (ZIP_STREAMING || DOWNLOAD_ARCHIVE_FORMAT !== 'zip') {
+        // A form post lets the browser's download manager take the streamed response
+        const form = document.createElement('form');
+        form.method = 'POST';
+        form.action = '/bulk-download-zip';
+        form.style.display = 'none';
+        const fields = { paths: JSON.stringify(paths), stream: '1', compression: ZIP_STREAM_COMPRESSION, format: DOWNLOAD_ARCHIVE_FORMAT };
+        Object.entries(fields).forEach(([name, value]) => {
+            const input = document.createElement('input');
+            input.type = 'hidden';
+            input.name = name;
+            input.value = value;
+            form.appendChild(input);
+        });
+        document.body.appendChild(form);
+        form.submit();
+        document.body.removeChild(form);
+        return;
+    }
 
     // Show progress UI
     const progressWrapper = document.getElementById('zipProgressWrapper');
@@ -494,7 +1271,7 @@ document.getElementById("bulkDownload-btn").addEventListener("click", async func
     cancelZipBtn.style.display = 'inline-block';
     progressBar.style.width = '0%';
     progressText.textContent = '0%';
-    filenameLabel.textContent = `Zipping ${selectedCheckboxes.length} item(s)...`;
+    filenameLabel.textContent = `Zipping ${selected.length} item(s)...`;
 
     try {
         // Step 1: Send POST request to bulk-zip API
@@ -504,49 +1281,40 @@ document.getElementById("bulkDownload-btn").addEventListener("click", async func
             body: JSON.stringify({ paths })
         });
 
-        if (!response.ok) throw new Error("Failed to start bulk zip");
+        const jobId = await startZipJob(response);
+        currentZipJobId = jobId;
 
-        const data = await response.json();
-        const jobId = data.job_id;
-
-        // Step 2: Poll progress every 500ms
-        const pollProgress = setInterval(async () => {
-            try {
-                const progRes = await fetch(`/zip-progress?job_id=${jobId}`);
-                const progData = await progRes.json();
-                const prog = progData.progress;
-
-                if (prog < 0) {
-                    clearInterval(pollProgress);
+        // Step 2: Follow the job's progress events
+        watchJob(jobId, job => {
+            if (job.state === 'failed' || job.state === 'cancelled') {
+                unwatchJob(jobId);
+                currentZipJobId = null;
+                if (job.state === 'failed') {
                     alert("Error creating zip file.");
-                    progressWrapper.style.display = 'none';
-                    cancelZipBtn.style.display = 'none';
-                    return;
                 }
+                progressWrapper.style.display = 'none';
+                cancelZipBtn.style.display = 'none';
+                return;
+            }
 
-                progressBar.style.width = prog + '%';
-                progressText.textContent = prog + '%';
+            progressBar.style.width = job.progress + '%';
+            progressText.textContent = zipJobLabel(job);
 
-                if (prog >= 100) {
-                    clearInterval(pollProgress);
-                    // Step 3: Trigger download
-                    const a = document.createElement('a');
-                    a.href = `/download-zip-file?job_id=${jobId}`;
-                    a.download = '';
-                    document.body.appendChild(a);
-                    a.click();
-                    document.body.removeChild(a);
+            if (job.state === 'done') {
+                unwatchJob(jobId);
+                currentZipJobId = null;
+                // Step 3: Trigger download
+                const a = document.createElement('a');
+                a.href = `/download-zip-file?job_id=${jobId}`;
+                a.download = '';
+                document.body.appendChild(a);
+                a.click();
+                document.body.removeChild(a);
 
-                    progressWrapper.style.display = 'none';
-                    cancelZipBtn.style.display = 'none';
-                }
-            } catch (err) {
-                clearInterval(pollProgress);
-                alert("Error fetching zip progress.");
                 progressWrapper.style.display = 'none';
                 cancelZipBtn.style.display = 'none';
             }
-        }, 500);
+        });
 
     } catch (err) {
         alert(err.message);
@@ -647,25 +1415,9 @@ function previewFile(fileName) {
 
     document.getElementById("previewFileName").textContent = fileName;
 
-	// Get all image links on the page
-    const links = Array.from(document.querySelectorAll('.file-table td a'));
-    const hrefs = links
-        .map(link => link.getAttribute('href'))
-        .filter(href => href && /\.(png|jpe?g|gif|bmp|webp|mp4|webm|ogg)$/i.test(href))
-        .map(href => decodeURIComponent(href));
-
-    // Remove duplicates using Set
-    mediaFiles = Array.from(new Set(hrefs));
-
-    // Find index of current media
-    currentMediaIndex = mediaFiles.findIndex(f => {
-        const decodedName = decodeURIComponent(f).split('/').pop().toLowerCase();
-        return decodedName === fileName.toLowerCase();
-    });
-
     if (["png", "jpg", "jpeg", "gif", "bmp", "webp"].includes(ext)) {
         document.getElementById("previewContent").innerHTML = `<img src="${fullPath}" alt="Image Preview" style="max-width: 100%; max-height: 80vh;" />`;
-        updateCarousel();
+        loadMediaFiles(fileName);
         document.getElementById("previewModal").style.display = "flex";
     } else if (["mp4", "webm", "ogg"].includes(ext)) {
         document.getElementById("previewContent").innerHTML = `
@@ -674,7 +1426,7 @@ function previewFile(fileName) {
                 Your browser does not support the video tag.
             </video>
         `;
-        updateCarousel();
+        loadMediaFiles(fileName);
         document.getElementById("previewModal").style.display = "flex";
     } else if (["mp3", "wav", "ogg"].includes(ext)) {
         // existing audio preview code...
@@ -710,6 +1462,23 @@ function previewFile(fileName) {
     }
 }
 
+// Fill mediaFiles (URL-encoded names, in listing order) for the carousel and arrow keys
+function loadMediaFiles(fileName) {
+    mediaFiles = [];
+    mediaVersions = [];
+    currentMediaIndex = -1;
+    updateCarousel();
+
+    getMediaEntries()
+        .then(entries => {
+            mediaFiles = entries.map(entry => encodeURIComponent(entry.name));
+            mediaVersions = entries.map(entry => entry.mtime);
+            currentMediaIndex = entries.findIndex(entry => entry.name === fileName);
+            updateCarousel();
+        })
+        .catch(err => console.error("Failed to load media list:", err));
+}
+
 // Update showPrevMedia and showNextMedia to also update carousel selection
 function showPrevMedia() {
     if (mediaFiles.length === 0) {
@@ -777,24 +1546,18 @@ function updateCarousel() {
 
     for (let index = start; index <= end; index++) {
         const mediaPath = mediaFiles[index];
-        const fileName = mediaPath.split('/').pop();
+        const fileName = decodeURIComponent(mediaPath.split('/').pop());
         const ext = fileName.split('.').pop().toLowerCase();
 
         let thumb;
 
         if (["png", "jpg", "jpeg", "gif", "bmp", "webp"].includes(ext)) {
-            thumb = document.createElement("img");
-            thumb.src = mediaPath;
+            thumb = createThumb(mediaPath, 160, mediaVersions[index], false);
             thumb.alt = fileName;
         } else if (["mp4", "webm", "ogg"].includes(ext)) {
-            thumb = document.createElement("video");
-            thumb.src = mediaPath;
-            thumb.muted = true;
-            thumb.loop = true;
-            thumb.playsInline = true;
+            thumb = createThumb(mediaPath, 160, mediaVersions[index], true);
             thumb.style.height = "80px";
             thumb.style.width = "auto";
-            thumb.autoplay = true;
         } else {
             // Skip unsupported thumbnails
             continue;
@@ -805,11 +1568,11 @@ function updateCarousel() {
             thumb.classList.add("selected");
         }
 
-        thumb.addEventListener("click", () => {
+        thumb.onclick = () => {
             currentMediaIndex = index;
             previewMediaAtIndex(currentMediaIndex);
             updateCarousel();
-        });
+        };
 
         carousel.appendChild(thumb);
     }
@@ -821,7 +1584,7 @@ function previewMediaAtIndex(index) {
     }
 
     const mediaPath = mediaFiles[index];
-    const fileName = mediaPath.split('/').pop();
+    const fileName = decodeURIComponent(mediaPath.split('/').pop());
     const ext = fileName.split('.').pop().toLowerCase();
 
     document.getElementById("previewFileName").textContent = fileName;
@@ -829,7 +1592,7 @@ function previewMediaAtIndex(index) {
     let content = "";
 
     if (["png", "jpg", "jpeg", "gif", "bmp", "webp"].includes(ext)) {
-        content = `<img src="${mediaPath}" alt="${fileName}" style="max-width: 100%; max-height: 80vh;" />`;
+        content = `<img src="${mediaPath}" alt="${escapeHtml(fileName)}" style="max-width: 100%; max-height: 80vh;" />`;
     } else if (["mp4", "webm", "ogg"].includes(ext)) {
         content = `
             <video controls autoplay style="max-width: 100%; max-height: 80vh;">
@@ -918,15 +1681,56 @@ document.getElementById("detailModal").addEventListener("click", function(event)
 });
 
 function openGallery() {
-    const mediaExtensions = /\.(png|jpe?g|gif|bmp|webp|mp4|webm|ogg)$/i;
-    const links = Array.from(document.querySelectorAll('.file-table td a'));
-    const mediaLinksList = links
-        .map(link => link.getAttribute('href'))
-        .filter(href => href && mediaExtensions.test(href))
-        .map(href => decodeURIComponent(href));
+    getMediaEntries()
+        .then(showGallery)
+        .catch(err => {
+            alert(err.message);
+            console.error(err);
+        });
+}
+
+// URL of the thumbnail of a media link (relative to this folder), at least `size` CSS pixels.
+// `version` (the file's mtime) makes the URL change with the file, so it can be cached.
+function thumbUrl(href, size, version) {
+    const path = decodeURIComponent(new URL(href, window.location.href).pathname);
+    const query = new URLSearchParams({
+        path,
+        size: Math.round(size * Math.min(window.devicePixelRatio || 1, 2)),
+        format: THUMB_FORMAT,
+    });
+    if (version) {
+        query.set("v", version);
+    }
+    return `/thumb?${query}`;
+}
 
-    // Remove duplicates using Set
-    mediaLinks = Array.from(new Set(mediaLinksList));
+// Thumbnail <img> that falls back to the original (images) or to a video's first frame
+// (videos, no autoplay) when the server cannot make one
+function createThumb(href, size, version, isVideo) {
+    const thumb = document.createElement("img");
+    thumb.src = thumbUrl(href, size, version);
+    thumb.loading = "lazy";
+    thumb.addEventListener("error", () => {
+        if (!isVideo) {
+            thumb.src = href;
+            return;
+        }
+        const video = document.createElement("video");
+        video.src = href;
+        video.preload = "metadata";
+        video.muted = true;
+        video.playsInline = true;
+        video.className = thumb.className;
+        video.title = thumb.title;
+        video.style.cssText = thumb.style.cssText;
+        video.onclick = thumb.onclick;
+        thumb.replaceWith(video);
+    }, { once: true });
+    return thumb;
+}
+
+function showGallery(entries) {
+    const mediaLinks = entries.map(entry => encodeURIComponent(entry.name));
 
     // Dynamically set number of columns
     const modalContent = document.querySelector(".gallery-modal-content");
@@ -943,28 +1747,17 @@ function openGallery() {
         return;
     }
 
-    mediaLinks.forEach(href => {
-        const fileName = href.split("/").pop();
+    mediaLinks.forEach((href, index) => {
+        const fileName = decodeURIComponent(href);
         const ext = fileName.split(".").pop().toLowerCase();
-        let thumb;
-
-        if (["png", "jpg", "jpeg", "gif", "bmp", "webp"].includes(ext)) {
-            thumb = document.createElement("img");
-            thumb.src = href;
-        } else if (["mp4", "webm", "ogg"].includes(ext)) {
-            thumb = document.createElement("video");
-            thumb.src = href;
-            thumb.muted = true;
-            thumb.loop = true;
-            thumb.playsInline = true;
-            thumb.autoplay = true;
-        }
+        const isVideo = ["mp4", "webm", "ogg"].includes(ext);
+        const thumb = createThumb(href, thumbMaxSize, entries[index].mtime, isVideo);
 
         thumb.title = fileName;
-        thumb.addEventListener("click", () => {
+        thumb.onclick = () => {
             console.log("Href: " + href);
             window.open(href, '_blank');
-        });
+        };
 
         gallery.appendChild(thumb);
     });
@@ -1100,8 +1893,111 @@ function renameItem(name) {
     });
 }
 
+// Background job updates, pushed for all of the profile's jobs on one /events stream;
+// long-polled where EventSource is missing or the server turns the stream away
+const JOB_EVENT_TYPES = ['queued', 'progress', 'done', 'failed', 'cancelled'];
+const jobWatchers = new Map();  // job id -> function(job record)
+let jobEventSource = null;
+let jobPollActive = false;
+
+function dispatchJobEvent(job) {
+    const watcher = jobWatchers.get(job.job_id);
+    if (watcher) {
+        watcher(job);
+    }
+}
+
+function watchJob(jobId, onUpdate) {
+    jobWatchers.set(jobId, onUpdate);
+    if (jobEventSource || jobPollActive) {
+        return;
+    }
+    if (!window.EventSource) {
+        pollJobEvents();
+        return;
+    }
+    const source = new EventSource('/events');
+    JOB_EVENT_TYPES.forEach(type => {
+        source.addEventListener(type, event => dispatchJobEvent(JSON.parse(event.data)));
+    });
+    source.onerror = () => {
+        // The browser retries dropped streams by itself, but not refused ones
+        if (source.readyState === EventSource.CLOSED && jobEventSource === source) {
+            jobEventSource = null;
+            if (jobWatchers.size) {
+                pollJobEvents();
+            }
+        }
+    };
+    jobEventSource = source;
+}
+
+function unwatchJob(jobId) {
+    jobWatchers.delete(jobId);
+    if (jobWatchers.size === 0 && jobEventSource) {
+        jobEventSource.close();
+        jobEventSource = null;
+    }
+}
+
+async function pollJobEvents() {
+    jobPollActive = true;
+    let cursor = 0;
+    while (jobWatchers.size) {
+        try {
+            const res = await fetch(`/events?poll=1&since=${cursor}`);
+            if (!res.ok) {
+                throw new Error(`HTTP ${res.status}`);
+            }
+            const data = await res.json();
+            cursor = data.cursor;
+            data.events.forEach(dispatchJobEvent);
+            // A busy server answers at once and says when to ask again
+            const retryAfter = parseInt(res.headers.get('Retry-After'), 10);
+            if (retryAfter > 0) {
+                await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+            }
+        } catch (err) {
+            console.error("Job events error:", err);
+            await new Promise(resolve => setTimeout(resolve, 2000));
+        }
+    }
+    jobPollActive = false;
+}
+
+// Progress text for a zip job record from /events or /zip-progress
+function zipJobLabel(job) {
+    if (job.state === 'queued') {
+        return `Queued (#${job.position})`;
+    }
+    if (job.eta === null || job.eta === undefined) {
+        return job.progress + '%';
+    }
+    const eta = job.eta >= 60 ? `${Math.floor(job.eta / 60)}m ${job.eta % 60}s` : `${job.eta}s`;
+    return `${job.progress}% (${eta} left)`;
+}
+
+// Start a zip job; rejects with the server's reason (queue full, not enough space)
+async function startZipJob(response) {
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        throw new Error(data.error || "Failed to start zip download.");
+    }
+    return data.job_id;
+}
+
 // Start ZIP download with progress bar updates
 function startZipDownload(folderPath) {
+    if (ZIP_STREAMING || DOWNLOAD_ARCHIVE_FORMAT !== 'zip') {
+        const a = document.createElement('a');
+        a.href = `/download-zip?folder=${encodeURIComponent(folderPath)}&stream=1&compression=${ZIP_STREAM_COMPRESSION}&format=${DOWNLOAD_ARCHIVE_FORMAT}`;
+        a.download = '';
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+        return;
+    }
+
     const progressWrapper = document.getElementById('zipProgressWrapper');
     const progressBar = document.getElementById('zipProgressBar');
     const progressText = document.getElementById('zipProgressText');
@@ -1119,55 +2015,37 @@ function startZipDownload(folderPath) {
 
     // Step 1: Start zip creation job
     fetch(`/download-zip?folder=${encodeURIComponent(folderPath)}`)
-        .then(response => response.json())
-        .then(data => {
-            const jobId = data.job_id;
+        .then(startZipJob)
+        .then(jobId => {
             currentZipJobId = jobId;
 
-            if (zipProgressIntervalId) {
-                clearInterval(zipProgressIntervalId);
-            }
+            // Step 2: Follow the job's progress events
+            watchJob(jobId, job => {
+                if (job.state === 'failed' || job.state === 'cancelled') {
+                    unwatchJob(jobId);
+                    if (job.state === 'failed') {
+                        alert("Error creating zip file.");
+                    }
+                    progressWrapper.style.display = 'none';
+                    cancelZipBtn.style.display = 'none';
+                    currentZipJobId = null;
+                    return;
+                }
+                progressBar.style.width = job.progress + '%';
+                progressText.textContent = zipJobLabel(job);
 
-            // Step 2: Poll progress every 500ms
-            zipProgressIntervalId = setInterval(() => {
-                fetch(`/zip-progress?job_id=${jobId}`)
-                    .then(res => res.json())
-                    .then(progressData => {
-                        const prog = progressData.progress;
-                        if (prog < 0) {
-                            clearInterval(zipProgressIntervalId);
-                            zipProgressIntervalId = null;
-                            alert("Error creating zip file.");
-                            progressWrapper.style.display = 'none';
-                            cancelZipBtn.style.display = 'none';
-                            currentZipJobId = null;
-                            return;
-                        }
-                        progressBar.style.width = prog + '%';
-                        progressText.textContent = prog + '%';
-
-                        if (prog >= 100) {
-                            clearInterval(zipProgressIntervalId);
-                            zipProgressIntervalId = null;
-                            // Step 3: Trigger file download
-                            window.location.href = `/download-zip-file?job_id=${jobId}`;
-                            progressWrapper.style.display = 'none';
-                            cancelZipBtn.style.display = 'none';
-                            currentZipJobId = null;
-                        }
-                    })
-                    .catch(() => {
-                        clearInterval(zipProgressIntervalId);
-                        zipProgressIntervalId = null;
-                        alert("Error fetching zip progress.");
-                        progressWrapper.style.display = 'none';
-                        cancelZipBtn.style.display = 'none';
-                        currentZipJobId = null;
-                    });
-            }, 500);
+                if (job.state === 'done') {
+                    unwatchJob(jobId);
+                    // Step 3: Trigger file download
+                    window.location.href = `/download-zip-file?job_id=${jobId}`;
+                    progressWrapper.style.display = 'none';
+                    cancelZipBtn.style.display = 'none';
+                    currentZipJobId = null;
+                }
+            });
         })
-        .catch(() => {
-            alert("Failed to start zip download.");
+        .catch(err => {
+            alert(err.message);
             progressWrapper.style.display = 'none';
             cancelZipBtn.style.display = 'none';
         });
@@ -1182,11 +2060,8 @@ document.getElementById("cancelZipBtn").addEventListener("click", () => {
     .then(res => res.text())
     .then(msg => {
       console.log("Canceled:", msg);
-      // Stop progress polling
-      if (zipProgressIntervalId) {
-          clearInterval(zipProgressIntervalId);
-          zipProgressIntervalId = null;
-      }
+      // Stop following the job
+      unwatchJob(currentZipJobId);
 
       // Reset job ID so no download triggers
       currentZipJobId = null;
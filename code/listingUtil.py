@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import base64
+import threading
+import traceback
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from loadDirectoryUtil import scanDirectory, translatePath
+from profileUtil import get_profile_dir
+from responseUtil import send_json, send_text
+from thumbIndexUtil import note_folder
+
+DEFAULT_PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+# A sorted scan is reused while the directory mtime is unchanged and the scan is
+# younger than the TTL (file sizes can change without touching the directory)
+LISTING_CACHE_TTL = 10
+LISTING_CACHE_SIZE = 32
+
+MEDIA_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp", ".mp4", ".webm", ".ogg")
+
+# Entries are (name, is_folder, is_file, size, mtime) tuples from scanDirectory.
+# Every key ends with the name so the order is total and usable as a cursor.
+SORT_KEYS = {
+    "name": lambda e: (e[0].lower(), e[0]),
+    "size": lambda e: (e[3] if e[2] else -1, e[0].lower(), e[0]),
+    "mtime": lambda e: (e[4] or 0, e[0].lower(), e[0]),
+    "type": lambda e: (not e[1], os.path.splitext(e[0])[1].lower(), e[0].lower(), e[0]),
+}
+
+TYPE_FILTERS = {
+    "all": None,
+    "folder": lambda e: e[1],
+    "file": lambda e: not e[1],
+    "media": lambda e: not e[1] and e[0].lower().endswith(MEDIA_EXTENSIONS),
+}
+
+_listing_cache = OrderedDict()
+_listing_lock = threading.Lock()
+
+def get_sorted_listing(path, sort, search, type_filter):
+    """Return (sort keys, entries) for a directory in ascending order, from the cache when still valid."""
+    dir_mtime = os.stat(path).st_mtime_ns
+    cache_key = (path, sort, search, type_filter)
+    now = time.monotonic()
+
+    with _listing_lock:
+        cached = _listing_cache.get(cache_key)
+        if cached and cached[0] == dir_mtime and now - cached[1] < LISTING_CACHE_TTL:
+            _listing_cache.move_to_end(cache_key)
+            return cached[2], cached[3]
+
+    entries = scanDirectory(path, search=search)
+    keep = TYPE_FILTERS[type_filter]
+    if keep:
+        entries = [entry for entry in entries if keep(entry)]
+    sort_key = SORT_KEYS[sort]
+    entries.sort(key=sort_key)
+    keys = [sort_key(entry) for entry in entries]
+
+    with _listing_lock:
+        _listing_cache[cache_key] = (dir_mtime, now, keys, entries)
+        _listing_cache.move_to_end(cache_key)
+        while len(_listing_cache) > LISTING_CACHE_SIZE:
+            _listing_cache.popitem(last=False)
+    return keys, entries
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Sort key of the last entry the client has seen. Raises ValueError if malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(key, list):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+def page_listing(keys, entries, order, cursor_key, limit):
+    """
+    Slice one page after the cursor. Cursors are sort keys rather than offsets,
+    so entries added or removed between requests do not shift the pages.
+    Returns (page entries, key of the last returned entry or None when done).
+    """
+    if order == "desc":
+        end = bisect_left(keys, cursor_key) if cursor_key is not None else len(keys)
+        start = max(0, end - limit)
+        page = entries[start:end][::-1]
+        return page, keys[start] if start > 0 else None
+
+    start = bisect_right(keys, cursor_key) if cursor_key is not None else 0
+    end = min(len(keys), start + limit)
+    return entries[start:end], keys[end - 1] if end < len(keys) else None
+
+def list_directory_json(handler, parsed_url, profile_root):
+    """
+    GET /list?path=<folder>&sort=name|size|mtime|type&order=asc|desc&q=<text>&type=all|folder|file|media&cursor=<c>&limit=<n>
+    One page of a folder listing as JSON, with a cursor for the next page.
+    """
+    query = parse_qs(parsed_url.query)
+    sort = query.get("sort", ["name"])[0]
+    order = query.get("order", ["asc"])[0]
+    type_filter = query.get("type", ["all"])[0]
+    search = query.get("q", [""])[0].strip().lower()
+    cursor = query.get("cursor", [""])[0]
+
+    if sort not in SORT_KEYS or order not in ("asc", "desc") or type_filter not in TYPE_FILTERS:
+        send_text(handler, 400, "Invalid sort, order or type")
+        return
+
+    try:
+        limit = int(query.get("limit", [DEFAULT_PAGE_SIZE])[0])
+        cursor_key = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        send_text(handler, 400, "Invalid limit or cursor")
+        return
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    profile_dir = get_profile_dir(handler, profile_root)
+    path = translatePath(handler, query.get("path", ["/"])[0], profile_root)
+    if not os.path.isdir(path):
+        send_text(handler, 404, "Folder not found")
+        return
+
+    try:
+        keys, entries = get_sorted_listing(path, sort, search, type_filter)
+        page, last_key = page_listing(keys, entries, order, cursor_key, limit)
+    except OSError:
+        send_text(handler, 404, "No permission to list directory")
+        return
+    except TypeError:
+        # Cursor from a different sort order
+        send_text(handler, 400, "Invalid cursor")
+        return
+    except Exception as e:
+        print("Error listing directory:", e)
+        traceback.print_exc()
+        send_text(handler, 500, "Failed to list directory")
+        return
+
+    if not cursor:
+        # A folder being looked at gets its thumbnails made first
+        note_folder(path)
+
+    rel_path = os.path.relpath(path, profile_dir)
+    send_json(handler, 200, {
+        "profile": os.path.basename(profile_dir),
+        "path": "" if rel_path == "." else rel_path.replace(os.sep, "/"),
+        "total": len(entries),
+        "entries": [
+            {
+                "name": name,
+                "type": "folder" if is_folder else "file",
+                "size": size if is_file else None,
+                "mtime": mtime,
+            }
+            for name, is_folder, is_file, size, mtime in page
+        ],
+        "next_cursor": encode_cursor(last_key) if last_key is not None else None,
+    })
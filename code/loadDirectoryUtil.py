@@ -1,22 +1,63 @@
 import os
 from io import BytesIO
-from datetime import datetime
+from html import escape
+from stat import S_ISDIR, S_ISREG
 from errorUtil import send_error_page
+from templateUtil import get_template
+from cacheUtil import content_etag, send_cache_headers, send_if_not_modified
 from profileUtil import get_profile_dir
 from urllib.parse import quote, unquote, urlparse, parse_qs
 
+def scanDirectory(path, search="", skip_hidden=True, with_stat=True):
+    """
+    Read a directory in one os.scandir pass.
+    Returns (name, is_folder, is_file, size, mtime) tuples sorted by name. The entry type
+    comes from the directory entry itself and size / mtime from a single stat per entry,
+    which is skipped entirely when with_stat is False.
+    Raises OSError if the directory cannot be read.
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if skip_hidden and name.startswith("."):
+                continue
+            if search and search not in name.lower():
+                continue
+
+            if not with_stat:
+                try:
+                    is_folder = entry.is_dir()
+                    is_file = not is_folder and entry.is_file()
+                except OSError:
+                    is_folder = is_file = False
+                entries.append((name, is_folder, is_file, 0, None))
+                continue
+
+            try:
+                stat = entry.stat()
+            except OSError:
+                # Broken symlink or entry removed while listing
+                entries.append((name, False, False, 0, None))
+                continue
+            entries.append((name, S_ISDIR(stat.st_mode), S_ISREG(stat.st_mode), stat.st_size, stat.st_mtime))
+
+    entries.sort()
+    return entries
+
 def listDirectory(handler, path, profile_root, code_directory):
-    """Generate the HTML directory listing."""
+    """
+    Generate the HTML page for a folder. Only the table shell is rendered here;
+    main.js fetches the entries page by page from /list, so the page costs the
+    same whether the folder holds 50 or 500,000 entries.
+    """
     try:
-        with open(os.path.join(code_directory, "html", "template.html"), "r", encoding="utf-8") as f:
-            template = f.read()
+        template = get_template(code_directory, "template.html")
     except FileNotFoundError:
         send_error_page(handler, 500, "Application template not found", code_directory)
         return None
 
-    try:
-        file_list = os.listdir(path)
-    except OSError:
+    if not os.access(path, os.R_OK | os.X_OK):
         send_error_page(handler, 404, "No permission to list directory", code_directory)
         return None
 
@@ -27,8 +68,6 @@ def listDirectory(handler, path, profile_root, code_directory):
     query_params = parse_qs(parsed_url.query)
     search_query = query_params.get("q", [""])[0].strip().lower()
 
-    file_list.sort()
-    items = ""
     rel_path = os.path.relpath(path, get_profile_dir(handler, profile_root))
     url_rel_path = rel_path.replace(os.sep, '/')
     back_link = f'/{url_rel_path}' if rel_path != "." else '/'
@@ -39,23 +78,13 @@ def listDirectory(handler, path, profile_root, code_directory):
         else ''
     )
 
-    items += '''
-        <table class="file-table">
-            <thead>
-                <tr>
-                    <th><input type="checkbox" id="selectAll"></th>
-                    <th>Name</th>
-                    <th>Type</th>
-                    <th>Size</th>
-                    <th>Modified</th>
-                    <th>Actions</th>
-                </tr>
-            </thead>
-            <tbody>
-    '''
+    # The shell only changes with the template, the folder and the search
+    template_mtime = template.mtime
+    etag = content_etag(profile_name, rel_path, search_query, template_mtime)
+    if send_if_not_modified(handler, "listing", etag, template_mtime):
+        return None
 
-    if rel_path != ".":
-        items += '''
+    parent_row = '''
             <tr class="folder">
                 <td></td>
                 <td><a href="../"><strong>Parent Directory</strong></a></td>
@@ -64,71 +93,24 @@ def listDirectory(handler, path, profile_root, code_directory):
                 <td>-</td>
                 <td></td>
             </tr>
-        '''
-
-    for name in file_list:
-        if name.startswith("."):
-            continue
-        if search_query and search_query not in name.lower():
-            continue
-
-        full_path = os.path.join(path, name)
-        try:
-            stat = os.stat(full_path)
-            size = stat.st_size
-            last_modified = os.path.getmtime(full_path)
-            last_modified_str = datetime.fromtimestamp(last_modified).strftime("%Y-%m-%d %H:%M")
-        except Exception:
-            size = 0
-            last_modified_str = "Unknown"
-
-        size_kb = f"{size / 1024:.1f} KB" if os.path.isfile(full_path) else "-"
-        is_folder = os.path.isdir(full_path)
-        type_str = "Folder" if is_folder else "File"
-
-        href = quote(name) + "/" if is_folder else quote(name)
-        target_attr = ' target="_blank"' if not is_folder else ""
-        name_html = f'<a href="{href}"{target_attr}><strong>{name}</strong></a>'
-
-        if is_folder:
-            actions_html = f'''
-                <div class="dropdown">
-                    <button class="dots-btn" onclick="toggleDropdown(event)">&#8942;</button>
-                    <div class="dropdown-content">
-                        <a href="javascript:void(0)" class="dropdown-link" onclick="startZipDownload('{quote(os.path.join(rel_path, name))}')">Download ZIP</a>
-                        <button class="rename-btn" onclick="renameItem('{name}')">Rename</button>
-                        <button class="delete-btn" onclick="deleteFile('{name}', false)">Delete</button>
-                        <button class="share-btn" onclick="showShareLink('{name}', '{profile_name}', 'folder')">Share Link</button>
-            '''
-        else:
-            actions_html = f'''
-                <div class="dropdown">
-                    <button class="dots-btn" onclick="toggleDropdown(event)">&#8942;</button>
-                    <div class="dropdown-content">
-                        <a href="{quote(name)}" download class="dropdown-link">Download</a>
-                        <button class="preview-btn" onclick="previewFile('{name}')">Preview</button>
-                        <button class="rename-btn" onclick="renameItem('{name}')">Rename</button>
-                        <button class="delete-btn" onclick="deleteFile('{name}', false)">Delete</button>
-                        <button class="detail-btn" onclick="showDetails('{name}')">Details</button>
-                        <button class="share-btn" onclick="showShareLink('{name}', '{profile_name}', 'file')">Share Link</button>
-                    </div>
-                </div>
-            '''
-
-        items += f'''
-            <tr>
-                <td><input type="checkbox" class="fileCheckbox" data-name="{name}" data-path="{quote(name)}" data-type="{'folder' if is_folder else 'file'}"></td>
-                <td>{name_html}</td>
-                <td>{type_str}</td>
-                <td>{size_kb}</td>
-                <td>{last_modified_str}</td>
-                <td>{actions_html}</td>
-            </tr>
-        '''
+    ''' if rel_path != "." else ""
 
-    items += '''
-            </tbody>
+    items = f'''
+        <table class="file-table" id="fileTable" data-profile="{escape(profile_name)}" data-path="{escape(url_rel_path if rel_path != "." else "")}">
+            <thead>
+                <tr>
+                    <th><input type="checkbox" id="selectAll"></th>
+                    <th><button class="sort-btn" data-sort="name">Name</button></th>
+                    <th><button class="sort-btn" data-sort="type">Type</button></th>
+                    <th><button class="sort-btn" data-sort="size">Size</button></th>
+                    <th><button class="sort-btn" data-sort="mtime">Modified</button></th>
+                    <th>Actions</th>
+                </tr>
+            </thead>
+            <tbody>{parent_row}</tbody>
+            <tbody id="fileTableBody"></tbody>
         </table>
+        <div class="listing-status" id="listingStatus">Loading...</div>
     '''
 
     parts = [] if rel_path == "." else rel_path.split(os.sep)
@@ -143,12 +125,14 @@ def listDirectory(handler, path, profile_root, code_directory):
     currentFolderName = parts[-1] if parts else "Home"
     currentFolderPath = f'<div class="currentFolder">Currently in: {breadcrumb_html}</div>'
 
-    html = template.replace("{{currentFolderName}}", currentFolderName)
-    html = html.replace("{{profileName}}", profile_name.split("_")[0])
-    html = html.replace("{{currentFolderPath}}", currentFolderPath)
-    html = html.replace("{{file_table}}", items)
-    html = html.replace("{{query}}", search_query)
-    html = html.replace("{{backToRootHTML}}", back_to_root_html)
+    html = template.render({
+        "currentFolderName": currentFolderName,
+        "profileName": profile_name.split("_")[0],
+        "currentFolderPath": currentFolderPath,
+        "file_table": items,
+        "query": escape(search_query),
+        "backToRootHTML": back_to_root_html,
+    })
 
     encoded = html.encode("utf-8", "surrogateescape")
     f = BytesIO()
@@ -158,6 +142,7 @@ def listDirectory(handler, path, profile_root, code_directory):
     handler.send_response(200)
     handler.send_header("Content-type", "text/html; charset=utf-8")
     handler.send_header("Content-Length", str(len(encoded)))
+    send_cache_headers(handler, "listing", etag, template_mtime)
     handler.end_headers()
     return f
 
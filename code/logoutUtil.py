@@ -2,6 +2,7 @@ import os
 import time
 import signal
 import threading
+from responseUtil import send_redirect
 
 def shutdown_and_kill(pid):
     # Wait a moment so response is sent before killing
@@ -14,8 +15,8 @@ def shutdown_and_kill(pid):
 
 def logout(handler, pid):
     threading.Thread(target=shutdown_and_kill, args=(pid,)).start()
-    handler.send_response(303)
-    handler.send_header("Set-Cookie", "profile=; Max-Age=0; Path=/")  # Clear cookie
-    handler.send_header("Set-Cookie", "authenticated=; Max-Age=0; Path=/")  # Clear auth cookie
-    handler.end_headers()
+    send_redirect(handler, 303, cookies=(
+        "profile=; Max-Age=0; Path=/",  # Clear cookie
+        "authenticated=; Max-Age=0; Path=/",  # Clear auth cookie
+    ))
     return
\ No newline at end of file
@@ -0,0 +1,165 @@
+from email.message import Message
+
+# Bytes pulled from the socket at a time; the buffer never holds much more than this
+CHUNK_SIZE = 256 * 1024
+
+# Largest header block accepted for a single part
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+class MultipartError(ValueError):
+    """The request body is not valid multipart/form-data."""
+
+class Part:
+    """Headers of one multipart part; its body is read with MultipartReader.read_chunks()."""
+
+    def __init__(self, headers):
+        self.headers = headers
+        disposition = Message()
+        disposition["Content-Disposition"] = headers.get("content-disposition", "")
+        self.name = disposition.get_param("name", header="content-disposition")
+        self.filename = disposition.get_filename()
+        self.content_type = headers.get("content-type", "text/plain")
+
+class MultipartReader:
+    """
+    Streaming multipart/form-data parser.
+    Boundaries are found in a rolling buffer of about CHUNK_SIZE bytes, so memory use
+    stays constant however large the uploaded files are.
+
+        reader = MultipartReader(handler.rfile, boundary, content_length)
+        for part in reader:
+            for chunk in reader.read_chunks():
+                ...
+    """
+
+    def __init__(self, rfile, boundary, content_length):
+        if not boundary or len(boundary) > 200:
+            raise MultipartError("Invalid multipart boundary")
+        if isinstance(boundary, str):
+            boundary = boundary.encode("latin-1")
+        self.rfile = rfile
+        self.remaining = content_length
+        self.delimiter = b"\r\n--" + boundary
+        # Leading CRLF lets the first boundary match the same delimiter as the others
+        self.buffer = bytearray(b"\r\n")
+        self.started = False
+        self.finished = False
+        self.in_body = False
+
+    def _fill(self):
+        """Read the next chunk of the request body. Returns False once it is exhausted."""
+        if self.remaining <= 0:
+            return False
+        data = self.rfile.read(min(CHUNK_SIZE, self.remaining))
+        if not data:
+            raise MultipartError("Upload ended before the request body was complete")
+        self.remaining -= len(data)
+        self.buffer += data
+        return True
+
+    def _skip_to_delimiter(self):
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                del self.buffer[:index + len(self.delimiter)]
+                return
+            # Keep a tail that could be the start of a delimiter split across reads
+            keep = len(self.delimiter) - 1
+            if len(self.buffer) > keep:
+                del self.buffer[:len(self.buffer) - keep]
+            if not self._fill():
+                raise MultipartError("Multipart boundary not found")
+
+    def _read_headers(self):
+        while True:
+            index = self.buffer.find(b"\r\n\r\n")
+            if index >= 0:
+                break
+            if len(self.buffer) > MAX_PART_HEADER_SIZE:
+                raise MultipartError("Multipart part headers too large")
+            if not self._fill():
+                raise MultipartError("Upload ended inside part headers")
+
+        block = bytes(self.buffer[:index]).decode("utf-8", "surrogateescape")
+        del self.buffer[:index + 4]
+        headers = {}
+        for line in block.split("\r\n"):
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return headers
+
+    def next_part(self):
+        """Advance to the next part and return it, or None after the closing boundary."""
+        if self.finished:
+            return None
+        if self.in_body:
+            # Discard whatever the caller did not read of the previous part
+            for _ in self.read_chunks():
+                pass
+        if not self.started:
+            self._skip_to_delimiter()
+            self.started = True
+
+        # After a delimiter comes "--" (end of the body) or CRLF (another part)
+        while len(self.buffer) < 2:
+            if not self._fill():
+                raise MultipartError("Upload ended after a boundary")
+        if self.buffer[:2] == b"--":
+            self.finished = True
+            return None
+        while True:
+            index = self.buffer.find(b"\r\n")
+            if index >= 0:
+                break
+            if len(self.buffer) > MAX_PART_HEADER_SIZE or not self._fill():
+                raise MultipartError("Malformed multipart boundary line")
+        if self.buffer[:index].strip(b" \t"):
+            raise MultipartError("Malformed multipart boundary line")
+        del self.buffer[:index + 2]
+
+        part = Part(self._read_headers())
+        self.in_body = True
+        return part
+
+    def read_chunks(self):
+        """Yield the current part's body in pieces of at most about CHUNK_SIZE bytes."""
+        if not self.in_body:
+            return
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    yield bytes(self.buffer[:index])
+                del self.buffer[:index + len(self.delimiter)]
+                self.in_body = False
+                return
+            if len(self.buffer) > keep:
+                size = len(self.buffer) - keep
+                yield bytes(self.buffer[:size])
+                del self.buffer[:size]
+            if not self._fill():
+                raise MultipartError("Upload ended inside a part")
+
+    def drain(self, limit):
+        """
+        Discard the epilogue after the closing boundary so the connection can be reused.
+        Returns False if more than `limit` bytes were left unread.
+        """
+        self.buffer.clear()
+        if self.remaining > limit:
+            return False
+        while self.remaining > 0:
+            data = self.rfile.read(min(CHUNK_SIZE, self.remaining))
+            if not data:
+                return False
+            self.remaining -= len(data)
+        return True
+
+    def __iter__(self):
+        while True:
+            part = self.next_part()
+            if part is None:
+                return
+            yield part
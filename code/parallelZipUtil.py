@@ -0,0 +1,224 @@
+import os
+import zlib
+import functools
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from zipStreamUtil import ZIP_DEFLATED, READ_SIZE
+
+# Files are deflated in pieces of this size so one big file also keeps every core busy
+PIECE_SIZE = 4 * 1024 * 1024
+
+# Each piece is primed with the end of the previous one, as pigz does, to keep the ratio
+DICTIONARY_SIZE = 32 * 1024
+
+# Pieces compressed ahead of the writer, per process; bounds memory to about
+# PIECE_SIZE * PIECES_AHEAD * processes
+PIECES_AHEAD = 2
+
+# Compression processes; None means one per CPU
+ZIP_PROCESSES = None
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def configure_zip_processes(count):
+    """Set the number of compression processes (0 or None: one per CPU); a running pool is replaced."""
+    global ZIP_PROCESSES, _pool
+    with _pool_lock:
+        ZIP_PROCESSES = count or None
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+class ZipCancelled(Exception):
+    """The job was cancelled while its archive was being written."""
+
+def compression_pool():
+    """Process pool shared by all zip jobs, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # forkserver: workers are not forked from the threaded server process itself
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=ZIP_PROCESSES or os.cpu_count() or 1,
+                                        mp_context=multiprocessing.get_context(method))
+        return _pool
+
+def reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def compress_pieces(pieces):
+    """
+    Runs in a pool process: raw deflate of (path, offset, length, level, last) pieces of
+    files. Pieces other than a file's last end with a sync flush, so their outputs
+    concatenate into one valid deflate stream. Returns (crc32 of the piece, bytes read,
+    compressed bytes) for each.
+    """
+    results = []
+    for path, offset, length, level, last in pieces:
+        with open(path, "rb") as f:
+            dictionary = b""
+            if offset:
+                start = max(0, offset - DICTIONARY_SIZE)
+                f.seek(start)
+                dictionary = f.read(offset - start)
+            data = f.read(length)
+        if dictionary:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        output = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        results.append((zlib.crc32(data), len(data), output))
+    return results
+
+def _gf2_times(matrix, vector):
+    total = 0
+    row = 0
+    while vector:
+        if vector & 1:
+            total ^= matrix[row]
+        vector >>= 1
+        row += 1
+    return total
+
+def _gf2_square(matrix):
+    return [_gf2_times(matrix, matrix[row]) for row in range(32)]
+
+@functools.lru_cache(maxsize=64)
+def _zeros_operator(length):
+    """GF(2) matrix that moves a CRC-32 past `length` zero bytes (as zlib's crc32_combine)."""
+    bit = [0xEDB88320] + [1 << row for row in range(31)]
+    byte = _gf2_square(_gf2_square(_gf2_square(bit)))
+    operator = [1 << row for row in range(32)]
+    while length:
+        if length & 1:
+            operator = [_gf2_times(byte, column) for column in operator]
+        length >>= 1
+        if length:
+            byte = _gf2_square(byte)
+    return tuple(operator)
+
+def crc32_combine(crc1, crc2, length2):
+    """CRC-32 of A + B from crc32(A), crc32(B) and len(B)."""
+    return _gf2_times(_zeros_operator(length2), crc1) ^ crc2
+
+def _pieces(size):
+    offset = 0
+    while True:
+        length = min(PIECE_SIZE, size - offset)
+        yield offset, length, offset + length >= size
+        offset += length
+        if offset >= size:
+            return
+
+def write_entries_parallel(writer, entries, choose, on_progress=None, is_cancelled=None):
+    """
+    Add `entries` ((path, arcname, stat) tuples) to a ZipStreamWriter, deflating pieces of
+    them in the compression pool while earlier entries are written. `choose(path, size)`
+    returns (method, level). on_progress gets the number of file bytes done at each step;
+    is_cancelled() is checked between pieces and raises ZipCancelled.
+    """
+    pool = compression_pool()
+    window = PIECES_AHEAD * (ZIP_PROCESSES or os.cpu_count() or 1)
+    # Queue of (entry index of each piece, future or None for a stored entry) in archive order
+    pending = deque()
+    plans = []
+
+    def submit_next(iterator):
+        for item in iterator:
+            pending.append(item)
+            if len(pending) >= window:
+                return
+
+    def plan():
+        # Small files travel to the pool together, up to PIECE_SIZE per task
+        batch, indices, batch_size = [], [], 0
+        for index, (path, arcname, stat) in enumerate(entries):
+            method, level = choose(path, stat.st_size)
+            plans.append(method)
+            if method != ZIP_DEFLATED:
+                if batch:
+                    yield indices, pool.submit(compress_pieces, batch)
+                    batch, indices, batch_size = [], [], 0
+                yield [index], None
+                continue
+            for offset, length, last in _pieces(stat.st_size):
+                batch.append((path, offset, length, level, last))
+                indices.append(index)
+                batch_size += length + 512
+                if batch_size >= PIECE_SIZE:
+                    yield indices, pool.submit(compress_pieces, batch)
+                    batch, indices, batch_size = [], [], 0
+        if batch:
+            yield indices, pool.submit(compress_pieces, batch)
+
+    iterator = plan()
+    submit_next(iterator)
+    current = None  # [index, entry state, crc, compressed, size]
+    try:
+        while pending:
+            if is_cancelled and is_cancelled():
+                raise ZipCancelled()
+            indices, future = pending.popleft()
+            results = future.result() if future else [None]
+            for index, result in zip(indices, results):
+                path, arcname, stat = entries[index]
+                if current is None or current[0] != index:
+                    if current is not None:
+                        writer.finish_entry(*current[1:])
+                    current = [index, writer.start_entry(arcname, stat, plans[index]), 0, 0, 0]
+
+                if result is None:
+                    # Stored entries are copied in this thread; reading is cheap next to deflate
+                    crc, size = copy_stored(writer, path, stat.st_size, on_progress, is_cancelled)
+                    current[2:] = [crc, size, size]
+                else:
+                    crc, length, output = result
+                    writer.write_data(output)
+                    current[2] = crc32_combine(current[2], crc, length) if current[4] else crc
+                    current[3] += len(output)
+                    current[4] += length
+                    if on_progress:
+                        on_progress(length)
+            submit_next(iterator)
+        if current is not None:
+            writer.finish_entry(*current[1:])
+    except BrokenProcessPool:
+        # A worker died (OOM killer, signal); start a fresh pool for the next job
+        reset_pool(pool)
+        raise
+    finally:
+        for _, future in pending:
+            if future:
+                future.cancel()
+
+def copy_stored(writer, path, size, on_progress=None, is_cancelled=None):
+    """Copy exactly `size` bytes of a stored entry. Returns (crc, size)."""
+    crc = 0
+    read = 0
+    with open(path, "rb") as f:
+        while read < size:
+            data = f.read(min(READ_SIZE, size - read))
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            writer.write_data(data)
+            read += len(data)
+            if on_progress:
+                on_progress(len(data))
+            if is_cancelled and is_cancelled():
+                raise ZipCancelled()
+    if read < size:
+        # The file shrank while being read; pad so the announced length still holds
+        padding = bytes(size - read)
+        crc = zlib.crc32(padding, crc)
+        writer.write_data(padding)
+    return crc, size
@@ -0,0 +1,109 @@
+import time
+import queue
+import threading
+from http.server import HTTPServer
+
+BUSY_RESPONSE_BODY = b"Server busy, please retry"
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTPServer that hands accepted connections to a fixed pool of worker threads.
+    Connections wait in a bounded queue; when it is full they get an immediate 503.
+    """
+
+    def __init__(self, server_address, handler_class, pool_size=32, queue_size=64, retry_after=2):
+        # Listen backlog, used by server_activate() inside HTTPServer.__init__
+        self.request_queue_size = max(queue_size, 5)
+        super().__init__(server_address, handler_class)
+
+        self.pool_size = pool_size
+        self.retry_after = retry_after
+        self.connections = queue.Queue(maxsize=queue_size)
+        self.stats_lock = threading.Lock()
+        self.busy_workers = 0
+        self.served = 0
+        self.rejected = 0
+        self.saturated_since = None
+
+        self.workers = []
+        for i in range(pool_size):
+            worker = threading.Thread(target=self.worker_loop, name=f"http-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        try:
+            self.connections.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request)
+            with self.stats_lock:
+                self.rejected += 1
+            self.shutdown_request(request)
+
+    def reject_request(self, request):
+        """Answer an overflow connection with a fast 503 instead of letting it wait."""
+        response = (
+            "HTTP/1.1 503 Service Unavailable\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            f"Content-Length: {len(BUSY_RESPONSE_BODY)}\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1") + BUSY_RESPONSE_BODY
+        try:
+            request.settimeout(1)
+            request.sendall(response)
+        except OSError:
+            pass
+
+    def worker_loop(self):
+        while True:
+            item = self.connections.get()
+            if item is None:
+                return
+            request, client_address = item
+            self.mark_busy(1)
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                self.mark_busy(-1)
+
+    def mark_busy(self, delta):
+        with self.stats_lock:
+            self.busy_workers += delta
+            if delta < 0:
+                self.served += 1
+
+            # Report when the pool fills up and when it recovers
+            if self.busy_workers >= self.pool_size and self.saturated_since is None:
+                self.saturated_since = time.monotonic()
+                print(f"[Pool] Saturated: {self.pool_size} workers busy, {self.connections.qsize()} queued")
+            elif self.busy_workers < self.pool_size and self.saturated_since is not None:
+                print(f"[Pool] Recovered after {time.monotonic() - self.saturated_since:.1f}s, {self.rejected} rejected so far")
+                self.saturated_since = None
+
+    def is_saturated(self):
+        return self.saturated_since is not None or not self.connections.empty()
+
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "mode": "pool",
+                "pool_size": self.pool_size,
+                "busy_workers": self.busy_workers,
+                "queued": self.connections.qsize(),
+                "queue_size": self.connections.maxsize,
+                "served": self.served,
+                "rejected": self.rejected,
+                "saturated": self.saturated_since is not None,
+            }
+
+    def server_close(self):
+        super().server_close()
+        for _ in self.workers:
+            try:
+                self.connections.put_nowait(None)
+            except queue.Full:
+                break
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import signal
+import socket
+import traceback
+
+# Workers that die sooner than this after starting are restarted with a delay
+MIN_WORKER_UPTIME = 2
+RESTART_DELAY = 1
+
+class ReusePortMixin:
+    """Bind with SO_REUSEPORT so every worker process can listen on the same port."""
+
+    def server_bind(self):
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def run_worker(make_server):
+    """Child process body: build this worker's own listening server and serve until killed."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        httpd = make_server()
+        httpd.serve_forever()
+    except Exception:
+        traceback.print_exc()
+        os._exit(1)
+    os._exit(0)
+
+def spawn_worker(make_server):
+    pid = os.fork()
+    if pid == 0:
+        run_worker(make_server)
+    return pid
+
+def run_prefork(make_server, processes):
+    """
+    Start `processes` workers, each with its own SO_REUSEPORT listener, and restart
+    any that exit. SIGTERM / SIGINT stop the workers and then the supervisor.
+
+    Workers are forked from this process: they get none of its threads, and a SQLite
+    connection must not be used on both sides of a fork. Modules therefore open their
+    connections and start their background threads on first use in each process, keyed
+    by os.getpid().
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise RuntimeError("Prefork mode needs SO_REUSEPORT support")
+
+    workers = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(processes):
+        workers[spawn_worker(make_server)] = time.monotonic()
+    print(f"[Prefork] Supervising {processes} workers: {sorted(workers)}")
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        started = workers.pop(pid, None)
+        if started is None or stopping:
+            continue
+
+        print(f"[Prefork] Worker {pid} exited with status {status}, restarting")
+        if time.monotonic() - started < MIN_WORKER_UPTIME:
+            time.sleep(RESTART_DELAY)
+        if not stopping:
+            workers[spawn_worker(make_server)] = time.monotonic()
+
+    sys.exit(0)
@@ -1,26 +1,17 @@
-import os
 from urllib.parse import parse_qs
 from errorUtil import send_error_page
+from responseUtil import send_redirect
+from templateUtil import render_template
 
 def send_login_form(handler, profile, error_msg, code_directory):
-    template_path = os.path.join(code_directory, "html", "profileLogin.html")
     try:
-        with open(template_path, "r", encoding="utf-8") as f:
-            html = f.read()
+        # The {% if error_msg %} block is dropped when there is no error
+        html = render_template(code_directory, "profileLogin.html",
+                               profile=profile, profileSplit=profile.split("_")[0], error_msg=error_msg or "")
     except FileNotFoundError:
         send_error_page(handler, 500, "Login template not found", code_directory)
         return
 
-    # Simple replacement
-    html = html.replace("{{profile}}", profile)
-    html = html.replace("{{profileSplit}}", profile.split("_")[0])
-    html = html.replace("{{error_msg}}", error_msg or "")
-    if error_msg:
-        html = html.replace("{% if error_msg %}", "").replace("{% endif %}", "")
-    else:
-        # Remove the error block if no error
-        html = html.replace("{% if error_msg %}", "<!--").replace("{% endif %}", "-->")
-
     encoded = html.encode("utf-8")
     handler.send_response(200)
     handler.send_header("Content-type", "text/html")
@@ -43,11 +34,10 @@ def login(handler, profile_passwords, code_directory):
     expected_password = profile_passwords.get(profile)
     if expected_password is not None and password == expected_password:
         # Password is correct - set authenticated cookie and redirect to /
-        handler.send_response(302)
-        handler.send_header("Set-Cookie", f"profile={profile}; Path=/")
-        handler.send_header("Set-Cookie", "authenticated=yes; Path=/")
-        handler.send_header("Location", "/")
-        handler.end_headers()
+        send_redirect(handler, 302, "/", cookies=(
+            f"profile={profile}; Path=/",
+            "authenticated=yes; Path=/",
+        ))
     else:
         # Wrong password - show password form with error
         send_login_form(handler, profile, "Incorrect password", code_directory)
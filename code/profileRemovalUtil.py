@@ -1,5 +1,7 @@
 import os
 from errorUtil import send_error_page
+from responseUtil import send_redirect
+from templateUtil import render_template
 from urllib.parse import quote, parse_qs
 
 def remove_profile(handler, profile_root, profile_passwords, code_directory):
@@ -27,9 +29,7 @@ def remove_profile(handler, profile_root, profile_passwords, code_directory):
     if expected_password is not None:
         if password != expected_password or password is None:
             # Redirect back to confirmation with error
-            handler.send_response(302)
-            handler.send_header("Location", f"/confirm-remove?profile={quote(profile_to_remove)}&error=Invalid+password")
-            handler.end_headers()
+            send_redirect(handler, 302, f"/confirm-remove?profile={quote(profile_to_remove)}&error=Invalid+password")
             return
 
     return profile_path, profile_to_remove
@@ -49,12 +49,8 @@ def remove_profile_get(handler, profile_root, code_directory):
     for prof in profile_dirs:
         profiles_html += f'<li><a href="/confirm-remove?profile={quote(prof)}">{prof.split("_")[0]}</a></li>'
 
-    template_path = os.path.join(code_directory, "html", "profileRemove.html")
-    with open(template_path, "r", encoding="utf-8") as f:
-        template = f.read()
-
-    # Replace placeholder with actual profiles HTML
-    html = template.replace("{{profiles_html}}", profiles_html)
+    # Fill the placeholder with actual profiles HTML
+    html = render_template(code_directory, "profileRemove.html", profiles_html=profiles_html)
 
     encoded = html.encode("utf-8")
     handler.send_response(200)
@@ -84,18 +80,15 @@ def remove_profile_confirm_get(handler, qs, public_profile, profile_root, code_d
     error_msg = qs.get("error", [None])[0]
     error_html = f'<p style="color:#ff4444; font-weight:bold;">{error_msg}</p>' if error_msg else ""
 
-    template_path = os.path.join(code_directory, "html", "profileRemoveConfirm.html")
     try:
-        with open(template_path, "r", encoding="utf-8") as f:
-            html = f.read()
+        html = render_template(code_directory, "profileRemoveConfirm.html",
+                               profile_name_to_remove=profile_to_remove.split("_")[0],
+                               profile_to_remove=profile_to_remove,
+                               error_html=error_html)
     except FileNotFoundError:
         send_error_page(handler, 500, "Profile removal confirmation template not found", code_directory)
         return
 
-    html = html.replace("{{profile_name_to_remove}}", profile_to_remove.split("_")[0])
-    html = html.replace("{{profile_to_remove}}", profile_to_remove)
-    html = html.replace("{{error_html}}", error_html)
-
     encoded = html.encode("utf-8")
     handler.send_response(200)
     handler.send_header("Content-Type", "text/html")
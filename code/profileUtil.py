@@ -1,6 +1,7 @@
 import os
 from urllib.parse import quote
 from errorUtil import send_error_page
+from templateUtil import render_template
 
 def get_profile_dir(handler, profile_root):
     # Get profile from cookie
@@ -28,14 +29,6 @@ def send_profile_selection(handler, profile_root, profile_list, code_directory):
         send_error_page(handler, 500, "Failed to read profiles", code_directory)
         return
 
-    template_path = os.path.join(code_directory, "html", "profile.html")
-    try:
-        with open(template_path, "r", encoding="utf-8") as f:
-            html = f.read()
-    except FileNotFoundError:
-        send_error_page(handler, 500, "Profile selection template not found", code_directory)
-        return
-
     # Build list of profiles
     profiles_html = ""
     profile_dirs.sort()
@@ -43,7 +36,11 @@ def send_profile_selection(handler, profile_root, profile_list, code_directory):
         profiles_html += f'<a href="/?set_profile={quote(prof)}">{prof.split("_")[0]}</a>\n'
 
     # Insert into template
-    html = html.replace("{{profiles}}", profiles_html)
+    try:
+        html = render_template(code_directory, "profile.html", profiles=profiles_html)
+    except FileNotFoundError:
+        send_error_page(handler, 500, "Profile selection template not found", code_directory)
+        return
 
     encoded = html.encode("utf-8")
     handler.send_response(200)
@@ -53,20 +50,16 @@ def send_profile_selection(handler, profile_root, profile_list, code_directory):
     handler.wfile.write(encoded)
 
 def send_add_profile_form(handler, error_msg, code_directory):
-    template_path = os.path.join(code_directory, "html", "profileAdd.html")
-    try:
-        with open(template_path, "r", encoding="utf-8") as f:
-            html = f.read()
-    except FileNotFoundError:
-        send_error_page(handler, 500, "Add profile template not found", code_directory)
-        return
-
     if error_msg:
         error_html = f'<div class="error">{error_msg}</div>'
     else:
         error_html = ''
 
-    html = html.replace("{{error_msg}}", error_html)
+    try:
+        html = render_template(code_directory, "profileAdd.html", error_msg=error_html)
+    except FileNotFoundError:
+        send_error_page(handler, 500, "Add profile template not found", code_directory)
+        return
 
     encoded = html.encode("utf-8")
     handler.send_response(200)
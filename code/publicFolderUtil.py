@@ -3,6 +3,9 @@ import json
 from urllib.parse import quote
 
 from errorUtil import send_error_page
+from loadDirectoryUtil import scanDirectory
+from templateUtil import get_template
+from cacheUtil import content_etag, send_cache_headers, send_if_not_modified
 
 def build_folder_listing(profile_root, folder_path, profile, rel_folder=""):
     """
@@ -11,25 +14,26 @@ def build_folder_listing(profile_root, folder_path, profile, rel_folder=""):
         - html listing string
         - json array of files for gallery
     """
-    html = ""
+    html = []
     gallery_files = []
+    profile_dir = os.path.join(profile_root, profile)
 
     try:
         # --- Up one level link ---
-        html += "<ul>"
+        html.append("<ul>")
 
-        for item in sorted(os.listdir(folder_path)):
+        for item, is_folder, _, _, _ in scanDirectory(folder_path, with_stat=False):
             full_path = os.path.join(folder_path, item)
-            rel_path = os.path.relpath(full_path, os.path.join(profile_root, profile))
+            rel_path = os.path.relpath(full_path, profile_dir)
 
-            if os.path.isdir(full_path):
+            if is_folder:
                 # Folder link
                 folder_url = f"/share?profile={quote(profile)}&folder={quote(rel_path)}"
-                html += f'<li class="folder"><strong><a href="{folder_url}">{item}/</a></strong></li>'
+                html.append(f'<li class="folder"><strong><a href="{folder_url}">{item}/</a></strong></li>')
             else:
                 # File link
                 file_url = f"/{profile}/{quote(rel_path)}"
-                html += f'<li><a href="{file_url}" target="_blank">{item}</a></li>'
+                html.append(f'<li><a href="{file_url}" target="_blank">{item}</a></li>')
 
                 # Collect gallery files (images only)
                 if item.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')):
@@ -46,12 +50,12 @@ def build_folder_listing(profile_root, folder_path, profile, rel_folder=""):
                     })
 
     except Exception as e:
-        html += f"<li>Error reading directory: {e}</li>"
+        html.append(f"<li>Error reading directory: {e}</li>")
 
-    html += "</ul>"
+    html.append("</ul>")
 
     # Return HTML + JSON array for gallery
-    return html, json.dumps(gallery_files)
+    return "".join(html), json.dumps(gallery_files)
 
 def share_public_folder(handler, qs, profile_root, code_directory):
     profile = qs.get("profile", [""])[0]
@@ -72,22 +76,30 @@ def share_public_folder(handler, qs, profile_root, code_directory):
         send_error_page(handler, 404, "Folder not found", code_directory)
         return
 
+    # The page lists names only, so the folder and template mtimes cover every change
+    template = get_template(code_directory, "sharePublicFolder.html")
+    template_mtime = template.mtime
+    folder_mtime = os.path.getmtime(folder_path)
+    etag = content_etag(profile, folder, template_mtime, os.stat(folder_path).st_mtime_ns)
+    mtime = max(template_mtime, folder_mtime)
+    if send_if_not_modified(handler, "share", etag, mtime):
+        return
+
     # Build *non-recursive* listing
     html_listing, json_folder_files = build_folder_listing(profile_root, folder_path, profile, folder)
 
-    template_path = os.path.join(code_directory, "html", "sharePublicFolder.html")
-    with open(template_path, "r", encoding="utf-8") as f:
-        template = f.read()
-
-    html = template.replace("{{profile}}", profile.split("_")[0])
-    html = html.replace("{{folder}}", folder)
-    html = html.replace("{{folder_listing}}", html_listing)
-    html = html.replace("{{json_folder_files}}", json_folder_files)
+    html = template.render({
+        "profile": profile.split("_")[0],
+        "folder": folder,
+        "folder_listing": html_listing,
+        "json_folder_files": json_folder_files,
+    })
 
     encoded = html.encode("utf-8")
     handler.send_response(200)
     handler.send_header("Content-Type", "text/html; charset=utf-8")
     handler.send_header("Content-Length", str(len(encoded)))
+    send_cache_headers(handler, "share", etag, mtime)
     handler.end_headers()
     handler.wfile.write(encoded)
     return
\ No newline at end of file
@@ -1,7 +1,11 @@
 import os
 import json
+import traceback
 from urllib.parse import unquote
 from profileUtil import get_profile_dir
+from responseUtil import send_text
+from dedupUtil import moved
+from catalogUtil import catalog_move
 
 def rename(handler, profile_root):
     content_length = int(handler.headers.get('Content-Length', 0))
@@ -13,9 +17,7 @@ def rename(handler, profile_root):
         new_path = data.get("new_path")
 
         if not old_path or not new_path:
-            handler.send_response(400)
-            handler.end_headers()
-            handler.wfile.write(b"Missing old_path or new_path")
+            send_text(handler, 400, "Missing old_path or new_path")
             return
 
         # Sanitize paths
@@ -27,32 +29,24 @@ def rename(handler, profile_root):
 
         # Security check: ensure both are inside DIRECTORY
         if not old_abs.startswith(os.path.abspath(get_profile_dir(handler, profile_root))) or not new_abs.startswith(os.path.abspath(get_profile_dir(handler, profile_root))):
-            handler.send_response(400)
-            handler.end_headers()
-            handler.wfile.write(b"Invalid path")
+            send_text(handler, 400, "Invalid path")
             return
 
         # Check existence and perform rename
         if not os.path.exists(old_abs):
-            handler.send_response(404)
-            handler.end_headers()
-            handler.wfile.write(b"Source file or folder does not exist")
+            send_text(handler, 404, "Source file or folder does not exist")
             return
 
         if os.path.exists(new_abs):
-            handler.send_response(409)
-            handler.end_headers()
-            handler.wfile.write(b"Target name already exists")
+            send_text(handler, 409, "Target name already exists")
             return
 
         os.rename(old_abs, new_abs)
-        handler.send_response(200)
-        handler.end_headers()
-        handler.wfile.write(b"Renamed successfully")
+        moved(old_abs, new_abs)
+        catalog_move(old_abs, new_abs)
+        send_text(handler, 200, "Renamed successfully")
 
     except Exception as e:
         print("Error renaming:", e)
         traceback.print_exc()
-        handler.send_response(500)
-        handler.end_headers()
-        handler.wfile.write(b"Rename failed")
\ No newline at end of file
+        send_text(handler, 500, "Rename failed")
\ No newline at end of file
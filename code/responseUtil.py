@@ -0,0 +1,69 @@
+import json
+
+def send_text(handler, code, message, content_type="text/plain; charset=utf-8"):
+    """Send a short plain-text reply with an explicit Content-Length."""
+    body = message.encode("utf-8") if isinstance(message, str) else message
+    handler.send_response(code)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+def send_json(handler, code, data):
+    """Send a JSON reply with an explicit Content-Length."""
+    send_text(handler, code, json.dumps(data), "application/json")
+
+def send_redirect(handler, code, location=None, cookies=()):
+    """Send a body-less redirect, optionally setting or clearing cookies."""
+    handler.send_response(code)
+    for cookie in cookies:
+        handler.send_header("Set-Cookie", cookie)
+    if location:
+        handler.send_header("Location", location)
+    handler.send_header("Content-Length", "0")
+    handler.end_headers()
+
+def send_empty(handler, code):
+    """Send a status-only reply."""
+    handler.send_response(code)
+    handler.send_header("Content-Length", "0")
+    handler.end_headers()
+
+class StreamWriter:
+    """
+    File-like body writer for responses whose length is not known up front. Small writes
+    are gathered and sent in pieces of about buffer_size bytes, framed with HTTP/1.1
+    chunked transfer coding when `chunked` is set (the response then needs
+    "Transfer-Encoding: chunked"). close() ends the body.
+    """
+
+    def __init__(self, wfile, chunked=True, buffer_size=64 * 1024):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= self.buffer_size:
+            self._send()
+        return len(data)
+
+    def _send(self):
+        if not self.buffer:
+            return
+        if self.chunked:
+            self.wfile.write(b"%x\r\n" % len(self.buffer) + self.buffer + b"\r\n")
+        else:
+            self.wfile.write(self.buffer)
+        self.buffer.clear()
+
+    def flush(self):
+        self._send()
+        self.wfile.flush()
+
+    def close(self):
+        self._send()
+        if self.chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
@@ -0,0 +1,438 @@
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import base64
+import shutil
+import hashlib
+import traceback
+from urllib.parse import unquote, parse_qs
+
+from profileUtil import get_profile_dir
+from responseUtil import send_text, send_json, send_empty
+from dedupUtil import dedup_enabled, hash_file, place_file
+from catalogUtil import catalog_add
+from thumbIndexUtil import note_upload
+
+# Sessions live under the profile so they survive a server restart
+UPLOAD_SESSIONS_DIRECTORY = ".uploads"
+
+# Sessions untouched for this long are deleted with their partial data
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+
+WRITE_CHUNK_SIZE = 256 * 1024
+
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Parallel sessions: chunks of this size (Upload-Chunk-Size) arrive in any order on separate connections
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 256 * 1024 * 1024
+
+# Upload-Checksum algorithms a chunk may be verified with
+CHECKSUM_ALGORITHMS = {"sha256": hashlib.sha256, "sha1": hashlib.sha1, "md5": hashlib.md5}
+
+def sessions_root(profile_dir):
+    return os.path.join(profile_dir, UPLOAD_SESSIONS_DIRECTORY)
+
+def load_session(profile_dir, upload_id):
+    """Return (session dir, info dict) or None if the session does not exist or has expired."""
+    if not SESSION_ID_PATTERN.match(upload_id or ""):
+        return None
+    session_dir = os.path.join(sessions_root(profile_dir), upload_id)
+    try:
+        with open(os.path.join(session_dir, "info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if session_expired(session_dir):
+        shutil.rmtree(session_dir, ignore_errors=True)
+        return None
+    return session_dir, info
+
+def session_expired(session_dir):
+    try:
+        last_used = os.stat(os.path.join(session_dir, "data")).st_mtime
+    except FileNotFoundError:
+        return True
+    return time.time() - last_used > UPLOAD_SESSION_TTL
+
+def session_offset(session_dir):
+    """Bytes received so far: the data file only ever grows by appended, written bytes."""
+    return os.stat(os.path.join(session_dir, "data")).st_size
+
+def chunk_count(info):
+    return max(1, -(-info["length"] // info["chunk_size"]))
+
+def chunk_length(info, index):
+    return min(info["chunk_size"], info["length"] - index * info["chunk_size"])
+
+def missing_chunks(session_dir):
+    """Indexes of chunks not received yet. The chunks file holds one byte per chunk, 1 once it is written."""
+    with open(os.path.join(session_dir, "chunks"), "rb") as f:
+        received = f.read()
+    return [index for index, done in enumerate(received) if not done]
+
+def preallocate(fd, length):
+    """Reserve the whole file up front so parallel writes never extend it or fragment it."""
+    if length <= 0:
+        return
+    try:
+        os.posix_fallocate(fd, 0, length)
+    except (AttributeError, OSError):
+        # Not supported by this platform or filesystem; a sparse file works the same way
+        os.ftruncate(fd, length)
+
+def expire_sessions(profile_dir):
+    root = sessions_root(profile_dir)
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return
+    for name in names:
+        session_dir = os.path.join(root, name)
+        if session_expired(session_dir):
+            print(f"[Upload] Expiring stale session {name}")
+            shutil.rmtree(session_dir, ignore_errors=True)
+
+def parse_metadata(header):
+    """Upload-Metadata: comma separated `key base64value` pairs, as in tus."""
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value).decode("utf-8")
+            except (ValueError, UnicodeDecodeError):
+                metadata[key] = ""
+    return metadata
+
+def send_offset(handler, code, offset, length=None):
+    handler.send_response(code)
+    handler.send_header("Upload-Offset", str(offset))
+    if length is not None:
+        handler.send_header("Upload-Length", str(length))
+    handler.send_header("Cache-Control", "no-store")
+    handler.send_header("Content-Length", "0")
+    handler.end_headers()
+
+def create_upload(handler, parsed_url, profile_root):
+    """POST /uploads?path=<folder> with Upload-Length and Upload-Metadata: filename <base64>"""
+    # The body of this request is empty, anything sent anyway is not read
+    if handler.headers.get("Content-Length", "0") != "0":
+        handler.close_connection = True
+    profile_dir = get_profile_dir(handler, profile_root)
+    if not profile_dir:
+        send_text(handler, 403, "Profile not selected")
+        return
+
+    try:
+        length = int(handler.headers.get("Upload-Length", ""))
+    except ValueError:
+        send_text(handler, 400, "Missing or invalid Upload-Length")
+        return
+    if length < 0:
+        send_text(handler, 400, "Missing or invalid Upload-Length")
+        return
+
+    chunk_size = handler.headers.get("Upload-Chunk-Size")
+    if chunk_size is not None:
+        try:
+            chunk_size = int(chunk_size)
+        except ValueError:
+            chunk_size = 0
+        if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+            send_text(handler, 400, f"Upload-Chunk-Size must be between {MIN_CHUNK_SIZE} and {MAX_CHUNK_SIZE}")
+            return
+
+    filename = os.path.basename(parse_metadata(handler.headers.get("Upload-Metadata")).get("filename", ""))
+    if filename in ("", ".", ".."):
+        send_text(handler, 400, "No filename provided")
+        return
+
+    query = parse_qs(parsed_url.query)
+    upload_path = query.get("path", ["/"])[0]
+    safe_rel_path = os.path.normpath(unquote(upload_path)).lstrip("/")
+    abs_upload_dir = os.path.abspath(os.path.join(profile_dir, safe_rel_path))
+    if not abs_upload_dir.startswith(os.path.abspath(profile_dir)):
+        send_text(handler, 400, "Invalid upload path")
+        return
+
+    expire_sessions(profile_dir)
+
+    try:
+        os.makedirs(sessions_root(profile_dir), exist_ok=True)
+        if shutil.disk_usage(sessions_root(profile_dir)).free < length:
+            send_text(handler, 507, "Not enough free space for this upload")
+            return
+
+        upload_id = uuid.uuid4().hex
+        session_dir = os.path.join(sessions_root(profile_dir), upload_id)
+        os.mkdir(session_dir)
+        info = {
+            "filename": filename,
+            "folder": os.path.relpath(abs_upload_dir, profile_dir),
+            "length": length,
+            "created": time.time(),
+        }
+        if chunk_size:
+            info["chunk_size"] = chunk_size
+        with open(os.path.join(session_dir, "info.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        with open(os.path.join(session_dir, "data"), "wb") as f:
+            if chunk_size:
+                preallocate(f.fileno(), length)
+        if chunk_size:
+            with open(os.path.join(session_dir, "chunks"), "wb") as f:
+                f.write(bytes(chunk_count(info)))
+    except OSError as e:
+        shutil.rmtree(os.path.join(sessions_root(profile_dir), upload_id), ignore_errors=True)
+        traceback.print_exc()
+        send_text(handler, 500, f"Failed to create upload: {e}")
+        return
+
+    handler.send_response(201)
+    handler.send_header("Location", f"/uploads/{upload_id}")
+    handler.send_header("Upload-Offset", "0")
+    body = json.dumps({"id": upload_id, "offset": 0}).encode("utf-8")
+    handler.send_header("Content-Type", "application/json")
+    handler.send_header("Content-Length", str(len(body)))
+    handler.end_headers()
+    handler.wfile.write(body)
+
+def upload_status(handler, upload_id, profile_root):
+    """HEAD /uploads/<id>: where to resume from."""
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        send_offset(handler, 404, 0)
+        return
+    session_dir, info = session
+    if "chunk_size" in info:
+        # Parallel sessions have no single offset; report how much has been received
+        received = info["length"] - sum(chunk_length(info, index) for index in missing_chunks(session_dir))
+        send_offset(handler, 200, received, info["length"])
+        return
+    send_offset(handler, 200, session_offset(session_dir), info["length"])
+
+def upload_info(handler, upload_id, profile_root):
+    """GET /uploads/<id>: session state as JSON, including the chunks a parallel upload still needs."""
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        send_text(handler, 404, "Upload not found")
+        return
+    session_dir, info = session
+    data = {"id": upload_id, "filename": info["filename"], "length": info["length"]}
+    if "chunk_size" in info:
+        data["chunk_size"] = info["chunk_size"]
+        data["missing"] = missing_chunks(session_dir)
+    else:
+        data["offset"] = session_offset(session_dir)
+    send_json(handler, 200, data)
+
+def append_chunk(handler, upload_id, profile_root):
+    """PATCH /uploads/<id> with Upload-Offset: body bytes are appended at that offset."""
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        handler.close_connection = True
+        send_text(handler, 404, "Upload not found")
+        return
+    session_dir, info = session
+    if "chunk_size" in info:
+        handler.close_connection = True
+        send_text(handler, 400, "This upload takes chunks: PUT /uploads/<id>/chunks/<index>")
+        return
+
+    try:
+        offset = int(handler.headers.get("Upload-Offset", ""))
+        content_length = int(handler.headers.get("Content-Length", ""))
+    except ValueError:
+        handler.close_connection = True
+        send_text(handler, 400, "Missing Upload-Offset or Content-Length")
+        return
+
+    if offset + content_length > info["length"]:
+        handler.close_connection = True
+        send_text(handler, 413, "Chunk goes past Upload-Length")
+        return
+
+    data_path = os.path.join(session_dir, "data")
+    with open(data_path, "ab") as f:
+        try:
+            # One writer per session; a retry racing a stalled request gets 409 instead of interleaving
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            handler.close_connection = True
+            send_text(handler, 409, "Upload is busy")
+            return
+
+        current = os.fstat(f.fileno()).st_size
+        if offset != current:
+            handler.close_connection = True
+            send_offset(handler, 409, current, info["length"])
+            return
+
+        remaining = content_length
+        try:
+            while remaining > 0:
+                data = handler.rfile.read(min(WRITE_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+        except OSError:
+            # Client went away; what arrived is kept and the client resumes from it
+            f.flush()
+            handler.close_connection = True
+            print(f"[Upload] Session {upload_id} interrupted at {os.fstat(f.fileno()).st_size} bytes")
+            return
+        f.flush()
+        offset = os.fstat(f.fileno()).st_size
+
+    if remaining > 0:
+        handler.close_connection = True
+        return
+    send_offset(handler, 204, offset, info["length"])
+
+def parse_checksum(header):
+    """Upload-Checksum: <algorithm> <base64 digest>, as in the tus checksum extension."""
+    algorithm, _, digest = (header or "").strip().partition(" ")
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        return None
+    try:
+        return CHECKSUM_ALGORITHMS[algorithm](), base64.b64decode(digest, validate=True)
+    except ValueError:
+        return None
+
+def put_chunk(handler, upload_id, index, profile_root):
+    """
+    PUT /uploads/<id>/chunks/<index>: write one chunk of a parallel upload at its
+    position with os.pwrite. Chunks may arrive in any order and on any connection.
+    """
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        handler.close_connection = True
+        send_text(handler, 404, "Upload not found")
+        return
+    session_dir, info = session
+    if "chunk_size" not in info:
+        handler.close_connection = True
+        send_text(handler, 400, "This upload takes PATCH requests at Upload-Offset")
+        return
+
+    if index >= chunk_count(info):
+        handler.close_connection = True
+        send_text(handler, 416, "Chunk index out of range")
+        return
+    position = index * info["chunk_size"]
+    expected = chunk_length(info, index)
+    try:
+        content_length = int(handler.headers.get("Content-Length", ""))
+    except ValueError:
+        content_length = -1
+    if content_length != expected:
+        handler.close_connection = True
+        send_text(handler, 400, f"Chunk {index} must be {expected} bytes")
+        return
+
+    checksum = None
+    if handler.headers.get("Upload-Checksum"):
+        checksum = parse_checksum(handler.headers["Upload-Checksum"])
+        if checksum is None:
+            handler.close_connection = True
+            send_text(handler, 400, "Unsupported Upload-Checksum")
+            return
+
+    chunks_fd = os.open(os.path.join(session_dir, "chunks"), os.O_WRONLY)
+    data_fd = os.open(os.path.join(session_dir, "data"), os.O_WRONLY)
+    try:
+        # Unmark first: a rewrite that fails halfway must not leave the chunk counted as received
+        os.pwrite(chunks_fd, b"\0", index)
+        remaining = expected
+        try:
+            while remaining > 0:
+                data = handler.rfile.read(min(WRITE_CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                if checksum:
+                    checksum[0].update(data)
+                written = 0
+                while written < len(data):
+                    written += os.pwrite(data_fd, data[written:], position + written)
+                position += len(data)
+                remaining -= len(data)
+        except OSError:
+            remaining = -1
+        if remaining:
+            # Client went away; the chunk is sent again in full
+            handler.close_connection = True
+            print(f"[Upload] Chunk {index} of session {upload_id} interrupted")
+            return
+
+        if checksum and checksum[0].digest() != checksum[1]:
+            handler.send_response(460, "Checksum Mismatch")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        os.pwrite(chunks_fd, b"\1", index)
+    finally:
+        os.close(data_fd)
+        os.close(chunks_fd)
+
+    send_empty(handler, 204)
+
+def finalize_upload(handler, upload_id, profile_root):
+    """POST /uploads/<id>/finalize: move the completed file into its folder."""
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        send_text(handler, 404, "Upload not found")
+        return
+    session_dir, info = session
+
+    if "chunk_size" in info:
+        missing = missing_chunks(session_dir)
+        if missing:
+            send_json(handler, 409, {"missing": missing})
+            return
+    else:
+        offset = session_offset(session_dir)
+        if offset != info["length"]:
+            send_offset(handler, 409, offset, info["length"])
+            return
+
+    target_dir = os.path.abspath(os.path.join(profile_dir, info["folder"]))
+    if not target_dir.startswith(os.path.abspath(profile_dir)):
+        send_text(handler, 400, "Invalid upload path")
+        return
+
+    try:
+        os.makedirs(target_dir, exist_ok=True)
+        data_path = os.path.join(session_dir, "data")
+        # Chunks may have arrived in any order, so the content is hashed here in one pass
+        hasher = hash_file(data_path) if dedup_enabled() else None
+        place_file(data_path, os.path.join(target_dir, info["filename"]), hasher)
+        shutil.rmtree(session_dir, ignore_errors=True)
+        catalog_add(os.path.join(target_dir, info["filename"]))
+        note_upload(os.path.join(target_dir, info["filename"]))
+    except OSError as e:
+        traceback.print_exc()
+        send_text(handler, 500, f"Failed to save file: {e}")
+        return
+
+    rel_path = os.path.join(info["folder"], info["filename"]) if info["folder"] != "." else info["filename"]
+    send_json(handler, 200, {"path": rel_path.replace(os.sep, "/"), "size": info["length"]})
+
+def cancel_upload(handler, upload_id, profile_root):
+    """DELETE /uploads/<id>: drop the session and its partial data."""
+    profile_dir = get_profile_dir(handler, profile_root)
+    session = load_session(profile_dir, upload_id) if profile_dir else None
+    if not session:
+        send_text(handler, 404, "Upload not found")
+        return
+    shutil.rmtree(session[0], ignore_errors=True)
+    send_text(handler, 200, "Upload cancelled")
@@ -1,10 +1,8 @@
 #!/usr/bin/env python3
 
 import os
-import cgi
 import json
 import shutil
-import traceback
 import socketserver
 from io import BytesIO
 from datetime import datetime
@@ -12,26 +10,41 @@ from urllib.parse import quote, unquote, urlparse, parse_qs
 from http.server import HTTPServer, SimpleHTTPRequestHandler
 
 import re
-import time
 import uuid
 import signal
+import argparse
 import threading
 
 import mimetypes
 
 from switchUtil import switch
+from poolServerUtil import PooledHTTPServer
+from asyncServerUtil import AsyncHTTPServer
+from preforkUtil import ReusePortMixin, run_prefork
+from jobStoreUtil import create_shared_job_state
 from deleteUtil import delete
 from logoutUtil import logout
 from renameUtil import rename
-from uploadUtil import upload
+from dedupUtil import DEDUP_MODES, configure_dedup, dedup_report, forget
+from parallelZipUtil import configure_zip_processes
+from zipJobUtil import configure_zip_jobs, sweep_zip_jobs, profile_jobs
+from eventUtil import register_job_source, send_events
+from thumbnailUtil import configure_thumbnails, send_thumbnail
+from thumbIndexUtil import configure_thumbnail_index, start_thumbnail_indexer, profile_status
+from catalogUtil import configure_catalog, start_catalog, drop_catalog, send_search
+from uploadUtil import upload, upload_batch
+from resumableUploadUtil import create_upload, upload_status, upload_info, append_chunk, put_chunk, finalize_upload, cancel_upload
 from errorUtil import send_error_page
+from responseUtil import send_json, send_redirect, send_empty
 from folderCreationUtil import create_folder
 from profileCreationUtil import create_profile
-from streamingUtil import send_file_with_range
+from streamingUtil import send_file_with_range, send_file_body
+from cacheUtil import configure_cache_policies, file_etag, send_cache_headers, send_if_not_modified
 from publicFolderUtil import share_public_folder
 from profileLoginUtil import send_login_form, login
+from listingUtil import list_directory_json
 from loadDirectoryUtil import listDirectory, translatePath
-from zipDownloadUtil import download_zip, bulk_download_zip
+from zipDownloadUtil import download_zip, bulk_download_zip, zip_progress, download_zip_file, release_zip_file, cancel_zip
 from loadProfileUtil import load_public_profile, load_profile
 from profileUtil import get_profile_dir, send_profile_selection, send_add_profile_form
 from profileRemovalUtil import remove_profile, remove_profile_get, remove_profile_confirm_get
@@ -48,12 +61,81 @@ TEMP_ZIP_DIRECTORY = "/nas/storage/temp/zips"
 
 PORT = 8888
 
-progress_store = {}  # progress %
+# HTTP/1.1 keep-alive: seconds a connection may sit idle between requests,
+# seconds a started request may stall, and requests served per connection
+KEEP_ALIVE_TIMEOUT = 15
+REQUEST_TIMEOUT = 120
+MAX_KEEP_ALIVE_REQUESTS = 200
+SATURATED_KEEP_ALIVE_TIMEOUT = 1
+
+# Worker pool server: fixed number of handler threads and connections allowed to wait
+SERVER_MODE = "pool"
+WORKER_POOL_SIZE = 32
+ACCEPT_QUEUE_SIZE = 64
+BUSY_RETRY_AFTER = 2
+
+# Worker processes bound with SO_REUSEPORT; more than 1 enables prefork mode
+SERVER_PROCESSES = 1
+
+# asyncio server: idle connections cost no thread, so they can stay open longer
+ASYNC_IDLE_TIMEOUT = 60
+ASYNC_MAX_CONNECTIONS = 10000
+
+# Cache-Control per route, merged over the defaults in cacheUtil
+CACHE_POLICIES = {
+    "static": "public, max-age=3600",
+}
+
+# Cross-process job state used when running several worker processes
+JOB_STATE_DIRECTORY = "/nas/storage/temp/jobs"
+
+# Upload dedup: "off", "auto", "reflink" or "hardlink" (see dedupUtil); the index covers all profiles
+DEDUP_MODE = "off"
+DEDUP_INDEX_FILE = "/nas/storage/temp/dedup.sqlite3"
+
+# Processes deflating zip archives in parallel; 0 means one per CPU
+ZIP_PROCESSES = 0
+
+# Zip jobs: archives built at once, jobs allowed to wait (in total and per profile),
+# seconds a finished archive is kept, and space the temp directory must keep free
+ZIP_JOB_WORKERS = 2
+ZIP_QUEUE_LIMIT = 32
+ZIP_PROFILE_QUEUE_LIMIT = 4
+ZIP_JOB_TTL = 3600
+ZIP_MIN_FREE_SPACE = 512 * 1024 * 1024
+
+# Thumbnail cache, the bytes it may use, and thumbnails decoded at the same time
+THUMB_CACHE_DIRECTORY = "/nas/storage/temp/thumbs"
+THUMB_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+THUMB_WORKERS = 2
+
+# Background thumbnail indexer: its checkpoint and status, and processes (0 turns it off)
+THUMB_INDEX_DIRECTORY = "/nas/storage/temp/thumb_index"
+THUMB_INDEX_PROCESSES = 1
+
+# Per-profile file catalogs behind /search, and seconds between the scans that reconcile them with the disk
+CATALOG_DIRECTORY = "/nas/storage/temp/catalog"
+CATALOG_RECONCILE_INTERVAL = 900
+
+zip_jobs = {}        # job records (state, progress, ETA), see zipJobUtil
 zip_paths = {}       # zip file path
 cancelled_jobs = set()
 
+# Jobs reported on /events; zip_jobs is looked up on each call as prefork mode replaces it
+register_job_source("zip", lambda profile: profile_jobs(zip_jobs, profile))
+register_job_source("thumbnails", profile_status)
+
+# Process that owns the server; logout stops it (and with it every prefork worker)
+SERVER_PID = os.getpid()
+PROFILE_PASSWORDS_MTIME = None
+
 def load_profile_passwords():
     global PROFILE_PASSWORDS
+    global PROFILE_PASSWORDS_MTIME
+    try:
+        PROFILE_PASSWORDS_MTIME = os.stat(PROFILE_PASSWORDS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        PROFILE_PASSWORDS_MTIME = None
     try:
         with open(PROFILE_PASSWORDS_FILE, "r", encoding="utf-8") as f:
             PROFILE_PASSWORDS = json.load(f)
@@ -71,7 +153,53 @@ def get_profiles_list():
             PUBLIC_PROFILE = profile
             break
 
+def refresh_profiles():
+    """Reload profiles.json if another worker process has changed it since we loaded it."""
+    try:
+        mtime = os.stat(PROFILE_PASSWORDS_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime != PROFILE_PASSWORDS_MTIME:
+        load_profile_passwords()
+        get_profiles_list()
+
+# Resumable upload session URLs: /uploads/<id>, /uploads/<id>/finalize and /uploads/<id>/chunks/<index>
+UPLOAD_SESSION_PATTERN = re.compile(r"^/uploads/([0-9a-f]{32})$")
+UPLOAD_FINALIZE_PATTERN = re.compile(r"^/uploads/([0-9a-f]{32})/finalize$")
+UPLOAD_CHUNK_PATTERN = re.compile(r"^/uploads/([0-9a-f]{32})/chunks/(\d{1,9})$")
+
 class FileHandler(SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
+
+    def handle_one_request(self):
+        # Idle timeout while waiting for the next request on a kept-alive connection.
+        # A saturated worker pool gets its worker back quickly instead of idling.
+        idle_timeout = KEEP_ALIVE_TIMEOUT
+        if self.requests_served and getattr(self.server, "is_saturated", lambda: False)():
+            idle_timeout = SATURATED_KEEP_ALIVE_TIMEOUT
+        self.connection.settimeout(idle_timeout)
+        super().handle_one_request()
+        self.requests_served += 1
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        # A request has started: allow slow uploads and downloads more time per read/write
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        if self.requests_served + 1 >= MAX_KEEP_ALIVE_REQUESTS:
+            self.close_connection = True
+        return True
+
+    def send_response(self, code, message=None):
+        super().send_response(code, message)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        else:
+            self.send_header("Keep-Alive", f"timeout={KEEP_ALIVE_TIMEOUT}, max={MAX_KEEP_ALIVE_REQUESTS - self.requests_served - 1}")
 
     def list_directory(self, path):
         return listDirectory(self, path, PROFILE_ROOT, CODE_DIRECTORY)
@@ -80,6 +208,7 @@ class FileHandler(SimpleHTTPRequestHandler):
         return translatePath(self, path, PROFILE_ROOT)
         
     def do_POST(self):
+        refresh_profiles()
         parsed_url = urlparse(self.path)
 
         if parsed_url.path == "/login":
@@ -102,9 +231,7 @@ class FileHandler(SimpleHTTPRequestHandler):
             get_profiles_list()
 
             # Redirect to profile selection after creation
-            self.send_response(302)
-            self.send_header("Location", "/switch")
-            self.end_headers()
+            send_redirect(self, 302, "/switch")
             return
 
         if parsed_url.path == "/remove-profile":
@@ -115,6 +242,8 @@ class FileHandler(SimpleHTTPRequestHandler):
 
             try:
                 shutil.rmtree(profile_path)
+                forget(profile_path)
+                drop_catalog(profile_path)
                 if profile_to_remove in PROFILE_PASSWORDS:
                     PROFILE_PASSWORDS.pop(profile_to_remove, None)
                     try:
@@ -127,9 +256,7 @@ class FileHandler(SimpleHTTPRequestHandler):
                 return
 
             # Redirect back to profile selection page after removal
-            self.send_response(302)
-            self.send_header("Location", "/switch")
-            self.end_headers()
+            send_redirect(self, 302, "/switch")
             return
 
         if parsed_url.path == "/create-folder":
@@ -138,27 +265,76 @@ class FileHandler(SimpleHTTPRequestHandler):
         elif parsed_url.path == "/upload":
             upload(self, parsed_url, PROFILE_ROOT, CODE_DIRECTORY)
 
+        elif parsed_url.path == "/upload-batch":
+            upload_batch(self, parsed_url, PROFILE_ROOT, CODE_DIRECTORY)
+
         elif parsed_url.path == "/rename":
             rename(self, PROFILE_ROOT)
 
         elif parsed_url.path == "/logout":
-            return logout(self, os.getpid())
+            return logout(self, SERVER_PID)
+
+        elif parsed_url.path == "/uploads":
+            create_upload(self, parsed_url, PROFILE_ROOT)
+
+        elif UPLOAD_FINALIZE_PATTERN.match(parsed_url.path):
+            finalize_upload(self, UPLOAD_FINALIZE_PATTERN.match(parsed_url.path).group(1), PROFILE_ROOT)
 
         elif parsed_url.path == "/bulk-download-zip":
-            bulk_download_zip(self, PROFILE_ROOT, TEMP_ZIP_DIRECTORY, progress_store, zip_paths, cancelled_jobs)
+            bulk_download_zip(self, PROFILE_ROOT, TEMP_ZIP_DIRECTORY, zip_jobs, zip_paths, cancelled_jobs)
+
+        elif parsed_url.path == "/cancel-zip":
+            cancel_zip(self, parsed_url, PROFILE_ROOT, zip_jobs, zip_paths, cancelled_jobs)
 
         else:
-            self.send_response(404)
-            self.end_headers()
+            # The request body was not read, so the connection cannot be reused
+            self.close_connection = True
+            send_empty(self, 404)
             
     def do_DELETE(self):
+        refresh_profiles()
         parsed_url = urlparse(self.path)
+        upload = UPLOAD_SESSION_PATTERN.match(parsed_url.path)
         if parsed_url.path == "/delete":
             delete(self, parsed_url, PROFILE_ROOT)
 
+        elif upload:
+            cancel_upload(self, upload.group(1), PROFILE_ROOT)
+
+        elif parsed_url.path == "/download-zip-file":
+            release_zip_file(self, parsed_url, PROFILE_ROOT, zip_jobs, zip_paths, cancelled_jobs)
+
         else:
-            self.send_response(404)
-            self.end_headers()
+            send_empty(self, 404)
+
+    def do_PATCH(self):
+        refresh_profiles()
+        parsed_url = urlparse(self.path)
+        upload = UPLOAD_SESSION_PATTERN.match(parsed_url.path)
+        if upload:
+            append_chunk(self, upload.group(1), PROFILE_ROOT)
+
+        else:
+            self.close_connection = True
+            send_empty(self, 404)
+
+    def do_PUT(self):
+        refresh_profiles()
+        parsed_url = urlparse(self.path)
+        chunk = UPLOAD_CHUNK_PATTERN.match(parsed_url.path)
+        if chunk:
+            put_chunk(self, chunk.group(1), int(chunk.group(2)), PROFILE_ROOT)
+
+        else:
+            self.close_connection = True
+            send_empty(self, 404)
+
+    def do_HEAD(self):
+        parsed_url = urlparse(self.path)
+        upload = UPLOAD_SESSION_PATTERN.match(parsed_url.path)
+        if upload:
+            return upload_status(self, upload.group(1), PROFILE_ROOT)
+        super().do_HEAD()
 
     def handle_details(self, parsed):
         params = parse_qs(parsed.query)
@@ -189,14 +365,10 @@ class FileHandler(SimpleHTTPRequestHandler):
             "path": file_path
         }
 
-        json_str = json.dumps(data)
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.send_header("Content-Length", str(len(json_str)))
-        self.end_headers()
-        self.wfile.write(json_str.encode("utf-8"))
+        send_json(self, 200, data)
             
     def do_GET(self):
+        refresh_profiles()
         parsed_url = urlparse(self.path)
         qs = parse_qs(parsed_url.query)
         requested_path = unquote(parsed_url.path)
@@ -212,6 +384,10 @@ class FileHandler(SimpleHTTPRequestHandler):
         if requested_path.startswith(f"/{PUBLIC_PROFILE}/"):
             return load_public_profile(self, requested_path, PUBLIC_PROFILE, PROFILE_ROOT, CODE_DIRECTORY)
 
+        # Thumbnails of the profile's own media, or the public profile's for share pages
+        if requested_path == "/thumb":
+            return send_thumbnail(self, qs, profile_name, PUBLIC_PROFILE, PROFILE_ROOT, CODE_DIRECTORY)
+
         for profile in PROFILE_LIST:
             if requested_path.startswith(f"/{profile}/"):
                 return load_profile(self, profile, profile_name, requested_path, PROFILE_ROOT, CODE_DIRECTORY)
@@ -234,11 +410,10 @@ class FileHandler(SimpleHTTPRequestHandler):
             profile_path = os.path.join(PROFILE_ROOT, new_profile)
             if os.path.isdir(profile_path):
                 # Set profile cookie but not authenticated yet
-                self.send_response(302)
-                self.send_header("Set-Cookie", f"profile={new_profile}; Path=/")
-                self.send_header("Set-Cookie", "authenticated=; Max-Age=0; Path=/")  # Clear auth
-                self.send_header("Location", "/")
-                self.end_headers()
+                send_redirect(self, 302, "/", cookies=(
+                    f"profile={new_profile}; Path=/",
+                    "authenticated=; Max-Age=0; Path=/",  # Clear auth
+                ))
             else:
                 send_error_page(self, 403, "Invalid profile name", CODE_DIRECTORY)
             return
@@ -284,14 +459,19 @@ class FileHandler(SimpleHTTPRequestHandler):
                 return
 
             try:
+                fs = os.stat(static_path)
+                etag = file_etag(fs)
+                if send_if_not_modified(self, "static", etag, fs.st_mtime):
+                    return
+
                 ctype = self.guess_type(static_path)
                 self.send_response(200)
                 self.send_header("Content-type", ctype)
-                fs = os.stat(static_path)
                 self.send_header("Content-Length", str(fs.st_size))
+                send_cache_headers(self, "static", etag, fs.st_mtime)
                 self.end_headers()
                 with open(static_path, "rb") as f:
-                    shutil.copyfileobj(f, self.wfile)
+                    send_file_body(self, f, 0, fs.st_size)
                 return
             except Exception as e:
                 print("Error serving static file:", e)
@@ -300,116 +480,40 @@ class FileHandler(SimpleHTTPRequestHandler):
         if parsed_url.path == "/details":
             return self.handle_details(parsed_url)
 
-        elif parsed_url.path == "/download-zip":
-            download_zip(self, parsed_url, PROFILE_ROOT, TEMP_ZIP_DIRECTORY, progress_store, zip_paths, cancelled_jobs)
-
-        elif parsed_url.path == "/zip-progress":
-            try:
-                query = parse_qs(parsed_url.query)
-                job_id = query.get("job_id", [None])[0]
+        elif parsed_url.path == "/list":
+            list_directory_json(self, parsed_url, PROFILE_ROOT)
 
-                if not job_id or job_id not in progress_store:
-                  self.send_response(404)
-                  self.end_headers()
-                  self.wfile.write(b"Job not found")
-                  return
+        elif parsed_url.path == "/search":
+            send_search(self, parsed_url, PROFILE_ROOT)
 
-                prog = progress_store[job_id]
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(f'{{"progress": {prog}}}'.encode())
-            except Exception as e:
-                print("Error fetching zip progress:", e)
-                traceback.print_exc()
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to fetch zip progress")
-        elif parsed_url.path == "/download-zip-file":
-            zip_path = None
-            try:
-                query = parse_qs(parsed_url.query)
-                job_id = query.get("job_id", [None])[0]
-                print(f"Query: {query}")
-                print(f"Job ID: {job_id}")
-
-                # Wait for the zip file to be ready (up to 30 seconds)
-                max_wait_time = 30  # seconds
-                wait_interval = 1   # seconds
-                waited = 0
-
-                while job_id not in zip_paths and waited < max_wait_time:
-                    time.sleep(wait_interval)
-                    waited += wait_interval
-                    print(f"Waiting for zip file... ({waited}s)")
-
-                if job_id not in zip_paths:
-                    self.send_response(404)
-                    self.end_headers()
-                    self.wfile.write(b"File not found (zip not ready)")
-                    return
+        elif UPLOAD_SESSION_PATTERN.match(parsed_url.path):
+            upload_info(self, UPLOAD_SESSION_PATTERN.match(parsed_url.path).group(1), PROFILE_ROOT)
 
-                zip_path = zip_paths[job_id]
-                print(f"Zip Path: {zip_path}")
-                folder_name = os.path.splitext(os.path.basename(zip_path))[0]
+        elif parsed_url.path == "/dedup-report":
+            send_json(self, 200, {"profile": dedup_report(self.profile_dir), "total": dedup_report()})
 
-                self.send_response(200)
-                self.send_header("Content-Type", "application/zip")
-                self.send_header("Content-Disposition", f'attachment; filename="{folder_name}.zip"')
-                fs = os.stat(zip_path)
-                self.send_header("Content-Length", str(fs.st_size))
-                self.end_headers()
+        elif parsed_url.path == "/server-status":
+            stats = getattr(self.server, "stats", None)
+            send_json(self, 200, stats() if stats else {"mode": "threaded"})
 
-                with open(zip_path, "rb") as f:
-                  shutil.copyfileobj(f, self.wfile)
+        elif parsed_url.path == "/download-zip":
+            download_zip(self, parsed_url, PROFILE_ROOT, TEMP_ZIP_DIRECTORY, zip_jobs, zip_paths, cancelled_jobs)
 
-                # Clean up
-                print(f"Zip path: {zip_path}")
-                os.remove(zip_path)
-                del zip_paths[job_id]
-                del progress_store[job_id]
-            except Exception as e:
-                print("Error downloading zipped folder:", e)
-                if zip_path and os.path.exists(zip_path):
-                    os.remove(zip_path)
-                traceback.print_exc()
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to download ZIP file")
-        elif parsed_url.path == "/cancel-zip":
-            try:
-                query = parse_qs(parsed_url.query)
-                job_id = query.get("job_id", [None])[0]
+        elif parsed_url.path == "/events":
+            send_events(self, parsed_url, os.path.basename(self.profile_dir))
 
-                if not job_id or job_id not in progress_store:
-                    self.send_response(404)
-                    self.end_headers()
-                    self.wfile.write(b"Job not found")
-                    return
+        elif parsed_url.path == "/thumb-status":
+            send_json(self, 200, dict(profile_status(os.path.basename(self.profile_dir))))
 
-                cancelled_jobs.add(job_id)
+        elif parsed_url.path == "/zip-progress":
+            zip_progress(self, parsed_url, PROFILE_ROOT, zip_jobs)
 
-                # Remove zip file if it already exists
-                zip_path = zip_paths.get(job_id)
-                print(f"Zip path in /cancel: {zip_path}")
-                if zip_path and os.path.exists(zip_path):
-                    os.remove(zip_path)
-                    print(f"Removed partially created zip for job {job_id}")
+        elif parsed_url.path == "/download-zip-file":
+            download_zip_file(self, parsed_url, PROFILE_ROOT, CODE_DIRECTORY, zip_jobs, zip_paths)
 
-                # Clean up all job state
-                cancelled_jobs.discard(job_id)
-                zip_paths.pop(job_id, None)
-                progress_store.pop(job_id, None)
+        elif parsed_url.path == "/cancel-zip":
+            cancel_zip(self, parsed_url, PROFILE_ROOT, zip_jobs, zip_paths, cancelled_jobs)
 
-                self.send_response(200)
-                self.end_headers()
-                self.wfile.write(b"Zip job cancelled")
-            except Exception as e:
-                print("Error cancelling zip:", e)
-                traceback.print_exc()
-                self.send_response(500)
-                self.end_headers()
-                self.wfile.write(b"Failed to cancel zip job")
         else:
             # Default file serving with Range support
             try:
@@ -435,12 +539,60 @@ class FileHandler(SimpleHTTPRequestHandler):
 class ThreadedHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
     daemon_threads = True  # threads exit when main thread exits
 
+class PreforkThreadedHTTPServer(ReusePortMixin, ThreadedHTTPServer):
+    pass
+
+class PreforkPooledHTTPServer(ReusePortMixin, PooledHTTPServer):
+    pass
+
+def make_server(mode, workers, queue_size, reuse_port=False):
+    server_address = ("", PORT)
+    if mode == "pool":
+        server_class = PreforkPooledHTTPServer if reuse_port else PooledHTTPServer
+        return server_class(server_address, FileHandler, workers, queue_size, BUSY_RETRY_AFTER)
+    if mode == "async":
+        return AsyncHTTPServer(server_address, FileHandler, workers, ASYNC_IDLE_TIMEOUT, ASYNC_MAX_CONNECTIONS, reuse_port)
+    server_class = PreforkThreadedHTTPServer if reuse_port else ThreadedHTTPServer
+    return server_class(server_address, FileHandler)
+
 if __name__ == "__main__":
     os.makedirs(PROFILE_ROOT, exist_ok=True)
     os.makedirs(CODE_DIRECTORY, exist_ok=True)
     load_profile_passwords()
     get_profiles_list()
-    server_address = ("", PORT)
-    httpd = ThreadedHTTPServer(server_address, FileHandler)
-    print(f"Serving on port {PORT}...")
-    httpd.serve_forever()
+    configure_cache_policies(CACHE_POLICIES)
+    parser = argparse.ArgumentParser(description="NAS file server")
+    parser.add_argument("--mode", choices=["pool", "threaded", "async"], default=SERVER_MODE)
+    parser.add_argument("--workers", type=int, default=WORKER_POOL_SIZE, help="worker threads in pool and async modes")
+    parser.add_argument("--queue", type=int, default=ACCEPT_QUEUE_SIZE, help="connections allowed to wait in pool mode")
+    parser.add_argument("--processes", type=int, default=SERVER_PROCESSES, help="prefork worker processes sharing the port")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=DEDUP_MODE, help="store duplicate uploads as reflinks or hardlinks")
+    parser.add_argument("--zip-jobs", type=int, default=ZIP_JOB_WORKERS, help="zip jobs built at the same time")
+    parser.add_argument("--zip-processes", type=int, default=ZIP_PROCESSES, help="processes compressing zip archives (0: one per CPU)")
+    parser.add_argument("--thumb-index-processes", type=int, default=THUMB_INDEX_PROCESSES, help="processes making thumbnails ahead in the background (0: off)")
+    args = parser.parse_args()
+    configure_dedup(DEDUP_INDEX_FILE, args.dedup)
+    configure_zip_processes(args.zip_processes)
+    configure_zip_jobs(args.zip_jobs, ZIP_QUEUE_LIMIT, ZIP_PROFILE_QUEUE_LIMIT, ZIP_JOB_TTL, ZIP_MIN_FREE_SPACE)
+    configure_thumbnails(THUMB_CACHE_DIRECTORY, THUMB_CACHE_MAX_BYTES, THUMB_WORKERS)
+    configure_catalog(CATALOG_DIRECTORY, PROFILE_ROOT, CATALOG_RECONCILE_INTERVAL)
+    configure_thumbnail_index(THUMB_INDEX_DIRECTORY)
+    if args.thumb_index_processes > 0:
+        start_thumbnail_indexer(PROFILE_ROOT, args.thumb_index_processes, THUMB_CACHE_DIRECTORY, THUMB_CACHE_MAX_BYTES)
+
+    if args.processes > 1:
+        # Workers share job state through files so any of them can answer for a zip job
+        zip_jobs, zip_paths, cancelled_jobs = create_shared_job_state(JOB_STATE_DIRECTORY)
+
+    # Builds cut off by a restart are gone; finished zips stay reusable until they expire
+    sweep_zip_jobs(TEMP_ZIP_DIRECTORY, zip_jobs, zip_paths, cancelled_jobs, partial_age=0)
+
+    if args.processes > 1:
+        print(f"Serving on port {PORT} with {args.processes} {args.mode} worker processes...")
+        run_prefork(lambda: make_server(args.mode, args.workers, args.queue, reuse_port=True), args.processes)
+    else:
+        # Prefork workers start it on first use
+        start_catalog()
+        httpd = make_server(args.mode, args.workers, args.queue)
+        print(f"Serving on port {PORT} ({args.mode} mode, {args.workers} workers)...")
+        httpd.serve_forever()
@@ -1,82 +1,207 @@
 import os
 import re
+import time
+import uuid
+import socket
 import mimetypes
 from errorUtil import send_error_page
+from cacheUtil import file_etag, http_date, send_cache_headers, send_if_not_modified
 
-def send_file_with_range(handler, file_path, code_directory):
-    """Stream file with HTTP Range support for seeking."""
+# Use the kernel's sendfile() for file bodies when available
+ZERO_COPY = hasattr(os, "sendfile")
+
+# Buffer bounds for the copy loop used when zero-copy is not possible
+MIN_COPY_BUFFER = 64 * 1024
+MAX_COPY_BUFFER = 1024 * 1024
+
+# Requests asking for more ranges than this get the full file instead
+MAX_RANGES = 64
+
+def copy_with_buffer(handler, f, offset, count):
+    """Copy count bytes from f to the client, growing the buffer while the client keeps up."""
+    f.seek(offset)
+    buffer_size = MIN_COPY_BUFFER
+    buffer = bytearray(buffer_size)
+    sent = 0
+    while sent < count:
+        view = memoryview(buffer)[:min(buffer_size, count - sent)]
+        read = f.readinto(view)
+        if not read:
+            break
+        started = time.monotonic()
+        handler.wfile.write(view[:read])
+        elapsed = time.monotonic() - started
+        sent += read
+
+        # Double the buffer on fast writes, halve it when the client stalls
+        if elapsed < 0.005 and buffer_size < MAX_COPY_BUFFER:
+            buffer_size *= 2
+            buffer = bytearray(buffer_size)
+        elif elapsed > 0.1 and buffer_size > MIN_COPY_BUFFER:
+            buffer_size //= 2
+    return sent
+
+def send_file_body(handler, f, offset, count):
+    """Send count bytes of the open file f starting at offset. Returns the number of bytes sent."""
+    if count <= 0:
+        return 0
+
+    handler.wfile.flush()
+
+    # Writers that can stream files themselves (e.g. the asyncio server) take the range as is
+    writer_sendfile = getattr(handler.wfile, "sendfile", None)
+    if writer_sendfile:
+        return writer_sendfile(f, offset, count)
+
+    sock = getattr(handler, "connection", None)
+    if ZERO_COPY and type(sock) is socket.socket:
+        # socket.sendfile() uses os.sendfile() and honours the socket timeout
+        return sock.sendfile(f, offset, count)
+    return copy_with_buffer(handler, f, offset, count)
+
+def parse_range_header(range_header, file_size):
+    """
+    Parse a Range header (RFC 7233).
+    Returns:
+        - None if the header is malformed and must be ignored
+        - [] if no range is satisfiable
+        - sorted list of (start, end) byte ranges, overlapping ranges merged
+    """
+    unit, _, specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not specs:
+        return None
+
+    ranges = []
+    for spec in specs.split(","):
+        spec = spec.strip()
+        m = re.fullmatch(r"(\d*)-(\d*)", spec)
+        if not m or spec == "-":
+            return None
+
+        start, end = m.groups()
+        if not start:
+            # Suffix range: the last N bytes of the file
+            suffix = int(end)
+            if suffix == 0 or file_size == 0:
+                # An empty file has no last bytes to send
+                continue
+            ranges.append((max(file_size - suffix, 0), file_size - 1))
+            continue
+
+        start = int(start)
+        end = int(end) if end else None
+        if end is not None and end < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, file_size - 1 if end is None else min(end, file_size - 1)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def if_range_matches(if_range, etag, last_modified):
+    """Check an If-Range validator against the current entity."""
+    if_range = if_range.strip()
+    if if_range.startswith("W/"):
+        return False  # Weak validators never match for ranges
+    if if_range.startswith('"'):
+        return if_range == etag
+    return if_range == last_modified
+
+def send_multipart_ranges(handler, f, ranges, file_size, mime_type):
+    """Send a 206 multipart/byteranges response for several ranges."""
+    boundary = uuid.uuid4().hex
+    heads = [
+        (f"\r\n--{boundary}\r\n"
+         f"Content-Type: {mime_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n").encode("latin-1")
+        for start, end in ranges
+    ]
+    tail = f"\r\n--{boundary}--\r\n".encode("latin-1")
+    content_length = sum(len(head) for head in heads) + len(tail)
+    content_length += sum(end - start + 1 for start, end in ranges)
+
+    handler.send_header("Content-Type", f"multipart/byteranges; boundary={boundary}")
+    handler.send_header("Content-Length", str(content_length))
+    handler.end_headers()
+
+    for head, (start, end) in zip(heads, ranges):
+        handler.wfile.write(head)
+        send_file_body(handler, f, start, end - start + 1)
+    handler.wfile.write(tail)
+
+def send_file_with_range(handler, file_path, code_directory, cache_route="file", extra_headers=None):
+    """Stream file with HTTP Range support for seeking. extra_headers go on 200 and 206 replies."""
     try:
-        file_size = os.path.getsize(file_path)
+        stat = os.stat(file_path)
+        file_size = stat.st_size
+        etag = file_etag(stat)
+        last_modified = http_date(stat.st_mtime)
         mime_type, _ = mimetypes.guess_type(file_path)
         if not mime_type:
             mime_type = "application/octet-stream"
 
-        # Check if client sent a Range header
+        if send_if_not_modified(handler, cache_route, etag, stat.st_mtime):
+            return
+
+        # Check if client sent a Range header, ignoring it when If-Range no longer matches
         range_header = handler.headers.get("Range")
-        if range_header:
-            # Parse Range: bytes=start-end
-            m = re.match(r"bytes=(\d*)-(\d*)", range_header)
-            if not m:
-                send_error_page(handler, 400, "Invalid Range header", code_directory)
-                return
-
-            start, end = m.groups()
-            start = int(start) if start else 0
-            end = int(end) if end else file_size - 1
-
-            if start >= file_size:
-                send_error_page(handler, 416, "Requested Range Not Satisfiable", code_directory)
-                return
-
-            # Clamp end to file size
-            end = min(end, file_size - 1)
-            chunk_size = end - start + 1
-
-            handler.send_response(206)  # Partial Content
-            handler.send_header("Content-Type", mime_type)
-            handler.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
-            handler.send_header("Content-Length", str(chunk_size))
-            handler.send_header("Accept-Ranges", "bytes")
-            handler.end_headers()
-
-            with open(file_path, "rb") as f:
-                f.seek(start)
-                remaining = chunk_size
-                while remaining > 0:
-                    read_size = min(32 * 1024, remaining)
-                    data = f.read(read_size)
-                    if not data:
-                        break
-                    try:
-                        handler.wfile.write(data)
-                        handler.wfile.flush()
-                    except BrokenPipeError:
-                        print("Client disconnected during range transfer.")
-                        break
-                    remaining -= len(data)
+        if_range = handler.headers.get("If-Range")
+        if range_header and if_range and not if_range_matches(if_range, etag, last_modified):
+            range_header = None
 
-        else:
-            # No Range header — send full file
-            handler.send_response(200)
-            handler.send_header("Content-Type", mime_type)
-            handler.send_header("Content-Length", str(file_size))
-            handler.send_header("Accept-Ranges", "bytes")
-            handler.end_headers()
-
-            with open(file_path, "rb") as f:
-                while True:
-                    data = f.read(32 * 1024)
-                    if not data:
-                        break
-                    try:
-                        handler.wfile.write(data)
-                        handler.wfile.flush()
-                    except BrokenPipeError:
-                        print("Client disconnected during full transfer.")
-                        break
+        ranges = parse_range_header(range_header, file_size) if range_header else None
+        if ranges == []:
+            send_error_page(handler, 416, "Requested Range Not Satisfiable", code_directory,
+                            extra_headers={"Content-Range": f"bytes */{file_size}"})
+            return
+
+        with open(file_path, "rb") as f:
+            try:
+                if ranges:
+                    handler.send_response(206)  # Partial Content
+                    handler.send_header("Accept-Ranges", "bytes")
+                    send_cache_headers(handler, cache_route, etag, stat.st_mtime)
+                    for name, value in (extra_headers or {}).items():
+                        handler.send_header(name, value)
+
+                    if len(ranges) > 1:
+                        send_multipart_ranges(handler, f, ranges, file_size, mime_type)
+                        return
+
+                    start, end = ranges[0]
+                    chunk_size = end - start + 1
+                    handler.send_header("Content-Type", mime_type)
+                    handler.send_header("Content-Range", f"bytes {start}-{end}/{file_size}")
+                    handler.send_header("Content-Length", str(chunk_size))
+                    handler.end_headers()
+                    send_file_body(handler, f, start, chunk_size)
+
+                else:
+                    # No usable Range header — send full file
+                    handler.send_response(200)
+                    handler.send_header("Content-Type", mime_type)
+                    handler.send_header("Content-Length", str(file_size))
+                    handler.send_header("Accept-Ranges", "bytes")
+                    send_cache_headers(handler, cache_route, etag, stat.st_mtime)
+                    for name, value in (extra_headers or {}).items():
+                        handler.send_header(name, value)
+                    handler.end_headers()
+                    send_file_body(handler, f, 0, file_size)
+            except (BrokenPipeError, ConnectionResetError):
+                print("Client disconnected during file transfer.")
 
     except Exception as e:
         try:
             send_error_page(handler, 500, f"Error streaming file: {e}", code_directory)
         except BrokenPipeError:
-            pass
\ No newline at end of file
+            pass
@@ -1,7 +1,8 @@
+from responseUtil import send_redirect
+
 def switch(handler):
-    handler.send_response(302)
-    handler.send_header("Set-Cookie", "profile=; Max-Age=0; Path=/")  # Clear cookie
-    handler.send_header("Set-Cookie", "authenticated=; Max-Age=0; Path=/")  # Clear auth cookie
-    handler.send_header("Location", "/")
-    handler.end_headers()
+    send_redirect(handler, 302, "/", cookies=(
+        "profile=; Max-Age=0; Path=/",  # Clear cookie
+        "authenticated=; Max-Age=0; Path=/",  # Clear auth cookie
+    ))
     return
\ No newline at end of file
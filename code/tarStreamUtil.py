@@ -0,0 +1,116 @@
+import shutil
+import tarfile
+import threading
+import subprocess
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# Two zero blocks end an archive
+END_OF_ARCHIVE = bytes(2 * BLOCK_SIZE)
+
+# Bytes read from a file and handed to the compressor at a time
+READ_SIZE = 1024 * 1024
+
+# ?format= values besides zip: suffix of the download, Content-Type, and the external
+# compressors to pipe the tar through, first one installed wins. zstd -T0 and pigz use
+# every core; plain tar needs no CPU at all.
+TAR_FORMATS = {
+    "tar": (".tar", "application/x-tar", []),
+    "tar.zst": (".tar.zst", "application/zstd", [["zstd", "-T0", "-3", "-q", "-c"]]),
+    "tar.gz": (".tar.gz", "application/gzip", [["pigz", "-3", "-c"], ["gzip", "-3", "-c"]]),
+}
+
+def tar_header(arcname, stat):
+    """ustar header block(s) for a regular file, with a PAX header for long or non-ASCII names."""
+    info = tarfile.TarInfo(arcname)
+    info.size = stat.st_size
+    info.mtime = int(stat.st_mtime)
+    info.mode = stat.st_mode & 0o7777
+    return info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+
+def padding(size):
+    return bytes(-size % BLOCK_SIZE)
+
+def tar_archive_size(entries):
+    """Exact size of the uncompressed tar of `entries`, for Content-Length."""
+    total = len(END_OF_ARCHIVE)
+    for _, arcname, stat in entries:
+        total += len(tar_header(arcname, stat)) + stat.st_size + len(padding(stat.st_size))
+    return total
+
+def compressor_command(archive_format):
+    """Command of the first installed compressor for a TAR_FORMATS entry, or None."""
+    for command in TAR_FORMATS[archive_format][2]:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+def write_tar_entries(out, entries, send_file=None):
+    """
+    Write a tar of `entries` to `out`. send_file(f, size), when given, sends a file's
+    data itself (sendfile) and returns the bytes sent. A file that shrank meanwhile is
+    padded with zeros so the announced sizes still hold, and one that can no longer be
+    read is sent as zeros for the same reason.
+    """
+    for path, arcname, stat in entries:
+        size = stat.st_size
+        try:
+            f = open(path, "rb")
+        except OSError as e:
+            print(f"[Tar Stream] Cannot read {path}, sending zeros: {e}")
+            out.write(tar_header(arcname, stat))
+            for offset in range(0, size, READ_SIZE):
+                out.write(bytes(min(READ_SIZE, size - offset)))
+            out.write(padding(size))
+            continue
+        with f:
+            out.write(tar_header(arcname, stat))
+            if send_file:
+                sent = send_file(f, size)
+            else:
+                sent = 0
+                while sent < size:
+                    data = f.read(min(READ_SIZE, size - sent))
+                    if not data:
+                        break
+                    out.write(data)
+                    sent += len(data)
+            if sent < size:
+                out.write(bytes(size - sent))
+        out.write(padding(size))
+    out.write(END_OF_ARCHIVE)
+
+def pipe_through(command, produce, out):
+    """
+    Run `command` (a compressor reading stdin) with produce(stdin) feeding it on this
+    thread while its output is copied to `out` on another. Raises the first error of
+    either side; a failed write to `out` (client gone) stops the compressor.
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    errors = []
+
+    def copy_output():
+        try:
+            for data in iter(lambda: process.stdout.read1(READ_SIZE), b""):
+                out.write(data)
+        except Exception as e:
+            errors.append(e)
+            process.kill()
+
+    reader = threading.Thread(target=copy_output, daemon=True)
+    reader.start()
+    try:
+        produce(process.stdin)
+        process.stdin.close()
+    except BrokenPipeError:
+        pass  # the reader failed and killed the compressor; its error is raised below
+    except BaseException:
+        process.kill()
+        raise
+    finally:
+        reader.join()
+        process.wait()
+    if errors:
+        raise errors[0]
+    if process.returncode:
+        raise OSError(f"{command[0]} exited with status {process.returncode}")
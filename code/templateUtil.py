@@ -0,0 +1,101 @@
+import os
+import re
+import time
+import threading
+
+# How often (seconds) a cached template's file is checked for changes.
+# Between checks, rendering a page does not touch the disk at all.
+TEMPLATE_CHECK_INTERVAL = 2
+
+# {{name}}, {% if name %} and {% endif %}
+TOKEN_PATTERN = re.compile(r"{{\s*(\w+)\s*}}|{%\s*if\s+(\w+)\s*%}|{%\s*endif\s*%}")
+
+class Template:
+    """
+    An html/ file split once into literal text and placeholders.
+    Segments are strings (literal text), ("var", name) or ("if", name, segments).
+    """
+
+    def __init__(self, path, mtime, source):
+        self.path = path
+        self.mtime = mtime
+        self.checked_at = time.monotonic()
+        self.segments = self.compile(source)
+
+    def compile(self, source):
+        root = []
+        stack = [(None, root)]
+        position = 0
+        for match in TOKEN_PATTERN.finditer(source):
+            segments = stack[-1][1]
+            if match.start() > position:
+                segments.append(source[position:match.start()])
+            position = match.end()
+
+            variable, condition = match.group(1), match.group(2)
+            if variable:
+                segments.append(("var", variable))
+            elif condition:
+                block = []
+                segments.append(("if", condition, block))
+                stack.append((condition, block))
+            elif len(stack) > 1:
+                stack.pop()
+            else:
+                # Stray {% endif %}: keep it as text rather than failing the page
+                segments.append(match.group(0))
+
+        if position < len(source):
+            stack[-1][1].append(source[position:])
+        return root
+
+    def render(self, values):
+        parts = []
+        self._render_into(self.segments, values, parts)
+        return "".join(parts)
+
+    def _render_into(self, segments, values, parts):
+        for segment in segments:
+            if isinstance(segment, str):
+                parts.append(segment)
+            elif segment[0] == "var":
+                value = values.get(segment[1])
+                # Unknown placeholders are left in the page, as str.replace did
+                parts.append("{{" + segment[1] + "}}" if value is None else str(value))
+            elif values.get(segment[1]):
+                self._render_into(segment[2], values, parts)
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_template(code_directory, name):
+    """
+    Compiled template for code/html/<name>, reloaded when the file's mtime changes.
+    Raises FileNotFoundError if the file does not exist.
+    """
+    path = os.path.join(code_directory, "html", name)
+    now = time.monotonic()
+    template = _templates.get(path)
+    if template and now - template.checked_at < TEMPLATE_CHECK_INTERVAL:
+        return template
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        with _templates_lock:
+            _templates.pop(path, None)
+        raise
+
+    if template and template.mtime == mtime:
+        template.checked_at = now
+        return template
+
+    with open(path, "r", encoding="utf-8") as f:
+        template = Template(path, mtime, f.read())
+    with _templates_lock:
+        _templates[path] = template
+    return template
+
+def render_template(code_directory, name, **values):
+    """Render code/html/<name> with one join. Raises FileNotFoundError if the template is missing."""
+    return get_template(code_directory, name).render(values)
@@ -0,0 +1,373 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import traceback
+import subprocess
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import thumbnailUtil
+from thumbnailUtil import can_decode, thumb_key, cache_path, get_thumbnail
+
+# Checkpoint (folders done, with their mtime), status for /thumb-status and /events, and
+# folders the server asked to do first; files so every server process can use them
+THUMB_INDEX_DIRECTORY = "/nas/storage/temp/thumb_index"
+CHECKPOINT_FILE = "checkpoint.json"
+STATUS_FILE = "status.json"
+HINTS_FILE = "hints"
+
+# The hints file stops growing at this size until the indexer takes it
+HINTS_MAX_BYTES = 64 * 1024
+
+# Thumbnails made ahead for every picture and video: the sizes the gallery and carousel
+# ask for on ordinary and high-density screens (see THUMB_SIZES), in the page's format
+THUMB_INDEX_SIZES = (320, 640)
+THUMB_INDEX_FORMAT = "jpeg"
+
+# Processes decoding thumbnails; all of them run at idle CPU and I/O priority
+THUMB_INDEX_PROCESSES = 1
+
+# Seconds between rescans; only folders whose mtime changed are read again
+THUMB_INDEX_INTERVAL = 600
+
+# Seconds between checkpoint writes, status writes, and looks for new hints when idle
+CHECKPOINT_INTERVAL = 30
+STATUS_INTERVAL = 1.0
+HINT_INTERVAL = 2
+
+_status_cache = {"mtime": None, "status": {}}
+_hints = {"enabled": False, "last": None, "at": 0.0}
+
+def configure_thumbnail_index(directory):
+    global THUMB_INDEX_DIRECTORY
+    THUMB_INDEX_DIRECTORY = directory
+    os.makedirs(directory, exist_ok=True)
+
+def _path(name):
+    return os.path.join(THUMB_INDEX_DIRECTORY, name)
+
+def _write_json(name, data):
+    fd, tmp_path = tempfile.mkstemp(dir=THUMB_INDEX_DIRECTORY, prefix=".tmp-")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, _path(name))
+
+def _read_json(name):
+    try:
+        with open(_path(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def start_thumbnail_indexer(profile_root, processes, cache_directory, cache_max_bytes):
+    """
+    Run the indexer as a separate process started with ionice -c 3 (idle I/O class), so
+    it can never hold up the server, in any server mode. It stops when the server does.
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--profile-root", profile_root,
+               "--index-directory", THUMB_INDEX_DIRECTORY, "--processes", str(processes),
+               "--cache-directory", cache_directory, "--cache-max-bytes", str(cache_max_bytes),
+               "--parent-pid", str(os.getpid())]
+    ionice = shutil.which("ionice")
+    if ionice:
+        command = [ionice, "-c", "3"] + command
+    # Prefork workers are forked after this, so they note folders too
+    _hints["enabled"] = True
+    return subprocess.Popen(command, stdin=subprocess.DEVNULL)
+
+def note_folder(folder):
+    """Ask the indexer to do `folder` next (it was just browsed or uploaded to)."""
+    now = time.monotonic()
+    # Nothing takes the hints with the indexer off; a batch upload notes one folder once
+    if not _hints["enabled"] or (folder == _hints["last"] and now - _hints["at"] < HINT_INTERVAL):
+        return
+    _hints["last"], _hints["at"] = folder, now
+    try:
+        if os.path.getsize(_path(HINTS_FILE)) >= HINTS_MAX_BYTES:
+            return
+    except OSError:
+        pass
+    try:
+        with open(_path(HINTS_FILE), "a", encoding="utf-8", errors="surrogateescape") as f:
+            f.write(folder + "\n")
+    except OSError:
+        pass
+
+def note_upload(path):
+    """note_folder() for the folder of an uploaded file, if it is a picture or video."""
+    if can_decode(path):
+        note_folder(os.path.dirname(path))
+
+def profile_status(profile):
+    """(job id, record) of the indexer's progress in a profile, for /events and /thumb-status."""
+    try:
+        mtime = os.stat(_path(STATUS_FILE)).st_mtime_ns
+    except OSError:
+        return []
+    if mtime != _status_cache["mtime"]:
+        _status_cache["status"] = _read_json(STATUS_FILE)
+        _status_cache["mtime"] = mtime
+    record = _status_cache["status"].get(profile)
+    return [("thumbnails", record)] if record else []
+
+def lower_priority():
+    """Idle CPU scheduling for this process and every thread and process it starts later."""
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+    except (AttributeError, OSError):
+        os.nice(19)
+
+def _init_worker(cache_directory, cache_max_bytes):
+    lower_priority()
+    thumbnailUtil.configure_thumbnails(cache_directory, cache_max_bytes, 1)
+
+def _make_thumbnail(path, size, fmt):
+    try:
+        return get_thumbnail(path, size, fmt) is not None
+    except OSError:
+        return False
+
+def scan_folders(profile_root):
+    """(folder, mtime_ns) of every folder of every profile; linked folders are not followed."""
+    stack = [profile_root]
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            # Hidden folders include upload sessions (.uploads)
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    yield entry.path, entry.stat(follow_symlinks=False).st_mtime_ns
+            except OSError:
+                continue
+
+def missing_thumbnails(folder):
+    """(path, size) of the folder's pictures and videos whose thumbnails are not cached yet."""
+    missing = []
+    try:
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return missing
+    for entry in entries:
+        if entry.name.startswith(".") or not can_decode(entry.name):
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+        except OSError:
+            continue
+        for size in THUMB_INDEX_SIZES:
+            if not os.path.exists(cache_path(thumb_key(stat, size, THUMB_INDEX_FORMAT), THUMB_INDEX_FORMAT)):
+                missing.append((entry.path, size))
+    return missing
+
+class ThumbnailIndexer:
+    """
+    Fills the thumbnail cache ahead of the gallery. Each pass walks the profiles' folders
+    and does those whose mtime changed since they were last done, newest first so fresh
+    uploads come early; folders in the hints file (just browsed or uploaded to) jump the
+    queue. Folders done are checkpointed, so a restart carries on where it stopped.
+    """
+
+    def __init__(self, profile_root, processes, cache_directory, cache_max_bytes, parent_pid=None):
+        self.profile_root = os.path.realpath(profile_root)
+        self.parent_pid = parent_pid
+        self.processes = max(1, processes)
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context(method),
+                                        initializer=_init_worker, initargs=(cache_directory, cache_max_bytes))
+        self.done = _read_json(CHECKPOINT_FILE).get("folders", {})
+        self.status = _read_json(STATUS_FILE)
+        self.pending = OrderedDict()  # folder -> mtime_ns, in the order they are done
+        self.saved_at = self.status_at = time.monotonic()
+
+    def server_alive(self):
+        if self.parent_pid is None:
+            return True
+        try:
+            os.kill(self.parent_pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+
+    def profile(self, folder):
+        return os.path.relpath(folder, self.profile_root).split(os.sep)[0]
+
+    def run_pass(self):
+        """Scan for changed folders and do them. Returns False if the server went away."""
+        started = time.time()
+        found = [(mtime, folder) for folder, mtime in scan_folders(self.profile_root)
+                 if self.done.get(folder) != mtime]
+        found.sort(reverse=True)
+        self.pending = OrderedDict((folder, mtime) for mtime, folder in found)
+
+        # Profiles with nothing to do keep the record of their last pass
+        counted = set()
+        for folder in self.pending:
+            profile = self.profile(folder)
+            if profile not in counted:
+                self.status[profile] = self.new_record(started)
+                counted.add(profile)
+            self.status[profile]["folders_total"] += 1
+        self.write_status(force=True)
+
+        if not self.index_pending():
+            return False
+        # Folders that no longer exist are dropped from the checkpoint
+        for folder in [folder for folder in self.done if not os.path.isdir(folder)]:
+            del self.done[folder]
+        self.save_checkpoint()
+        return True
+
+    def index_pending(self):
+        """Do the pending and hinted folders. Returns False if the server went away."""
+        worked = False
+        while True:
+            if not self.server_alive():
+                return False
+            folder = self.next_folder()
+            if folder is None:
+                break
+            self.index_folder(folder)
+            worked = True
+
+        if worked:
+            now = time.time()
+            for record in self.status.values():
+                if record["state"] == "running":
+                    record.update(state="done", folder=None, finished=now, updated=now)
+            self.write_status(force=True)
+        return True
+
+    def new_record(self, started):
+        return {"state": "running", "folders_total": 0, "folders_done": 0, "thumbnails": 0, "failed": 0,
+                "folder": None, "started": started, "finished": None, "updated": time.time()}
+
+    def take_hints(self):
+        """Folders noted by the server since the last look, most recent first."""
+        path = _path(HINTS_FILE)
+        taken = path + ".taking"
+        try:
+            os.replace(path, taken)
+        except FileNotFoundError:
+            return []
+        with open(taken, "r", encoding="utf-8", errors="surrogateescape") as f:
+            lines = f.read().splitlines()
+        os.remove(taken)
+        hints = []
+        for line in reversed(lines):
+            folder = os.path.realpath(line)
+            if folder not in hints and folder.startswith(self.profile_root + os.sep) and os.path.isdir(folder):
+                hints.append(folder)
+        return hints
+
+    def next_folder(self):
+        for folder in reversed(self.take_hints()):
+            # A browsed folder is brought forward if it is due, and checked anyway if not:
+            # a file edited in place leaves its folder's mtime alone
+            self.pending[folder] = self.pending.get(folder)
+            self.pending.move_to_end(folder, last=False)
+        if not self.pending:
+            return None
+        return next(iter(self.pending))
+
+    def index_folder(self, folder):
+        mtime = self.pending.pop(folder)
+        if mtime is None:
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                return
+        profile = self.profile(folder)
+        record = self.status.setdefault(profile, self.new_record(time.time()))
+        record.update(state="running", folder=os.path.relpath(folder, os.path.join(self.profile_root, profile)),
+                      finished=None)
+        self.write_status()
+
+        # Up to two thumbnails per process queued at a time keeps the pool busy and hints fresh
+        window = deque()
+        for path, size in missing_thumbnails(folder):
+            window.append(self.pool.submit(_make_thumbnail, path, size, THUMB_INDEX_FORMAT))
+            if len(window) >= 2 * self.processes:
+                self.collect(window.popleft(), record)
+        while window:
+            self.collect(window.popleft(), record)
+
+        if self.done.get(folder) != mtime:
+            record["folders_done"] = min(record["folders_done"] + 1, record["folders_total"])
+        self.done[folder] = mtime
+        record["updated"] = time.time()
+        self.write_status()
+        if time.monotonic() - self.saved_at >= CHECKPOINT_INTERVAL:
+            self.save_checkpoint()
+
+    def collect(self, future, record):
+        try:
+            made = future.result()
+        except Exception as e:
+            print(f"[Thumbnail Index] Thumbnail failed: {e}")
+            made = False
+        record["thumbnails" if made else "failed"] += 1
+        record["updated"] = time.time()
+        self.write_status()
+
+    def write_status(self, force=False):
+        if force or time.monotonic() - self.status_at >= STATUS_INTERVAL:
+            _write_json(STATUS_FILE, self.status)
+            self.status_at = time.monotonic()
+
+    def save_checkpoint(self):
+        _write_json(CHECKPOINT_FILE, {"folders": self.done, "saved": time.time()})
+        self.saved_at = time.monotonic()
+
+    def run_forever(self, once=False):
+        try:
+            while self.run_pass() and not once:
+                next_pass = time.monotonic() + THUMB_INDEX_INTERVAL
+                while time.monotonic() < next_pass:
+                    time.sleep(HINT_INTERVAL)
+                    # Between passes only the folders just browsed or uploaded to are looked at
+                    if not self.index_pending():
+                        return
+        finally:
+            self.save_checkpoint()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fill the NAS thumbnail cache in the background")
+    parser.add_argument("--profile-root", default="/nas/storage/profiles")
+    parser.add_argument("--index-directory", default=THUMB_INDEX_DIRECTORY)
+    parser.add_argument("--processes", type=int, default=THUMB_INDEX_PROCESSES)
+    parser.add_argument("--cache-directory", default=thumbnailUtil.THUMB_CACHE_DIRECTORY)
+    parser.add_argument("--cache-max-bytes", type=int, default=thumbnailUtil.THUMB_CACHE_MAX_BYTES)
+    parser.add_argument("--parent-pid", type=int, help="stop when this process (the server) exits")
+    parser.add_argument("--once", action="store_true", help="do one pass and exit")
+    args = parser.parse_args()
+
+    lower_priority()
+    configure_thumbnail_index(args.index_directory)
+    thumbnailUtil.configure_thumbnails(args.cache_directory, args.cache_max_bytes, 1)
+    try:
+        ThumbnailIndexer(args.profile_root, args.processes, args.cache_directory, args.cache_max_bytes,
+                         args.parent_pid).run_forever(once=args.once)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"[Thumbnail Index] Stopped: {e}")
+        traceback.print_exc()
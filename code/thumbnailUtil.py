@@ -0,0 +1,327 @@
+import os
+import io
+import time
+import shutil
+import hashlib
+import tempfile
+import functools
+import threading
+import subprocess
+from collections import OrderedDict
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow is optional; ffmpeg (if installed) decodes images then
+    Image = None
+
+from errorUtil import send_error_page
+from responseUtil import send_text
+from streamingUtil import send_file_with_range
+
+# Generated thumbnails, named after what they were made from (see thumb_key)
+THUMB_CACHE_DIRECTORY = "/nas/storage/temp/thumbs"
+
+# The cache is trimmed back to THUMB_CACHE_TRIM of this many bytes, least recently used first
+THUMB_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024
+THUMB_CACHE_TRIM = 0.9
+
+# Longest side of a thumbnail; ?size= is rounded up to one of these so the cache stays small
+THUMB_SIZES = (160, 320, 640)
+THUMB_QUALITY = 80
+
+# Thumbnails decoded at the same time; a 12 MP photo takes a core for a moment
+THUMB_WORKERS = 2
+
+# A cache hit refreshes the file's mtime (its LRU age) at most this often
+THUMB_TOUCH_INTERVAL = 3600
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+VIDEO_EXTENSIONS = (".mp4", ".webm", ".ogg", ".mov", ".mkv")
+
+# Video posters are taken this far in, past fade-ins and black first frames
+POSTER_SECOND = 1
+FFMPEG_TIMEOUT = 30
+
+# Files that could not be decoded are not tried again for every request
+FAILED_LIMIT = 1024
+
+_slots = threading.BoundedSemaphore(THUMB_WORKERS)
+_lock = threading.Lock()
+_building = {}       # cache key -> Event set when its thumbnail is written
+_failed = OrderedDict()
+_cache = {"bytes": None, "trimming": False}
+
+def configure_thumbnails(cache_directory, max_bytes, workers):
+    global THUMB_CACHE_DIRECTORY, THUMB_CACHE_MAX_BYTES, THUMB_WORKERS, _slots
+    THUMB_CACHE_DIRECTORY = cache_directory
+    THUMB_CACHE_MAX_BYTES = max_bytes
+    THUMB_WORKERS = max(1, workers)
+    _slots = threading.BoundedSemaphore(THUMB_WORKERS)
+    _cache["bytes"] = None
+    os.makedirs(cache_directory, exist_ok=True)
+
+@functools.lru_cache(maxsize=1)
+def ffmpeg_path():
+    return shutil.which("ffmpeg")
+
+def can_decode(path):
+    """Whether a thumbnail of `path` can be made with what is installed."""
+    name = path.lower()
+    if name.endswith(VIDEO_EXTENSIONS):
+        return ffmpeg_path() is not None
+    if name.endswith(IMAGE_EXTENSIONS):
+        return Image is not None or ffmpeg_path() is not None
+    return False
+
+def thumb_size(requested):
+    """The smallest of THUMB_SIZES at least `requested` pixels, or the largest."""
+    for size in THUMB_SIZES:
+        if size >= requested:
+            return size
+    return THUMB_SIZES[-1]
+
+def thumb_format(requested):
+    # WebP needs Pillow built with libwebp; anything else gets JPEG
+    if requested == "webp" and Image is not None and features.check("webp"):
+        return "webp"
+    return "jpeg"
+
+def thumb_key(stat, size, fmt):
+    """
+    Cache key of a thumbnail: the source file's identity and version (device, inode,
+    size, mtime) plus the thumbnail size and format. An edited or replaced file gets a
+    new key, and renaming or moving it keeps the old one.
+    """
+    source = f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}:{size}:{fmt}"
+    return hashlib.sha256(source.encode("ascii")).hexdigest()
+
+def cache_path(key, fmt):
+    return os.path.join(THUMB_CACHE_DIRECTORY, key[:2], f"{key}.{'webp' if fmt == 'webp' else 'jpg'}")
+
+def get_thumbnail(path, size, fmt="jpeg"):
+    """
+    Path of the cached thumbnail of `path` (size from THUMB_SIZES, fmt from thumb_format),
+    generated first if needed, or None when it cannot be decoded. Requests for a
+    thumbnail that is being generated wait for it instead of decoding it again.
+    """
+    stat = os.stat(path)
+    key = thumb_key(stat, size, fmt)
+    target = cache_path(key, fmt)
+
+    while True:
+        if _use_cached(target):
+            return target
+        with _lock:
+            if key in _failed:
+                return None
+            pending = _building.get(key)
+            if pending is None:
+                done = _building[key] = threading.Event()
+                break
+        pending.wait()
+
+    try:
+        with _slots:
+            if _use_cached(target):
+                return target
+            data = render_thumbnail(path, size, fmt)
+            if data is None:
+                with _lock:
+                    _failed[key] = True
+                    while len(_failed) > FAILED_LIMIT:
+                        _failed.popitem(last=False)
+                return None
+            _store(target, data)
+            return target
+    finally:
+        with _lock:
+            del _building[key]
+        done.set()
+
+def _use_cached(target):
+    try:
+        mtime = os.stat(target).st_mtime
+    except OSError:
+        return False
+    now = time.time()
+    if now - mtime > THUMB_TOUCH_INTERVAL:
+        try:
+            os.utime(target, (now, now))
+        except OSError:
+            pass
+    return True
+
+def _store(target, data):
+    """Write atomically, so a reader never sees half a thumbnail."""
+    folder = os.path.dirname(target)
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    with _lock:
+        if _cache["bytes"] is not None:
+            _cache["bytes"] += len(data)
+        if (_cache["bytes"] is None or _cache["bytes"] > THUMB_CACHE_MAX_BYTES) and not _cache["trimming"]:
+            _cache["trimming"] = True
+            threading.Thread(target=trim_cache, daemon=True).start()
+
+def trim_cache():
+    """
+    Remove the least recently used thumbnails (oldest mtime) until the cache is back
+    under THUMB_CACHE_TRIM of its limit. Also counts the cache after a start; with
+    several worker processes each keeps its own count and corrects it here.
+    """
+    try:
+        files = []
+        now = time.time()
+        for folder, _, names in os.walk(THUMB_CACHE_DIRECTORY):
+            for name in names:
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.startswith(".tmp-"):
+                    # Left behind by a crash; a write in progress is only a moment old
+                    if now - stat.st_mtime > THUMB_TOUCH_INTERVAL:
+                        _remove(path)
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        if total > THUMB_CACHE_MAX_BYTES:
+            files.sort()
+            limit = THUMB_CACHE_MAX_BYTES * THUMB_CACHE_TRIM
+            removed = 0
+            for mtime, size, path in files:
+                if total <= limit:
+                    break
+                # Thumbnails written or used a moment ago may be about to be sent
+                if now - mtime < 60:
+                    break
+                if _remove(path):
+                    total -= size
+                    removed += 1
+            if removed:
+                print(f"[Thumbnails] Evicted {removed} thumbnails, cache now {total} bytes")
+        with _lock:
+            _cache["bytes"] = total
+    finally:
+        with _lock:
+            _cache["trimming"] = False
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+def render_thumbnail(path, size, fmt):
+    """Encoded thumbnail bytes of an image or a video's poster frame, or None."""
+    is_video = path.lower().endswith(VIDEO_EXTENSIONS)
+    if Image is not None and not is_video:
+        try:
+            with Image.open(path) as image:
+                return _encode(image, size, fmt)
+        except Exception as e:
+            print(f"[Thumbnails] Pillow could not decode {path}: {e}")
+
+    frame = _ffmpeg_frame(path, size, is_video)
+    if frame is not None and fmt == "webp":
+        with Image.open(io.BytesIO(frame)) as image:
+            return _encode(image, size, fmt)
+    return frame
+
+def _encode(image, size, fmt):
+    # draft() lets the JPEG decoder scale down by up to 8x while decoding, which is most
+    # of the saving on camera photos; thumbnail() then resizes the rest of the way
+    image.draft("RGB", (size, size))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((size, size), Image.LANCZOS)
+    out = io.BytesIO()
+    if fmt == "webp":
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        image.save(out, "WEBP", quality=THUMB_QUALITY, method=4)
+    else:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        image.save(out, "JPEG", quality=THUMB_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+def _ffmpeg_frame(path, size, is_video):
+    """One frame scaled to fit size x size, as JPEG, using ffmpeg if it is installed."""
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None:
+        return None
+    scale = (f"scale='min({size},iw)':'min({size},ih)':force_original_aspect_ratio=decrease,"
+             f"format=yuvj420p")
+    # Videos shorter than POSTER_SECOND have no frame there, so try the first one next
+    for seek in ([["-ss", str(POSTER_SECOND)], []] if is_video else [[]]):
+        command = [ffmpeg, "-v", "error", "-nostdin", *seek, "-i", path, "-frames:v", "1",
+                   "-vf", scale, "-q:v", "4", "-f", "image2pipe", "-vcodec", "mjpeg", "-"]
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    timeout=FFMPEG_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"[Thumbnails] ffmpeg failed on {path}: {e}")
+            return None
+        if result.returncode == 0 and result.stdout:
+            return result.stdout
+    print(f"[Thumbnails] ffmpeg could not decode {path}: {result.stderr.decode(errors='replace').strip()}")
+    return None
+
+def resolve_media_path(path, profile_name, public_profile, profile_root):
+    """
+    File behind a media URL path ("/<profile>/<folder>/<name>"), if the requester may
+    read it: their own profile's files, or the public profile's. None otherwise.
+    """
+    parts = path.strip("/").split("/", 1)
+    if len(parts) < 2 or not parts[0] or parts[0] not in (profile_name, public_profile):
+        return None
+    root = os.path.realpath(os.path.join(profile_root, parts[0]))
+    file_path = os.path.realpath(os.path.join(root, parts[1]))
+    if not file_path.startswith(root + os.sep):
+        return None
+    return file_path
+
+def send_thumbnail(handler, qs, profile_name, public_profile, profile_root, code_directory):
+    """
+    /thumb?path=/<profile>/<file>&size=<px>&format=jpeg|webp: a thumbnail of an image, or
+    a poster frame of a video, no larger than size (rounded up to THUMB_SIZES) on its
+    longest side. Answers 404 when nothing installed can decode the file, so the page
+    falls back to the original. With &v=<mtime> the reply may be cached for a day.
+    """
+    file_path = resolve_media_path(qs.get("path", [""])[0], profile_name, public_profile, profile_root)
+    if file_path is None:
+        send_error_page(handler, 403, "You are not authorised", code_directory)
+        return
+    if not os.path.isfile(file_path):
+        send_error_page(handler, 404, "File not found", code_directory)
+        return
+
+    try:
+        size = thumb_size(int(qs.get("size", [THUMB_SIZES[1]])[0]))
+    except ValueError:
+        size = THUMB_SIZES[1]
+    fmt = thumb_format(qs.get("format", ["jpeg"])[0])
+
+    try:
+        thumbnail = get_thumbnail(file_path, size, fmt) if can_decode(file_path) else None
+    except OSError as e:
+        print(f"[Thumbnails] Could not make a thumbnail of {file_path}: {e}")
+        thumbnail = None
+    if thumbnail is None:
+        send_text(handler, 404, "No thumbnail available")
+        return
+    send_file_with_range(handler, thumbnail, code_directory, cache_route="thumb" if "v" in qs else "file")
@@ -1,70 +1,207 @@
 import os
-import cgi
+import uuid
+from email.message import Message
 from errorUtil import send_error_page
+from responseUtil import send_redirect, send_json
 from profileUtil import get_profile_dir
+from multipartUtil import MultipartReader, MultipartError
+from dedupUtil import new_hasher, place_file
+from catalogUtil import catalog_add
+from thumbIndexUtil import note_upload
 from urllib.parse import unquote, parse_qs
 
-def upload(handler, parsed_url, profile_root, code_directory):
+# Unread bytes after the closing boundary that are still drained to keep the connection
+MAX_EPILOGUE_SIZE = 64 * 1024
+
+# Largest text field (a relative path) accepted in a batch upload
+MAX_FIELD_SIZE = 4096
+
+def save_part(reader, directory, filename):
+    """
+    Stream the current part into a hidden temp file next to its destination and
+    rename it into place once complete, so readers never see a partial file.
+    With dedup on, the data is hashed on the way in.
+    """
+    filepath = os.path.join(directory, filename)
+    tmp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+    hasher = new_hasher()
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in reader.read_chunks():
+                if hasher:
+                    hasher.update(chunk)
+                f.write(chunk)
+        place_file(tmp_path, filepath, hasher)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    catalog_add(filepath)
+    note_upload(filepath)
+    return filepath
+
+def start_upload(handler, parsed_url, profile_root, code_directory):
+    """
+    Checks shared by /upload and /upload-batch. Returns (reader, upload directory), or
+    None after an error page has been sent.
+    """
     handler.profile_dir = get_profile_dir(handler, profile_root)
     if not handler.profile_dir:
+        handler.close_connection = True  # Unread request body
         send_error_page(handler, 403, "Profile not selected", code_directory)
-        return
+        return None
     query = parse_qs(parsed_url.query)
-    ctype, pdict = cgi.parse_header(handler.headers.get('Content-Type'))
-    if ctype == 'multipart/form-data':
-        pdict['boundary'] = bytes(pdict['boundary'], "utf-8")
-        pdict['CONTENT-LENGTH'] = int(handler.headers.get('Content-Length'))
-        try:
-            form = cgi.FieldStorage(fp=handler.rfile,
-                                    headers=handler.headers,
-                                    environ={'REQUEST_METHOD': 'POST'},
-                                    keep_blank_values=True)
-        except Exception as e:
-            send_error_page(handler, 400, f"Error parsing form data: {e}", code_directory)
-            return
 
-        if "file" not in form:
-            send_error_page(handler, 400, "No file field in form", code_directory)
-            return
+    content_type = Message()
+    content_type["Content-Type"] = handler.headers.get("Content-Type", "")
+    if content_type.get_content_type() != "multipart/form-data":
+        handler.close_connection = True
+        send_error_page(handler, 400, "Expected multipart/form-data upload", code_directory)
+        return None
 
-        file_item = form["file"]
+    try:
+        content_length = int(handler.headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        handler.close_connection = True
+        send_error_page(handler, 411, "Content-Length required", code_directory)
+        return None
 
-        if not file_item.filename:
-            send_error_page(handler, 400, "No filename provided", code_directory)
-            return
+    # Save file to DIRECTORY
+    upload_path = query.get("path", ["/"])[0]  # Default to root if not provided
+    safe_rel_path = os.path.normpath(unquote(upload_path)).lstrip("/")
 
-        # Sanitize filename to avoid directory traversal attacks
-        filename = os.path.basename(file_item.filename)
+    # Prevent escaping out of DIRECTORY
+    abs_upload_dir = os.path.abspath(os.path.join(handler.profile_dir, safe_rel_path))
 
-        # Save file to DIRECTORY
-        upload_path = query.get("path", ["/"])[0]  # Default to root if not provided
-        safe_rel_path = os.path.normpath(unquote(upload_path)).lstrip("/")
+    # Make sure it's still inside the DIRECTORY
+    if not abs_upload_dir.startswith(os.path.abspath(handler.profile_dir)):
+        handler.close_connection = True
+        send_error_page(handler, 400, "Invalid upload path", code_directory)
+        return None
 
-        # Prevent escaping out of DIRECTORY
-        abs_upload_dir = os.path.abspath(os.path.join(get_profile_dir(handler, profile_root), safe_rel_path))
+    try:
+        os.makedirs(abs_upload_dir, exist_ok=True)
+    except Exception as e:
+        handler.close_connection = True
+        send_error_page(handler, 500, f"Failed to create directories: {e}", code_directory)
+        return None
 
-        # Make sure it's still inside the DIRECTORY
-        if not abs_upload_dir.startswith(os.path.abspath(get_profile_dir(handler, profile_root))):
-            send_error_page(handler, 400, "Invalid upload path", code_directory)
-            return
+    try:
+        reader = MultipartReader(handler.rfile, content_type.get_param("boundary"), content_length)
+    except MultipartError as e:
+        handler.close_connection = True
+        send_error_page(handler, 400, f"Error parsing form data: {e}", code_directory)
+        return None
+    return reader, abs_upload_dir
 
-        try:
-            os.makedirs(abs_upload_dir, exist_ok=True)
-        except Exception as e:
-            send_error_page(handler, 500, f"Failed to create directories: {e}", code_directory)
-            return
+def upload(handler, parsed_url, profile_root, code_directory):
+    started = start_upload(handler, parsed_url, profile_root, code_directory)
+    if not started:
+        return
+    reader, abs_upload_dir = started
 
-        filepath = os.path.join(abs_upload_dir, filename)
+    saved = 0
+    try:
+        for part in reader:
+            if part.name != "file":
+                continue
+            if not part.filename:
+                handler.close_connection = True
+                send_error_page(handler, 400, "No filename provided", code_directory)
+                return
 
-        try:
-            with open(filepath, 'wb') as f:
-                data = file_item.file.read()
-                f.write(data)
-        except Exception as e:
-            send_error_page(handler, 500, f"Failed to save file: {e}", code_directory)
-            return
-
-        # Redirect back to the main page (file listing)
-        handler.send_response(303)  # See Other
-        handler.send_header('Location', '/')
-        handler.end_headers()
\ No newline at end of file
+            # Sanitize filename to avoid directory traversal attacks
+            filename = os.path.basename(part.filename)
+            if filename in ("", ".", ".."):
+                handler.close_connection = True
+                send_error_page(handler, 400, "Invalid filename", code_directory)
+                return
+            save_part(reader, abs_upload_dir, filename)
+            saved += 1
+        if not reader.drain(MAX_EPILOGUE_SIZE):
+            handler.close_connection = True
+    except MultipartError as e:
+        handler.close_connection = True
+        send_error_page(handler, 400, f"Error parsing form data: {e}", code_directory)
+        return
+    except OSError as e:
+        handler.close_connection = True
+        send_error_page(handler, 500, f"Failed to save file: {e}", code_directory)
+        return
+
+    if not saved:
+        send_error_page(handler, 400, "No file field in form", code_directory)
+        return
+
+    # Redirect back to the main page (file listing)
+    send_redirect(handler, 303, '/')  # See Other
+
+def read_field(reader, limit):
+    """Read a small text part into memory, refusing anything larger than `limit` bytes."""
+    value = bytearray()
+    for chunk in reader.read_chunks():
+        value += chunk
+        if len(value) > limit:
+            raise MultipartError("Form field too large")
+    return value.decode("utf-8")
+
+def batch_target(upload_dir, relative_path):
+    """Absolute path for a file's relative path inside upload_dir, or None if it would escape it."""
+    rel_path = os.path.normpath(relative_path.replace("\\", "/")).lstrip("/")
+    if rel_path in ("", ".") or rel_path.split(os.sep)[0] == "..":
+        return None
+    target = os.path.join(upload_dir, rel_path)
+    if not os.path.abspath(target).startswith(upload_dir + os.sep):
+        return None
+    return target
+
+def upload_batch(handler, parsed_url, profile_root, code_directory):
+    """
+    POST /upload-batch?path=<folder>: many files in one multipart body. Each "file" part
+    is preceded by a "relpath" field with its path relative to <folder>, e.g. "Trip/day1/IMG_0001.jpg".
+    Directories are created once per batch and the files are written one after another.
+    Replies with {"saved": [relative paths]}.
+    """
+    started = start_upload(handler, parsed_url, profile_root, code_directory)
+    if not started:
+        return
+    reader, abs_upload_dir = started
+
+    created_dirs = {abs_upload_dir}
+    saved = []
+    relative_path = None
+    try:
+        for part in reader:
+            if part.name == "relpath":
+                relative_path = read_field(reader, MAX_FIELD_SIZE)
+                continue
+            if part.name != "file":
+                continue
+
+            target = batch_target(abs_upload_dir, relative_path or part.filename or "")
+            relative_path = None
+            if not target:
+                handler.close_connection = True
+                send_error_page(handler, 400, "Invalid file path in batch", code_directory)
+                return
+            directory, filename = os.path.split(target)
+            if directory not in created_dirs:
+                os.makedirs(directory, exist_ok=True)
+                created_dirs.add(directory)
+            save_part(reader, directory, filename)
+            saved.append(os.path.relpath(target, abs_upload_dir).replace(os.sep, "/"))
+        if not reader.drain(MAX_EPILOGUE_SIZE):
+            handler.close_connection = True
+    except (MultipartError, UnicodeDecodeError) as e:
+        handler.close_connection = True
+        send_error_page(handler, 400, f"Error parsing form data: {e}", code_directory)
+        return
+    except OSError as e:
+        handler.close_connection = True
+        send_error_page(handler, 500, f"Failed to save file: {e}", code_directory)
+        return
+
+    send_json(handler, 200, {"saved": saved})
@@ -1,62 +1,270 @@
 import os
 import json
-import uuid
+import time
 import traceback
-import threading
 from profileUtil import get_profile_dir
-from urllib.parse import unquote, parse_qs
-from zipUtil import run_zip_job, run_zip_job_bulk
+from responseUtil import send_text, send_json, send_empty, StreamWriter
+from streamingUtil import send_file_with_range, send_file_body
+from urllib.parse import quote, unquote, parse_qs
+from zipUtil import choose_compression, COMPRESSION_POLICIES, DEFAULT_COMPRESSION_POLICY
+from zipJobUtil import ZipJobRejected, submit_zip_job, cancel_zip_job
+from zipStreamUtil import ZipStreamWriter, ZIP_STORED, ZIP_DEFLATED, collect_entries, iter_entries, stored_archive_size
+from tarStreamUtil import TAR_FORMATS, compressor_command, tar_archive_size, write_tar_entries, pipe_through
+from parallelZipUtil import compression_pool, write_entries_parallel
 
-def download_zip(handler, parsed_url, profile_root, temp_zip_directory, progress_store, zip_paths, cancelled_jobs):
+# ?compression= is a policy from zipUtil.COMPRESSION_POLICIES (fast, balanced, smallest),
+# or for streamed archives "store" (nothing compressed, exact Content-Length) or "deflate" (everything)
+STREAM_COMPRESSION = {"store": ZIP_STORED, "deflate": ZIP_DEFLATED}
+
+def compression_policy(name):
+    return name if name in COMPRESSION_POLICIES else DEFAULT_COMPRESSION_POLICY
+
+def content_disposition(filename):
+    """attachment header value that survives non-ASCII names (RFC 6266)."""
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace('"', "_")
+    return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+
+def start_archive_response(handler, download_name, content_type, length=None):
+    """Send the headers of a streamed archive download and return the writer for its body."""
+    handler.send_response(200)
+    handler.send_header("Content-Type", content_type)
+    handler.send_header("Content-Disposition", content_disposition(download_name))
+    handler.send_header("Cache-Control", "no-store")
+    if length is not None:
+        handler.send_header("Content-Length", str(length))
+        out = StreamWriter(handler.wfile, chunked=False)
+    elif handler.request_version == "HTTP/1.1":
+        handler.send_header("Transfer-Encoding", "chunked")
+        out = StreamWriter(handler.wfile, chunked=True)
+    else:
+        # HTTP/1.0 has no chunked coding: the end of the body is the end of the connection
+        handler.close_connection = True
+        out = StreamWriter(handler.wfile, chunked=False)
+    handler.end_headers()
+    return out
+
+def abort_archive(handler, label, e):
+    """
+    End a streamed archive that failed after start_archive_response(). Nothing more may
+    be written once the headers are out, whatever the error, so the connection is
+    dropped instead: the short body tells the client the download failed.
+    """
+    handler.close_connection = True
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        print(f"{label}: client disconnected ({e.__class__.__name__})")
+    else:
+        print(f"{label}: failed: {e!r}")
+        traceback.print_exc()
+
+def stream_tar(handler, abs_paths, base_name, archive_format="tar"):
+    """
+    Send a tar of abs_paths, one of TAR_FORMATS. A plain tar costs almost no CPU: its
+    exact size is sent up front and file data goes out with sendfile. The compressed
+    formats are piped through an external multithreaded compressor and sent chunked,
+    while the folders are scanned. Falls back to a plain tar if no compressor is installed.
+    """
+    command = compressor_command(archive_format)
+    if command is None and archive_format != "tar":
+        print(f"[Tar Stream] No compressor for {archive_format} installed, sending a plain tar")
+        archive_format = "tar"
+    suffix, content_type, _ = TAR_FORMATS[archive_format]
+    download_name = base_name + suffix
+
+    started = time.monotonic()
+    if command is None:
+        entries = collect_entries(abs_paths)
+        out = start_archive_response(handler, download_name, content_type, tar_archive_size(entries))
+    else:
+        out = start_archive_response(handler, download_name, content_type)
+    try:
+        if command is None:
+            def send_file(f, size):
+                out.flush()  # the header blocks go out before the file data
+                return send_file_body(handler, f, 0, size)
+
+            write_tar_entries(out, entries, send_file)
+        else:
+            pipe_through(command, lambda stdin: write_tar_entries(stdin, iter_entries(abs_paths)), out)
+        out.close()
+        print(f"[Tar Stream] {download_name} sent in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        abort_archive(handler, f"[Tar Stream] {download_name}", e)
+
+def stream_archive(handler, abs_paths, base_name, archive_format, compression):
+    """Streamed download in the requested ?format= (zip or one of TAR_FORMATS)."""
+    if archive_format in TAR_FORMATS:
+        stream_tar(handler, abs_paths, base_name, archive_format)
+    else:
+        stream_zip(handler, abs_paths, f"{base_name}.zip", compression)
+
+def stream_zip(handler, abs_paths, download_name, compression=DEFAULT_COMPRESSION_POLICY):
+    """
+    Send a ZIP of abs_paths straight to the client while walking the tree, without a
+    temporary file. A client that disconnects stops the walk at its next write.
+    """
+    method = STREAM_COMPRESSION.get(compression)
+    policy = compression_policy(compression)
+    entries = collect_entries(abs_paths)
+    length = stored_archive_size(entries) if method == ZIP_STORED else None
+    if method != ZIP_STORED:
+        compression_pool()  # a pool that cannot start still gets a proper error reply
+    out = start_archive_response(handler, download_name, "application/zip", length)
+
+    started = time.monotonic()
+    writer = ZipStreamWriter(out)
+    try:
+        if method == ZIP_STORED:
+            for abs_file, arcname, stat in entries:
+                writer.write_file(abs_file, arcname, ZIP_STORED, stat=stat)
+        elif method == ZIP_DEFLATED:
+            write_entries_parallel(writer, entries, lambda path, size: (ZIP_DEFLATED, 6))
+        else:
+            write_entries_parallel(writer, entries, lambda path, size: choose_compression(path, size, policy))
+        writer.close()
+        out.close()
+        print(f"[Zip Stream] {download_name}: {len(entries)} files, {writer.offset} bytes in {time.monotonic() - started:.1f}s")
+    except Exception as e:
+        abort_archive(handler, f"[Zip Stream] {download_name} after {writer.offset} bytes", e)
+
+def profile_name(handler, profile_root):
+    return os.path.basename(get_profile_dir(handler, profile_root) or "")
+
+def start_zip_job(handler, profile_root, temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs, abs_paths, download_name, policy):
+    """Queue a zip job and answer with its id, or with why it was turned away."""
+    try:
+        job_id = submit_zip_job(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs, profile_name(handler, profile_root),
+                                collect_entries(abs_paths), download_name, policy)
+    except ZipJobRejected as e:
+        print(f"[Zip Job] Rejected {download_name}: {e.message}")
+        body = json.dumps({"error": e.message}).encode("utf-8")
+        handler.send_response(e.status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        if e.retry_after:
+            handler.send_header("Retry-After", str(e.retry_after))
+        handler.end_headers()
+        handler.wfile.write(body)
+        return
+    send_json(handler, 200, {"job_id": job_id})
+
+def find_zip_job(handler, parsed_url, profile_root, zip_jobs):
+    """(job id, record) of the ?job_id= job if it belongs to the requesting profile, else (job id, None)."""
+    job_id = parse_qs(parsed_url.query).get("job_id", [None])[0]
+    record = zip_jobs.get(job_id) if job_id else None
+    if record is None or record["profile"] != profile_name(handler, profile_root):
+        return job_id, None
+    return job_id, record
+
+def zip_progress(handler, parsed_url, profile_root, zip_jobs):
+    """
+    State of a zip job: queued (with its place in line), running (with byte progress and
+    ETA in seconds), done, failed or cancelled. progress is 0-100, or -1 when it failed.
+    """
+    try:
+        job_id, record = find_zip_job(handler, parsed_url, profile_root, zip_jobs)
+        if record is None:
+            send_text(handler, 404, "Job not found")
+            return
+        send_json(handler, 200, dict(record))
+    except Exception as e:
+        print("Error fetching zip progress:", e)
+        traceback.print_exc()
+        send_text(handler, 500, "Failed to fetch zip progress")
+
+def download_zip_file(handler, parsed_url, profile_root, code_directory, zip_jobs, zip_paths):
+    """
+    Send a finished job's archive, with Range and If-Range so a dropped download resumes
+    where it stopped; 409 with the job's state if it is not done yet. The archive stays
+    until the job expires or is released with DELETE.
+    """
+    try:
+        job_id, record = find_zip_job(handler, parsed_url, profile_root, zip_jobs)
+        if record is None:
+            send_text(handler, 404, "Job not found")
+            return
+        if record["state"] != "done":
+            send_json(handler, 409, dict(record))
+            return
+        zip_path = zip_paths.get(job_id)
+        if not zip_path or not os.path.exists(zip_path):
+            send_text(handler, 404, "Zip file has expired")
+            return
+        send_file_with_range(handler, zip_path, code_directory,
+                             extra_headers={"Content-Disposition": content_disposition(record["name"])})
+    except Exception as e:
+        print("Error downloading zipped folder:", e)
+        traceback.print_exc()
+        send_text(handler, 500, "Failed to download ZIP file")
+
+def release_zip_file(handler, parsed_url, profile_root, zip_jobs, zip_paths, cancelled_jobs):
+    """DELETE /download-zip-file: the client has the archive, so it need not be kept until the job expires."""
+    job_id, record = find_zip_job(handler, parsed_url, profile_root, zip_jobs)
+    if record is None or not cancel_zip_job(zip_jobs, zip_paths, cancelled_jobs, job_id):
+        send_empty(handler, 404)
+        return
+    send_empty(handler, 204)
+
+def cancel_zip(handler, parsed_url, profile_root, zip_jobs, zip_paths, cancelled_jobs):
+    try:
+        job_id, record = find_zip_job(handler, parsed_url, profile_root, zip_jobs)
+        if record is None or not cancel_zip_job(zip_jobs, zip_paths, cancelled_jobs, job_id):
+            send_text(handler, 404, "Job not found")
+            return
+        send_text(handler, 200, "Zip job cancelled")
+    except Exception as e:
+        print("Error cancelling zip:", e)
+        traceback.print_exc()
+        send_text(handler, 500, "Failed to cancel zip job")
+
+def download_zip(handler, parsed_url, profile_root, temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs):
     try:
         query = parse_qs(parsed_url.query)
         folder = query.get("folder", [None])[0]
 
         if not folder:
-          handler.send_response(400)
-          handler.end_headers()
-          handler.wfile.write(b"Missing folder parameter")
+          send_text(handler, 400, "Missing folder parameter")
           return
 
         rel_path = os.path.normpath(unquote(folder)).lstrip("/")
         abs_path = os.path.abspath(os.path.join(get_profile_dir(handler, profile_root), rel_path))
 
         if not abs_path.startswith(os.path.abspath(get_profile_dir(handler, profile_root))) or not os.path.isdir(abs_path):
-          handler.send_response(400)
-          handler.end_headers()
-          handler.wfile.write(b"Invalid folder path")
+          send_text(handler, 400, "Invalid folder path")
           return
 
-        # Generate a job id
-        job_id = str(uuid.uuid4())
-
-        # Start zip creation in a thread
-        threading.Thread(target=run_zip_job, args=(temp_zip_directory, abs_path, job_id, progress_store, zip_paths, cancelled_jobs)).start()
-
-        # Respond immediately with job_id
-        handler.send_response(200)
-        handler.send_header("Content-Type", "application/json")
-        handler.end_headers()
-        handler.wfile.write(f'{{"job_id": "{job_id}"}}'.encode())
+        archive_format = query.get("format", ["zip"])[0]
+        # Tars are only ever streamed
+        if query.get("stream", ["0"])[0] == "1" or archive_format in TAR_FORMATS:
+            stream_archive(handler, [abs_path], os.path.basename(abs_path), archive_format,
+                           query.get("compression", [DEFAULT_COMPRESSION_POLICY])[0])
+            return
+        policy = compression_policy(query.get("compression", [None])[0])
+        start_zip_job(handler, profile_root, temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs,
+                      [abs_path], f"{os.path.basename(abs_path)}.zip", policy)
     except Exception as e:
         print("Error initiating zip:", e)
         traceback.print_exc()
-        handler.send_response(500)
-        handler.end_headers()
-        handler.wfile.write(b"Failed to initiate zip")
+        send_text(handler, 500, "Failed to initiate zip")
 
-def bulk_download_zip(handler, profile_root, temp_zip_directory, progress_store, zip_paths, cancelled_jobs):
+def bulk_download_zip(handler, profile_root, temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs):
     try:
-        # Expect JSON POST
+        # Expect JSON POST, or a form post (paths as a JSON list) for a streamed download
         content_length = int(handler.headers.get("Content-Length", 0))
         body = handler.rfile.read(content_length)
-        data = json.loads(body.decode())
+        if handler.headers.get("Content-Type", "").startswith("application/x-www-form-urlencoded"):
+            form = parse_qs(body.decode())
+            data = {
+                "paths": json.loads(form.get("paths", ["[]"])[0]),
+                "stream": form.get("stream", ["0"])[0] == "1",
+                "format": form.get("format", ["zip"])[0],
+                "compression": form.get("compression", [DEFAULT_COMPRESSION_POLICY])[0],
+            }
+        else:
+            data = json.loads(body.decode())
 
         paths = data.get("paths", [])
         if not paths or not isinstance(paths, list):
-            handler.send_response(400)
-            handler.end_headers()
-            handler.wfile.write(b"Missing or invalid paths parameter")
+            send_text(handler, 400, "Missing or invalid paths parameter")
             return
 
         abs_paths = []
@@ -70,26 +278,20 @@ def bulk_download_zip(handler, profile_root, temp_zip_directory, progress_store,
             abs_paths.append(abs_path)
 
         if not abs_paths:
-            handler.send_response(400)
-            handler.end_headers()
-            handler.wfile.write(b"No valid files or folders to zip")
+            send_text(handler, 400, "No valid files or folders to zip")
             return
 
-        # Generate a job id
-        job_id = str(uuid.uuid4())
-
-        # Start zip creation in a thread
-        threading.Thread(target=run_zip_job_bulk, args=(temp_zip_directory, abs_paths, job_id, progress_store, zip_paths, cancelled_jobs)).start()
+        archive_format = data.get("format", "zip")
+        if data.get("stream") or archive_format in TAR_FORMATS:
+            name = os.path.basename(abs_paths[0]) if len(abs_paths) == 1 else "download"
+            stream_archive(handler, abs_paths, name, archive_format, data.get("compression", DEFAULT_COMPRESSION_POLICY))
+            return
 
-        # Respond immediately with job_id
-        handler.send_response(200)
-        handler.send_header("Content-Type", "application/json")
-        handler.end_headers()
-        handler.wfile.write(f'{{"job_id": "{job_id}"}}'.encode())
+        name = os.path.basename(abs_paths[0]) if len(abs_paths) == 1 else "download"
+        start_zip_job(handler, profile_root, temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs,
+                      abs_paths, f"{name}.zip", compression_policy(data.get("compression")))
 
     except Exception as e:
         print("Error initiating bulk zip:", e)
         traceback.print_exc()
-        handler.send_response(500)
-        handler.end_headers()
-        handler.wfile.write(b"Failed to initiate bulk zip")
\ No newline at end of file
+        send_text(handler, 500, "Failed to initiate bulk zip")
\ No newline at end of file
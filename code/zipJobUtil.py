@@ -0,0 +1,348 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+import traceback
+from collections import OrderedDict, deque
+
+from zipUtil import build_zip, DEFAULT_COMPRESSION_POLICY, PARTIAL_PREFIX
+from parallelZipUtil import ZipCancelled
+from eventUtil import notify_job_changed
+
+# Zip jobs built at the same time; each one already spreads its compression over the process pool
+ZIP_JOB_WORKERS = 2
+
+# Jobs allowed to wait for a worker, in total and per profile; more are turned away with 429
+ZIP_QUEUE_LIMIT = 32
+ZIP_PROFILE_QUEUE_LIMIT = 4
+ZIP_RETRY_AFTER = 10
+
+# Seconds a finished job's record is kept, and its archive while no newer job reuses it;
+# also how long a job may go without progress before it is treated as abandoned
+ZIP_JOB_TTL = 3600
+
+# Free space the temp directory keeps once every admitted job has been written
+ZIP_MIN_FREE_SPACE = 512 * 1024 * 1024
+
+# Seconds between sweeps of expired jobs and abandoned temp zips
+ZIP_SWEEP_INTERVAL = 60
+
+# Bytes per file for headers and the central directory when estimating an archive's size
+ZIP_ENTRY_OVERHEAD = 256
+
+# Progress is written to the job record at most this often (a file write in prefork mode)
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATES = ("queued", "running")
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+# Jobs waiting in this process, round-robin between profiles: profile -> deque of jobs
+_queues = OrderedDict()
+_condition = threading.Condition()
+_started = {"pid": None}
+
+class ZipJobRejected(Exception):
+    """A zip job that was not admitted: status is the HTTP status to answer with."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+def configure_zip_jobs(workers, queue_limit, profile_queue_limit, ttl, min_free_space):
+    """Set the scheduler limits; call before the first zip job."""
+    global ZIP_JOB_WORKERS, ZIP_QUEUE_LIMIT, ZIP_PROFILE_QUEUE_LIMIT, ZIP_JOB_TTL, ZIP_MIN_FREE_SPACE
+    ZIP_JOB_WORKERS = max(1, workers)
+    ZIP_QUEUE_LIMIT = queue_limit
+    ZIP_PROFILE_QUEUE_LIMIT = profile_queue_limit
+    ZIP_JOB_TTL = ttl
+    ZIP_MIN_FREE_SPACE = min_free_space
+
+def _start(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs):
+    # Once per process (see preforkUtil.run_prefork)
+    if _started["pid"] == os.getpid():
+        return
+    _queues.clear()
+    _started["pid"] = os.getpid()
+    for index in range(ZIP_JOB_WORKERS):
+        threading.Thread(target=_work, name=f"zip-job-{index}", daemon=True).start()
+    threading.Thread(target=_sweep_forever, args=(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs),
+                     name="zip-job-sweeper", daemon=True).start()
+
+def _save(zip_jobs, job_id, record):
+    zip_jobs[job_id] = record
+    notify_job_changed()
+
+def profile_jobs(zip_jobs, profile):
+    """(job id, record) of every zip job of a profile, for the /events stream."""
+    return [(job_id, record) for job_id, record in list(zip_jobs.items()) if record["profile"] == profile]
+
+def tree_fingerprint(entries, policy):
+    """Hash of every file's path, size and mtime: equal for an unchanged selection, so its archive can be reused."""
+    digest = hashlib.sha256(policy.encode("utf-8"))
+    for path, arcname, stat in entries:
+        digest.update(f"\0{path}\0{arcname}\0{stat.st_size}\0{stat.st_mtime_ns}".encode("utf-8", "surrogateescape"))
+    return digest.hexdigest()[:32]
+
+def artifact_path(temp_zip_directory, fingerprint):
+    return os.path.join(temp_zip_directory, f"{fingerprint}.zip")
+
+def _unchanged(entries):
+    """True if no file of the archive changed while it was being built."""
+    for path, _, stat in entries:
+        try:
+            current = os.stat(path)
+        except OSError:
+            return False
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return False
+    return True
+
+def _reserved_space(zip_jobs):
+    """Bytes still to be written by admitted jobs (estimated archive size minus file bytes done)."""
+    reserved = 0
+    for _, record in list(zip_jobs.items()):
+        if record.get("state") in ACTIVE_STATES:
+            reserved += max(0, record["estimated_size"] - record["bytes_done"])
+    return reserved
+
+def submit_zip_job(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs, profile, entries, name,
+                   policy=DEFAULT_COMPRESSION_POLICY):
+    """
+    Queue a zip of `entries` (see zipStreamUtil.collect_entries) for `profile` and return
+    its job id. The same files, unchanged, get the job already building them or a job
+    that is done at once with the archive built before. Raises ZipJobRejected when the
+    queue is full or the archive could not fit in the temp directory.
+    """
+    total_bytes = sum(stat.st_size for _, _, stat in entries)
+    # A stored archive is the largest one the policies can produce
+    estimated_size = total_bytes + ZIP_ENTRY_OVERHEAD * (len(entries) + 1)
+    fingerprint = tree_fingerprint(entries, policy)
+    os.makedirs(temp_zip_directory, exist_ok=True)
+
+    with _condition:
+        _start(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs)
+        for job_id, record in profile_jobs(zip_jobs, profile):
+            if record.get("fingerprint") == fingerprint and record["state"] in ACTIVE_STATES:
+                return job_id
+
+        now = time.time()
+        record = {
+            "state": "queued", "progress": 0, "position": 0, "eta": None, "error": None,
+            "profile": profile, "name": name, "files": len(entries), "fingerprint": fingerprint,
+            "bytes_total": total_bytes, "bytes_done": 0, "estimated_size": estimated_size, "size": None,
+            "created": now, "started": None, "finished": None, "updated": now,
+        }
+        job_id = str(uuid.uuid4())
+        existing = artifact_path(temp_zip_directory, fingerprint)
+        if os.path.exists(existing):
+            zip_paths[job_id] = existing
+            _finish(zip_jobs, job_id, record, "done", progress=100, bytes_done=total_bytes,
+                    size=os.path.getsize(existing), started=now)
+            print(f"[Zip Job] {job_id}: reusing {existing}")
+            return job_id
+
+        if sum(len(queue) for queue in _queues.values()) >= ZIP_QUEUE_LIMIT:
+            raise ZipJobRejected(429, "Too many zip jobs are waiting, try again shortly", ZIP_RETRY_AFTER)
+        if len(_queues.get(profile, ())) >= ZIP_PROFILE_QUEUE_LIMIT:
+            raise ZipJobRejected(429, f"{ZIP_PROFILE_QUEUE_LIMIT} of your zip jobs are already waiting", ZIP_RETRY_AFTER)
+
+        available = shutil.disk_usage(temp_zip_directory).free - _reserved_space(zip_jobs) - ZIP_MIN_FREE_SPACE
+        if estimated_size > available:
+            raise ZipJobRejected(507, f"Not enough free space to build this zip ({estimated_size // (1024 * 1024)} MB needed, "
+                                      f"{max(available, 0) // (1024 * 1024)} MB available)")
+
+        _save(zip_jobs, job_id, record)
+        job = {"id": job_id, "profile": profile, "entries": entries, "policy": policy,
+               "temp_directory": temp_zip_directory, "stores": (zip_jobs, zip_paths, cancelled_jobs)}
+        _queues.setdefault(profile, deque()).append(job)
+        _publish_positions()
+        _condition.notify()
+    return job_id
+
+def _publish_positions():
+    """Store each waiting job's place in the order the workers will take them (under _condition)."""
+    queues = [list(queue) for queue in _queues.values()]
+    position = 0
+    for depth in range(max((len(queue) for queue in queues), default=0)):
+        for queue in queues:
+            if depth < len(queue):
+                position += 1
+                job = queue[depth]
+                zip_jobs = job["stores"][0]
+                record = zip_jobs.get(job["id"])
+                if record and record["state"] == "queued" and record["position"] != position:
+                    record["position"] = position
+                    record["updated"] = time.time()
+                    _save(zip_jobs, job["id"], record)
+
+def _next_job():
+    """Oldest job of the profile whose turn it is; that profile then goes to the back."""
+    with _condition:
+        while not _queues:
+            _condition.wait()
+        profile, queue = next(iter(_queues.items()))
+        job = queue.popleft()
+        if queue:
+            _queues.move_to_end(profile)
+        else:
+            del _queues[profile]
+        _publish_positions()
+        return job
+
+def _work():
+    while True:
+        job = _next_job()
+        try:
+            _run(job)
+        except Exception as e:
+            print(f"[Zip Job] {job['id']} crashed: {e}")
+            traceback.print_exc()
+
+def _finish(zip_jobs, job_id, record, state, **fields):
+    record.update(fields, state=state, position=0, eta=None, finished=time.time(), updated=time.time())
+    _save(zip_jobs, job_id, record)
+
+def _run(job):
+    job_id = job["id"]
+    zip_jobs, zip_paths, cancelled_jobs = job["stores"]
+    record = zip_jobs.get(job_id)
+    if record is None:
+        # Swept or cancelled away while waiting
+        cancelled_jobs.discard(job_id)
+        return
+    if job_id in cancelled_jobs:
+        cancelled_jobs.discard(job_id)
+        _finish(zip_jobs, job_id, record, "cancelled")
+        return
+
+    started = time.time()
+    record.update(state="running", position=0, started=started, updated=started)
+    _save(zip_jobs, job_id, record)
+    total = record["bytes_total"]
+    done = [0, 0.0]  # file bytes done, time of the last stored update
+
+    def on_progress(count):
+        done[0] += count
+        now = time.time()
+        if now - done[1] < PROGRESS_INTERVAL:
+            return
+        done[1] = now
+        elapsed = now - started
+        record.update(bytes_done=done[0], updated=now,
+                      progress=min(int(done[0] * 100 / total), 99) if total else 99,
+                      eta=round((total - done[0]) * elapsed / done[0]) if done[0] else None)
+        _save(zip_jobs, job_id, record)
+
+    try:
+        zip_path = build_zip(job["temp_directory"], job["entries"], job["policy"], on_progress,
+                             lambda: job_id in cancelled_jobs)
+    except ZipCancelled:
+        print(f"[Zip Cancelled] Job {job_id}")
+        cancelled_jobs.discard(job_id)
+        _finish(zip_jobs, job_id, record, "cancelled", bytes_done=done[0])
+        return
+    except Exception as e:
+        print(f"[Zip Job] {job_id} failed: {e}")
+        traceback.print_exc()
+        _finish(zip_jobs, job_id, record, "failed", progress=-1, error=str(e))
+        return
+
+    if _unchanged(job["entries"]):
+        # Publish under the fingerprint so the next request for the same files reuses it
+        published = artifact_path(job["temp_directory"], record["fingerprint"])
+        os.replace(zip_path, published)
+        zip_path = published
+    zip_paths[job_id] = zip_path
+    _finish(zip_jobs, job_id, record, "done", progress=100, bytes_done=total, size=os.path.getsize(zip_path))
+    print(f"[Zip Job] {job_id}: {record['files']} files, {record['size']} bytes in {time.time() - started:.1f}s")
+    # A cancel that arrived after the last piece was written
+    if job_id in cancelled_jobs:
+        cancel_zip_job(zip_jobs, zip_paths, cancelled_jobs, job_id)
+
+def _remove_artifact(zip_paths, job_id):
+    """Forget a job's archive, deleting it unless another job still uses the same one."""
+    zip_path = zip_paths.pop(job_id, None)
+    if zip_path and zip_path not in {path for _, path in list(zip_paths.items())}:
+        try:
+            os.remove(zip_path)
+        except FileNotFoundError:
+            pass
+
+def cancel_zip_job(zip_jobs, zip_paths, cancelled_jobs, job_id):
+    """
+    Cancel a job in any state. A waiting job is dropped, a running one stops at its next
+    piece, a finished one releases its archive. Returns False for an unknown job.
+    """
+    record = zip_jobs.get(job_id)
+    if record is None:
+        return False
+    if record["state"] in ACTIVE_STATES:
+        # The marker reaches the job wherever it is: another process's queue or its builder
+        cancelled_jobs.add(job_id)
+        with _condition:
+            for profile, queue in list(_queues.items()):
+                for job in queue:
+                    if job["id"] == job_id:
+                        queue.remove(job)
+                        if not queue:
+                            del _queues[profile]
+                        cancelled_jobs.discard(job_id)
+                        _finish(zip_jobs, job_id, record, "cancelled")
+                        _publish_positions()
+                        return True
+        # Re-read: the build may have finished before it saw the marker
+        record = zip_jobs.get(job_id)
+    if record and record["state"] == "done":
+        cancelled_jobs.discard(job_id)
+        _remove_artifact(zip_paths, job_id)
+        _finish(zip_jobs, job_id, record, "cancelled")
+    return True
+
+def sweep_zip_jobs(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs, partial_age=None):
+    """
+    Drop jobs that finished more than ZIP_JOB_TTL ago, or made no progress for that
+    long, with their archives. Archives in the temp directory that no job refers to go
+    once they are ZIP_JOB_TTL old, partly written ones once they are partial_age old
+    (default ZIP_JOB_TTL; a running build touches its file all the time).
+    """
+    now = time.time()
+    for job_id, record in list(zip_jobs.items()):
+        if record["state"] in FINISHED_STATES:
+            expired = now - record["finished"] > ZIP_JOB_TTL
+        else:
+            expired = now - record["updated"] > ZIP_JOB_TTL
+        if expired:
+            _remove_artifact(zip_paths, job_id)
+            zip_jobs.pop(job_id, None)
+            cancelled_jobs.discard(job_id)
+
+    referenced = {path for _, path in list(zip_paths.items())}
+    partial_age = ZIP_JOB_TTL if partial_age is None else partial_age
+    try:
+        names = os.listdir(temp_zip_directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(temp_zip_directory, name)
+        if not name.endswith(".zip") or path in referenced:
+            continue
+        try:
+            max_age = partial_age if name.startswith(PARTIAL_PREFIX) else ZIP_JOB_TTL
+            if now - os.stat(path).st_mtime > max_age:
+                os.remove(path)
+                print(f"[Zip Job] Removed abandoned {path}")
+        except FileNotFoundError:
+            pass
+
+def _sweep_forever(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs):
+    while True:
+        time.sleep(ZIP_SWEEP_INTERVAL)
+        try:
+            sweep_zip_jobs(temp_zip_directory, zip_jobs, zip_paths, cancelled_jobs)
+        except Exception as e:
+            print(f"[Zip Job] Sweep failed: {e}")
+            traceback.print_exc()
@@ -0,0 +1,212 @@
+import os
+import time
+import zlib
+import struct
+
+from resumableUploadUtil import UPLOAD_SESSIONS_DIRECTORY
+
+# Bytes read from a file and handed to the compressor / socket at a time
+READ_SIZE = 256 * 1024
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+
+# Field values that mean "see the ZIP64 extra field"
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+# General purpose flags: sizes and CRC follow the data (bit 3), names are UTF-8 (bit 11)
+FLAGS = 0x0008 | 0x0800
+NON_UTF8_FLAGS = 0x0008
+
+LOCAL_HEADER = struct.Struct("<4sHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<4sHHHHHHIIIHHHHHII")
+DESCRIPTOR = struct.Struct("<4sIII")
+DESCRIPTOR64 = struct.Struct("<4sIQQ")
+END_RECORD = struct.Struct("<4sHHHHIIH")
+END_RECORD64 = struct.Struct("<4sQHHIIQQQQ")
+END_LOCATOR64 = struct.Struct("<4sIQI")
+
+def dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # ZIP dates start in 1980
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+def needs_zip64(size, method):
+    # Decided before the data is written, so leave room for deflate's worst-case growth
+    if method == ZIP_DEFLATED:
+        size += size // 1000 + 64 * 1024
+    return size >= ZIP64_LIMIT
+
+def iter_entries(paths):
+    """
+    (absolute file, name in the archive, os.stat result) for every file below the given
+    files and folders, each under its own base name, yielded while the folders are
+    scanned. Partial uploads are left out.
+    """
+    for path in paths:
+        abs_path = os.path.abspath(path)
+        name_in_zip = os.path.basename(abs_path)
+        if os.path.isdir(abs_path):
+            yield from _scan_folder(abs_path, name_in_zip)
+        elif os.path.isfile(abs_path):
+            yield abs_path, name_in_zip, os.stat(abs_path)
+
+def _scan_folder(folder, prefix):
+    try:
+        with os.scandir(folder) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                # Linked folders are not followed (as os.walk), so a link loop cannot recurse forever
+                if entry.name != UPLOAD_SESSIONS_DIRECTORY and not entry.is_symlink():
+                    yield from _scan_folder(entry.path, f"{prefix}/{entry.name}")
+            elif not entry.name.startswith(".upload-"):
+                yield entry.path, f"{prefix}/{entry.name}", entry.stat()
+        except OSError:
+            continue
+
+def collect_entries(paths):
+    """All of iter_entries() as a list, for archives that need the totals up front."""
+    return list(iter_entries(paths))
+
+class ZipStreamWriter:
+    """
+    Writes a ZIP64-capable archive strictly front to back to `out` (anything with
+    write()), so it can go straight to a socket. Every entry's CRC and sizes follow its
+    data in a data descriptor, so nothing is seeked back to or buffered.
+
+        writer = ZipStreamWriter(out)
+        writer.write_file(path, "folder/name.jpg", ZIP_STORED)
+        writer.close()
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.offset = 0
+        self.records = []
+
+    def _write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def start_entry(self, arcname, stat, method):
+        """Write a local header. The entry's data follows with write_data(), then finish_entry()."""
+        name = arcname.encode("utf-8", "surrogateescape")
+        try:
+            name.decode("utf-8")
+            flags = FLAGS
+        except UnicodeDecodeError:
+            # A name that is not valid UTF-8 on disk is stored as its raw bytes, unflagged
+            flags = NON_UTF8_FLAGS
+        zip64 = needs_zip64(stat.st_size, method)
+        dos_time, dos_date = dos_datetime(stat.st_mtime)
+        entry = {"name": name, "method": method, "dos_time": dos_time, "dos_date": dos_date,
+                 "offset": self.offset, "mode": stat.st_mode, "zip64": zip64, "flags": flags}
+
+        # Local header: CRC and sizes are zero here and given in the descriptor
+        extra = struct.pack("<HHQQ", 1, 16, 0, 0) if zip64 else b""
+        self._write(LOCAL_HEADER.pack(b"PK\x03\x04", 45 if zip64 else 20, flags, method,
+                                      dos_time, dos_date, 0, ZIP64_LIMIT if zip64 else 0,
+                                      ZIP64_LIMIT if zip64 else 0, len(name), len(extra)) + name + extra)
+        return entry
+
+    def write_data(self, data):
+        """Entry data as it is stored: raw deflate output, or the file bytes for ZIP_STORED."""
+        self._write(data)
+
+    def finish_entry(self, entry, crc, compressed, size):
+        if entry["zip64"]:
+            self._write(DESCRIPTOR64.pack(b"PK\x07\x08", crc, compressed, size))
+        else:
+            self._write(DESCRIPTOR.pack(b"PK\x07\x08", crc, compressed, size))
+        self.records.append((entry["name"], entry["method"], entry["dos_time"], entry["dos_date"], crc,
+                             compressed, size, entry["offset"], entry["mode"], entry["zip64"], entry["flags"]))
+
+    def write_file(self, path, arcname, method=ZIP_DEFLATED, level=6, stat=None, on_progress=None):
+        """
+        Add one file. With ZIP_STORED exactly stat.st_size bytes are written, so the
+        archive size computed by stored_archive_size() stays correct. on_progress is
+        called with the number of file bytes consumed at each step.
+        """
+        stat = stat or os.stat(path)
+        size = stat.st_size
+        entry = self.start_entry(arcname, stat, method)
+
+        crc = 0
+        read = 0
+        compressed = 0
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+        with open(path, "rb") as f:
+            while True:
+                want = READ_SIZE if compressor else min(READ_SIZE, size - read)
+                data = f.read(want) if want else b""
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                read += len(data)
+                if on_progress:
+                    on_progress(len(data))
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    self.write_data(data)
+                    compressed += len(data)
+            if compressor:
+                data = compressor.flush()
+                self.write_data(data)
+                compressed += len(data)
+            elif read < size:
+                # The file shrank while being sent; pad so the announced length still holds
+                padding = bytes(size - read)
+                crc = zlib.crc32(padding, crc)
+                self.write_data(padding)
+                compressed = read = size
+
+        self.finish_entry(entry, crc, compressed, read)
+
+    def close(self):
+        """Write the central directory and end records."""
+        directory_offset = self.offset
+        for name, method, dos_time, dos_date, crc, compressed, size, header_offset, mode, zip64, flags in self.records:
+            extra_fields = []
+            if zip64:
+                extra_fields += [size, compressed]
+            if header_offset >= ZIP64_LIMIT:
+                extra_fields.append(header_offset)
+            extra = struct.pack(f"<HH{len(extra_fields)}Q", 1, 8 * len(extra_fields), *extra_fields) if extra_fields else b""
+            self._write(CENTRAL_HEADER.pack(
+                b"PK\x01\x02", (3 << 8) | 45, 45 if extra_fields else 20, flags, method, dos_time, dos_date, crc,
+                ZIP64_LIMIT if zip64 else compressed, ZIP64_LIMIT if zip64 else size, len(name), len(extra),
+                0, 0, 0, (mode & 0xFFFF) << 16, min(header_offset, ZIP64_LIMIT)) + name + extra)
+        directory_size = self.offset - directory_offset
+        count = len(self.records)
+
+        if count >= ZIP64_COUNT_LIMIT or directory_offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+            end64_offset = self.offset
+            self._write(END_RECORD64.pack(b"PK\x06\x06", 44, (3 << 8) | 45, 45, 0, 0, count, count,
+                                          directory_size, directory_offset))
+            self._write(END_LOCATOR64.pack(b"PK\x06\x07", 0, end64_offset, 1))
+        self._write(END_RECORD.pack(b"PK\x05\x06", 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+                                    min(directory_size, ZIP64_LIMIT), min(directory_offset, ZIP64_LIMIT), 0))
+        self.out.flush()
+
+def stored_archive_size(entries):
+    """Exact size of the archive ZipStreamWriter produces for `entries` with ZIP_STORED."""
+    offset = 0
+    directory_size = 0
+    for _, arcname, stat in entries:
+        name_length = len(arcname.encode("utf-8", "surrogateescape"))
+        zip64 = needs_zip64(stat.st_size, ZIP_STORED)
+        header_offset = offset
+        offset += LOCAL_HEADER.size + name_length + (20 if zip64 else 0) + stat.st_size
+        offset += DESCRIPTOR64.size if zip64 else DESCRIPTOR.size
+        extra_fields = (2 if zip64 else 0) + (1 if header_offset >= ZIP64_LIMIT else 0)
+        directory_size += CENTRAL_HEADER.size + name_length + (4 + 8 * extra_fields if extra_fields else 0)
+    total = offset + directory_size + END_RECORD.size
+    if len(entries) >= ZIP64_COUNT_LIMIT or offset >= ZIP64_LIMIT or directory_size >= ZIP64_LIMIT:
+        total += END_RECORD64.size + END_LOCATOR64.size
+    return total
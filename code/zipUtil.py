@@ -1,103 +1,119 @@
 import os
+import zlib
 import zipfile
 import tempfile
-import traceback
 
 import re
 import platform
 import subprocess
 
-def run_zip_job(temp_zip_directory, abs_path, job_id, progress_store, zip_paths, cancelled_jobs):
-    try:
-        create_zip_with_progress(temp_zip_directory, abs_path, job_id, progress_store, zip_paths, cancelled_jobs)
-    except Exception as e:
-        print(f"[Thread Error] Job {job_id}: {e}")
-        traceback.print_exc()
-        progress_store[job_id] = -1
-
-def create_zip_with_progress(temp_zip_directory, abs_path, job_id, progress_store, zip_paths, cancelled_jobs):
-    try:
-        folder_name = os.path.basename(abs_path)
-        file_list = []
-        for root, dirs, files in os.walk(abs_path):
-            for file in files:
-                file_list.append(os.path.join(root, file))
-        total_files = len(file_list)
-        progress_store[job_id] = 0
-
-        os.makedirs(temp_zip_directory, exist_ok=True)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip", dir=temp_zip_directory) as tmp_zip:
-            with zipfile.ZipFile(tmp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for i, abs_file in enumerate(file_list):
-                    if job_id in cancelled_jobs:
-                        print(f"[Zip Cancelled] Job {job_id}")
-                        progress_store[job_id] = -1
-
-                        # cleanup
-                        cancelled_jobs.remove(job_id)
-                        progress_store.pop(job_id, None)
-                        return
-
-                    rel_file = os.path.relpath(abs_file, abs_path)
-                    zipf.write(abs_file, arcname=os.path.join(folder_name, rel_file))
-
-                    # Update progress
-                    progress_store[job_id] = int((i+1) / total_files * 100) if total_files else 100
-        zip_paths[job_id] = tmp_zip.name
-    except Exception as e:
-        print(f"Error in create_zip_with_progress: {e}")
-        traceback.print_exc()
-        progress_store[job_id] = -1  # Error indicator
+from zipStreamUtil import ZipStreamWriter
+from parallelZipUtil import write_entries_parallel
+
+# Per-request compression policies (?compression=). Each file is stored or deflated
+# at `level` depending on what it is and how well a sample of it compresses:
+#   skip_known  - store files whose extension or magic bytes say they are already compressed
+#   max_ratio   - deflate only if the sample shrinks to at most this fraction of its size
+COMPRESSION_POLICIES = {
+    "fast": {"level": 1, "skip_known": True, "max_ratio": 0.85},
+    "balanced": {"level": 6, "skip_known": True, "max_ratio": 0.95},
+    "smallest": {"level": 9, "skip_known": False, "max_ratio": 0.99},
+}
+DEFAULT_COMPRESSION_POLICY = "balanced"
+
+# Files this small gain nothing worth a compressor
+MIN_COMPRESS_SIZE = 256
+
+# Trial compression: up to SAMPLE_COUNT pieces of SAMPLE_SIZE bytes spread over the file
+SAMPLE_SIZE = 32 * 1024
+SAMPLE_COUNT = 3
+
+# Formats that are compressed already; deflate gains ~0% on them
+COMPRESSED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".avif",
+    ".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi", ".3gp",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z", ".rar", ".apk", ".jar", ".docx", ".xlsx", ".pptx",
+}
+
+# (offset, signature) of compressed formats, for files with a missing or wrong extension
+COMPRESSED_SIGNATURES = (
+    (0, b"\xff\xd8\xff"),          # JPEG
+    (0, b"\x89PNG\r\n\x1a\n"),      # PNG
+    (0, b"GIF8"),                  # GIF
+    (8, b"WEBP"),                  # WebP (RIFF container)
+    (4, b"ftyp"),                  # MP4, MOV, HEIC, 3GP
+    (0, b"\x1a\x45\xdf\xa3"),      # Matroska / WebM
+    (0, b"ID3"),                   # MP3 with ID3 tag
+    (0, b"OggS"),                  # Ogg
+    (0, b"fLaC"),                  # FLAC
+    (0, b"PK\x03\x04"),            # ZIP and ZIP based formats
+    (0, b"\x1f\x8b"),               # gzip
+    (0, b"BZh"),                   # bzip2
+    (0, b"\xfd7zXZ\x00"),           # xz
+    (0, b"\x28\xb5\x2f\xfd"),      # zstd
+    (0, b"7z\xbc\xaf\x27\x1c"),     # 7-Zip
+    (0, b"Rar!"),                  # RAR
+)
+
+def is_compressed_format(header):
+    return any(header[offset:offset + len(signature)] == signature for offset, signature in COMPRESSED_SIGNATURES)
+
+def read_samples(f, size):
+    samples = []
+    if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+        return [f.read(size)]
+    step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    for i in range(SAMPLE_COUNT):
+        f.seek(i * step)
+        samples.append(f.read(SAMPLE_SIZE))
+    return samples
+
+def choose_compression(path, size, policy=DEFAULT_COMPRESSION_POLICY):
+    """
+    (zipfile.ZIP_STORED, None) or (zipfile.ZIP_DEFLATED, level) for one file under the
+    named policy, decided from its extension, its first bytes and a trial compression.
+    """
+    settings = COMPRESSION_POLICIES.get(policy, COMPRESSION_POLICIES[DEFAULT_COMPRESSION_POLICY])
+    level = settings["level"]
+    if size < MIN_COMPRESS_SIZE:
+        return zipfile.ZIP_STORED, None
+    if settings["skip_known"] and os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        return zipfile.ZIP_STORED, None
 
-def run_zip_job_bulk(temp_zip_directory, paths, job_id, progress_store, zip_paths, cancelled_jobs):
     try:
-        create_zip_bulk_with_progress(temp_zip_directory, paths, job_id, progress_store, zip_paths, cancelled_jobs)
-    except Exception as e:
-        print(f"[Thread Error] Job {job_id}: {e}")
-        traceback.print_exc()
-        progress_store[job_id] = -1
-
-def create_zip_bulk_with_progress(temp_zip_directory, paths, job_id, progress_store, zip_paths, cancelled_jobs):
-    try:
-        # Collect all files along with their relative path inside ZIP
-        files_to_zip = []
-
-        for path in paths:
-            abs_path = os.path.abspath(path)
-            name_in_zip = os.path.basename(abs_path)  # top-level folder or file name
-            if os.path.isdir(abs_path):
-                for root, dirs, files in os.walk(abs_path):
-                    for file in files:
-                        abs_file = os.path.join(root, file)
-                        rel_path_in_zip = os.path.join(
-                            name_in_zip,
-                            os.path.relpath(abs_file, abs_path)
-                        )
-                        files_to_zip.append((abs_file, rel_path_in_zip))
-            elif os.path.isfile(abs_path):
-                files_to_zip.append((abs_path, name_in_zip))  # single file at root
-
-        total_files = len(files_to_zip)
-        progress_store[job_id] = 0
-        os.makedirs(temp_zip_directory, exist_ok=True)
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".zip", dir=temp_zip_directory) as tmp_zip:
-            with zipfile.ZipFile(tmp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for i, (abs_file, rel_path_in_zip) in enumerate(files_to_zip):
-                    if job_id in cancelled_jobs:
-                        print(f"[Zip Cancelled] Job {job_id}")
-                        progress_store[job_id] = -1
-                        cancelled_jobs.remove(job_id)
-                        progress_store.pop(job_id, None)
-                        return
-
-                    zipf.write(abs_file, arcname=rel_path_in_zip)
-                    progress_store[job_id] = int((i+1) / total_files * 100) if total_files else 100
-
-        zip_paths[job_id] = tmp_zip.name
-
-    except Exception as e:
-        print(f"Error in create_zip_bulk_with_progress: {e}")
-        traceback.print_exc()
-        progress_store[job_id] = -1
+        with open(path, "rb") as f:
+            samples = read_samples(f, size)
+    except OSError:
+        return zipfile.ZIP_DEFLATED, level
+    if settings["skip_known"] and is_compressed_format(samples[0][:16]):
+        return zipfile.ZIP_STORED, None
+
+    sampled = sum(len(sample) for sample in samples)
+    compressed = sum(len(zlib.compress(sample, level)) for sample in samples)
+    if sampled and compressed > sampled * settings["max_ratio"]:
+        return zipfile.ZIP_STORED, None
+    return zipfile.ZIP_DEFLATED, level
+
+# Archives are written under this prefix and only get their final name once complete
+PARTIAL_PREFIX = "partial-"
+
+def build_zip(temp_zip_directory, entries, policy=DEFAULT_COMPRESSION_POLICY, on_progress=None, is_cancelled=None):
+    """
+    Write the archive of `entries` (see zipStreamUtil.collect_entries) to a new file in
+    the temp directory, compressing in the process pool, and return its path.
+    on_progress gets the number of file bytes done at each step. A cancelled or failed
+    build removes its partial file and raises (ZipCancelled when cancelled).
+    """
+    os.makedirs(temp_zip_directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(delete=False, prefix=PARTIAL_PREFIX, suffix=".zip", dir=temp_zip_directory) as tmp_zip:
+        try:
+            writer = ZipStreamWriter(tmp_zip)
+            write_entries_parallel(writer, entries, lambda path, size: choose_compression(path, size, policy),
+                                   on_progress, is_cancelled)
+            writer.close()
+        except BaseException:
+            tmp_zip.close()
+            os.remove(tmp_zip.name)
+            raise
+    return tmp_zip.name